@@ -1,20 +1,124 @@
+import secrets
+import threading
+
 from flask import Flask
-from routes import inventario_routes
+from comandos import COMANDOS
+from cache import CacheLRU
+from db import BANCO_MEMORIA, CONFIG_SQLITE, abrir_conexao, criar_banco_memoria, fechar_db
+from escritor import EscritorAgrupado
+from metricas import coletor_cache, iniciar_medicao, registrar_requisicao, registro
+from migracoes import aplicar_migracoes
+from models import cache_produtos, recuperar_transferencias
+from routes import ConversorInteiro, inventario_routes
+from varredor import VarredorReservas
 from web_routes import web_routes # <-- 1. Importar as novas rotas
 
-def create_app():
-    """Cria e configura uma instância da aplicação Flask."""
+def create_app(config=None):
+    """
+    Cria e configura uma instância da aplicação Flask.
+
+    As configurações vêm, em ordem de prioridade, de `config`, das variáveis de
+    ambiente com prefixo INVENTARIO_ (ex.: INVENTARIO_SECRET_KEY, INVENTARIO_DEBUG,
+    INVENTARIO_DATABASE) e dos padrões.
+    """
     app = Flask(__name__)
-    
-    # Chave secreta necessária para usar 'flash messages'
-    app.config['SECRET_KEY'] = 'uma-chave-secreta-qualquer-para-o-projeto'
 
+    # Ajustes da conexão SQLite (journal WAL, synchronous, cache, mmap e busy timeout)
+    app.config.from_mapping(CONFIG_SQLITE)
+    app.config.from_prefixed_env('INVENTARIO')
+    app.config.update(config or {})
+
+    # Chave secreta necessária para usar 'flash messages'. Sem INVENTARIO_SECRET_KEY
+    # é gerada uma chave aleatória, que não sobrevive a reinícios nem vale entre workers
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+        if not app.testing:
+            app.logger.warning("INVENTARIO_SECRET_KEY não definida; usando uma chave temporária.")
+
+    # DATABASE = ':memory:' cria um banco em memória próprio desta aplicação,
+    # clonado de um modelo com o schema (e DATABASE_SEMENTE, se informada)
+    app.config.setdefault('DATABASE_SEMENTE', None)
+    if app.config['DATABASE'] == BANCO_MEMORIA:
+        app.config['DATABASE'], app.extensions['banco_memoria'] = criar_banco_memoria(app.config['DATABASE_SEMENTE'])
+
+    # Aplica as migrações pendentes do schema; com o banco em dia só lê o user_version
+    with app.app_context():
+        conn = abrir_conexao()
+        try:
+            app.extensions['migracoes_aplicadas'] = aplicar_migracoes(conn)
+        finally:
+            conn.close()
+
+    # Cache de leitura de produtos (quantidade máxima de itens e validade em segundos)
+    app.config.setdefault('CACHE_PRODUTOS_CAPACIDADE', 1024)
+    app.config.setdefault('CACHE_PRODUTOS_TTL', 30.0)
+    # Um cache por aplicação: outra aplicação do mesmo processo pode usar outro banco
+    app.extensions['cache_produtos'] = CacheLRU(app.config['CACHE_PRODUTOS_CAPACIDADE'], app.config['CACHE_PRODUTOS_TTL'])
+    # Intervalo (ms) entre leituras da tabela de mudanças para descartar do cache
+    # os produtos alterados por outros processos; 0 desliga (um único processo)
+    app.config.setdefault('CACHE_PRODUTOS_SINCRONIZACAO_MS', 200)
+
+    # Escrita agrupada: uma thread grava em uma só transação as operações que
+    # chegam dentro da janela (em milissegundos), em vez de um commit por operação
+    app.config.setdefault('ESCRITA_AGRUPADA', False)
+    app.config.setdefault('ESCRITA_AGRUPADA_JANELA_MS', 2)
+    app.config.setdefault('ESCRITA_AGRUPADA_MAX_OPERACOES', 500)
+    if app.config['ESCRITA_AGRUPADA']:
+        app.extensions['escritor_agrupado'] = EscritorAgrupado(
+            app, app.config['ESCRITA_AGRUPADA_JANELA_MS'] / 1000, app.config['ESCRITA_AGRUPADA_MAX_OPERACOES'])
+
+    # Fluxos SSE simultâneos por worker: cada um ocupa uma thread enquanto o
+    # cliente estiver conectado; acima do limite a API responde 503 e a página
+    # passa a usar o long-poll, que devolve a thread a cada resposta
+    app.config.setdefault('MUDANCAS_SSE_MAXIMO', 4)
+    app.extensions['fluxos_sse'] = threading.BoundedSemaphore(app.config['MUDANCAS_SSE_MAXIMO'])
+
+    # Varredura das reservas vencidas (intervalo em segundos; 0 desliga)
+    app.config.setdefault('RESERVAS_VARREDURA_SEGUNDOS', 5.0)
+    app.config.setdefault('RESERVAS_VARREDURA_LOTE', 500)
+    if app.config['RESERVAS_VARREDURA_SEGUNDOS']:
+        app.extensions['varredor_reservas'] = VarredorReservas(
+            app, app.config['RESERVAS_VARREDURA_SEGUNDOS'], app.config['RESERVAS_VARREDURA_LOTE'])
+        app.extensions['varredor_reservas'].iniciar()
+
+    # Tempo de cada requisição e estado do cache, expostos em GET /metrics
+    app.before_request(iniciar_medicao)
+    app.after_request(registrar_requisicao)
+    registro.registrar_coletor('cache_produtos', coletor_cache('cache_produtos', cache_produtos))
+
+    # Fecha a conexão reutilizada ao final de cada requisição
+    app.teardown_appcontext(fechar_db)
+
+    # Conclui ou cancela as transferências entre armazéns interrompidas por uma queda
+    with app.app_context():
+        concluidas, canceladas = recuperar_transferencias()
+    if concluidas or canceladas:
+        app.logger.warning("Transferências recuperadas: %d concluída(s), %d cancelada(s).", concluidas, canceladas)
+
+    # Comandos de manutenção (flask --app app <comando>)
+    for comando in COMANDOS:
+        app.cli.add_command(comando)
+
+    # Ids acima de 64 bits nas URLs viram 404 em vez de estourar no SQLite
+    app.url_map.converters['int'] = ConversorInteiro
     app.register_blueprint(inventario_routes) # Blueprint da API
     app.register_blueprint(web_routes) # <-- 2. Registrar o blueprint da interface web
     
     return app
 
-app = create_app()
+def encerrar_app(app, timeout=None):
+    """
+    Encerra as threads de segundo plano da aplicação: a varredura de reservas
+    e o escritor agrupado, que antes grava as operações que estiverem na fila.
+    """
+    varredor = app.extensions.get('varredor_reservas')
+    if varredor is not None:
+        varredor.encerrar(timeout)
+    escritor = app.extensions.get('escritor_agrupado')
+    if escritor is not None:
+        escritor.encerrar(timeout)
 
+# Servidor de desenvolvimento (uma única instância). Em produção use o Gunicorn:
+#   gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,285 @@
+"""
+Benchmark reprodutível da API de inventário.
+
+Cria um catálogo sintético do tamanho escolhido em um diretório temporário,
+exercita todas as rotas da API e informa, por rota, a vazão (req/s) e as
+latências p50/p95/p99. Há dois modos:
+
+- cliente: chamadas em processo pelo test client de `create_app()`;
+- http: servidor HTTP real em uma thread e várias threads clientes simultâneas.
+
+Os resultados podem ser salvos em JSON e comparados com uma execução anterior,
+apontando regressões acima da tolerância:
+
+    python benchmarks/bench_api.py --produtos 100000 --saida base.json
+    python benchmarks/bench_api.py --produtos 100000 --modo http --threads 8 \\
+        --saida atual.json --comparar base.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from dados import popular  # noqa: E402
+
+TAMANHOS = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def _produto_novo(aleatorio):
+    return {
+        "nome": f"Bench {aleatorio.randrange(10**9)}",
+        "categoria": "Benchmark",
+        "preco_unitario": round(aleatorio.uniform(1, 500), 2),
+        "quantidade_inicial": aleatorio.randint(0, 100),
+    }
+
+
+def cenarios(total_produtos):
+    """
+    Lista (nome, peso, gerador) das rotas exercitadas. O gerador recebe um
+    random.Random e devolve (método, caminho, corpo JSON ou bytes, content-type).
+    O peso multiplica o número base de requisições (rotas pesadas têm peso menor).
+    """
+    def id_aleatorio(a):
+        return a.randint(1, total_produtos)
+
+    def importacao(a):
+        linhas = [json.dumps(_produto_novo(a)) for _ in range(100)]
+        return "POST", "/produtos/importar?formato=ndjson", "\n".join(linhas).encode(), "application/x-ndjson"
+
+    def lote(a):
+        operacoes = [{"produto_id": id_aleatorio(a), "tipo": "entrada", "quantidade": 1} for _ in range(100)]
+        return "POST", "/estoque/lote", {"modo": "melhor_esforco", "operacoes": operacoes}, None
+
+    return [
+        ("GET /produtos/<id>", 1.0, lambda a: ("GET", f"/produtos/{id_aleatorio(a)}", None, None)),
+        ("GET /produtos?limit=100", 1.0, lambda a: ("GET", f"/produtos?limit=100&cursor={id_aleatorio(a)}", None, None)),
+        ("GET /produtos?nome=", 1.0, lambda a: ("GET", f"/produtos?nome=xt{a.randrange(20000)}", None, None)),
+        ("GET /produtos?categoria=&limit=50", 1.0, lambda a: ("GET", "/produtos?categoria=perif&limit=50", None, None)),
+        ("POST /produtos", 1.0, lambda a: ("POST", "/produtos", _produto_novo(a), None)),
+        ("PUT /produtos/<id>", 1.0, lambda a: ("PUT", f"/produtos/{id_aleatorio(a)}", {"preco_unitario": round(a.uniform(1, 500), 2)}, None)),
+        ("POST /produtos/<id>/estoque", 1.0, lambda a: ("POST", f"/produtos/{id_aleatorio(a)}/estoque", {"tipo": a.choice(["entrada", "saida"]), "quantidade": 1}, None)),
+        ("POST /estoque/lote (100)", 0.2, lote),
+        ("POST /produtos/importar (100)", 0.2, importacao),
+        ("GET /produtos/<id>/historico", 1.0, lambda a: ("GET", f"/produtos/{id_aleatorio(a)}/historico", None, None)),
+        ("GET /produtos/<id>/historico/saldo", 1.0, lambda a: ("GET", f"/produtos/{id_aleatorio(a)}/historico/saldo", None, None)),
+        ("GET /relatorios/estoque", 1.0, lambda a: ("GET", "/relatorios/estoque", None, None)),
+        ("GET /cache/produtos", 1.0, lambda a: ("GET", "/cache/produtos", None, None)),
+        ("DELETE /produtos/<id>", 0.2, lambda a: ("DELETE", f"/produtos/{id_aleatorio(a)}", None, None)),
+        ("GET /produtos/exportar", 0.02, lambda a: ("GET", "/produtos/exportar?formato=ndjson", None, None)),
+        ("GET /produtos?stream=1", 0.02, lambda a: ("GET", "/produtos?stream=1", None, None)),
+    ]
+
+
+def percentil(valores_ordenados, p):
+    """Percentil pelo método do posto mais próximo."""
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados)) - 1))
+    return valores_ordenados[indice]
+
+
+def resumir(latencias, erros, duracao):
+    """Monta as estatísticas de uma rota a partir das latências em segundos."""
+    ordenadas = sorted(latencias)
+    return {
+        "requisicoes": len(latencias),
+        "erros": erros,
+        "vazao_rps": round(len(latencias) / duracao, 2) if duracao else 0.0,
+        "p50_ms": round(percentil(ordenadas, 50) * 1000, 3),
+        "p95_ms": round(percentil(ordenadas, 95) * 1000, 3),
+        "p99_ms": round(percentil(ordenadas, 99) * 1000, 3),
+    }
+
+
+def executar_cliente(app, gerador, quantidade, semente):
+    """Executa as requisições em sequência pelo test client do Flask."""
+    aleatorio = random.Random(semente)
+    cliente = app.test_client()
+    latencias, erros = [], 0
+    inicio_total = time.perf_counter()
+    for _ in range(quantidade):
+        metodo, caminho, corpo, tipo = gerador(aleatorio)
+        kwargs = {"json": corpo} if isinstance(corpo, dict) else {"data": corpo, "content_type": tipo}
+        inicio = time.perf_counter()
+        resposta = cliente.open(caminho, method=metodo, **kwargs)
+        resposta.get_data()
+        latencias.append(time.perf_counter() - inicio)
+        erros += resposta.status_code >= 500
+    return latencias, erros, time.perf_counter() - inicio_total
+
+
+def executar_http(url_base, gerador, quantidade, threads, semente):
+    """Executa as requisições contra um servidor HTTP real, com várias threads clientes."""
+    def uma_requisicao(indice):
+        metodo, caminho, corpo, tipo = gerador(random.Random(semente * 1_000_003 + indice))
+        if isinstance(corpo, dict):
+            corpo, tipo = json.dumps(corpo).encode(), "application/json"
+        requisicao = urllib.request.Request(url_base + caminho, data=corpo, method=metodo)
+        if tipo:
+            requisicao.add_header("Content-Type", tipo)
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(requisicao) as resposta:
+                resposta.read()
+            erro = False
+        except urllib.error.HTTPError as e:
+            e.read()
+            erro = e.code >= 500
+        except OSError:
+            erro = True
+        return time.perf_counter() - inicio, erro
+
+    inicio_total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        resultados = list(executor.map(uma_requisicao, range(quantidade)))
+    duracao = time.perf_counter() - inicio_total
+    return [r[0] for r in resultados], sum(r[1] for r in resultados), duracao
+
+
+def _versao_git():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual, anterior, tolerancia):
+    """Retorna as regressões de p95 e vazão acima da tolerância (fração) entre duas execuções."""
+    regressoes = []
+    for rota, dados in atual["rotas"].items():
+        base = anterior.get("rotas", {}).get(rota)
+        if not base:
+            continue
+        if base["p95_ms"] and dados["p95_ms"] > base["p95_ms"] * (1 + tolerancia):
+            regressoes.append(f"{rota}: p95 {base['p95_ms']}ms -> {dados['p95_ms']}ms")
+        if base["vazao_rps"] and dados["vazao_rps"] < base["vazao_rps"] * (1 - tolerancia):
+            regressoes.append(f"{rota}: vazão {base['vazao_rps']} -> {dados['vazao_rps']} req/s")
+    return regressoes
+
+
+def executar(produtos, modo="cliente", requisicoes=200, threads=8, semente=42, filtro=None):
+    """Cria o catálogo, roda todos os cenários e retorna o relatório da execução."""
+    diretorio_original = os.getcwd()
+    pasta = tempfile.mkdtemp(prefix="bench_inventario_")
+    try:
+        # O banco é criado em um diretório temporário para não tocar no database.db do projeto
+        os.chdir(pasta)
+
+        from app import create_app
+        from db import fechar_conexao_thread, get_db
+        from models import resetar_estoque
+
+        fechar_conexao_thread()
+        resetar_estoque()
+        inicio = time.perf_counter()
+        popular(get_db(), produtos, semente)
+        carga = time.perf_counter() - inicio
+        fechar_conexao_thread()
+
+        app = create_app()
+        servidor = None
+        if modo == "http":
+            from werkzeug.serving import make_server
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            servidor = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+            url_base = f"http://127.0.0.1:{servidor.server_port}"
+
+        rotas = {}
+        try:
+            for indice, (nome, peso, gerador) in enumerate(cenarios(produtos)):
+                if filtro and filtro not in nome:
+                    continue
+                quantidade = max(1, int(requisicoes * peso))
+                if modo == "http":
+                    latencias, erros, duracao = executar_http(url_base, gerador, quantidade, threads, semente + indice)
+                else:
+                    latencias, erros, duracao = executar_cliente(app, gerador, quantidade, semente + indice)
+                rotas[nome] = resumir(latencias, erros, duracao)
+                print(f"{nome:<40}{rotas[nome]['vazao_rps']:>10.1f} req/s"
+                      f"{rotas[nome]['p50_ms']:>10.2f}{rotas[nome]['p95_ms']:>10.2f}{rotas[nome]['p99_ms']:>10.2f} ms"
+                      f"{'  erros: ' + str(erros) if erros else ''}")
+        finally:
+            if servidor:
+                servidor.shutdown()
+
+        return {
+            "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _versao_git(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "modo": modo,
+            "produtos": produtos,
+            "requisicoes_base": requisicoes,
+            "threads": threads if modo == "http" else 1,
+            "semente": semente,
+            "carga_segundos": round(carga, 2),
+            "rotas": rotas,
+        }
+    finally:
+        from db import fechar_conexao_thread
+        fechar_conexao_thread()
+        os.chdir(diretorio_original)
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def _tamanho(valor):
+    return TAMANHOS.get(valor.lower()) or int(valor)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark da API de inventário.")
+    parser.add_argument("--produtos", type=_tamanho, default=10_000, help="tamanho do catálogo (ex.: 10k, 100k, 1m ou um número)")
+    parser.add_argument("--modo", choices=("cliente", "http"), default="cliente")
+    parser.add_argument("--requisicoes", type=int, default=200, help="requisições por rota (antes do peso da rota)")
+    parser.add_argument("--threads", type=int, default=8, help="threads clientes no modo http")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--rota", help="executa apenas as rotas cujo nome contém este texto")
+    parser.add_argument("--saida", help="arquivo JSON onde salvar os resultados")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="variação aceita antes de acusar regressão (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    print(f"{'rota':<40}{'vazão':>16}{'p50':>10}{'p95':>10}{'p99':>10}")
+    relatorio = executar(args.produtos, args.modo, args.requisicoes, args.threads, args.semente, args.rota)
+
+    if args.saida:
+        with open(args.saida, "w") as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados salvos em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            anterior = json.load(f)
+        if (anterior.get("modo"), anterior.get("produtos")) != (relatorio["modo"], relatorio["produtos"]):
+            print(f"\nAtenção: comparando execuções diferentes ({anterior.get('modo')}/{anterior.get('produtos')} "
+                  f"x {relatorio['modo']}/{relatorio['produtos']}).")
+        regressoes = comparar(relatorio, anterior, args.tolerancia)
+        if regressoes:
+            print("\nRegressões detectadas:")
+            for regressao in regressoes:
+                print(f"  - {regressao}")
+            return 1
+        print("\nNenhuma regressão acima da tolerância.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
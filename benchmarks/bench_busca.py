@@ -0,0 +1,66 @@
+"""
+Compara a busca de produtos por nome/categoria via FTS5 com o LIKE '%termo%'.
+
+Cria um banco temporário com N produtos sintéticos (padrão: 1 milhão) e mede,
+para cada termo, o tempo médio das duas consultas geradas por
+`montar_consulta_produtos`:
+
+    python benchmarks/bench_busca.py
+    python benchmarks/bench_busca.py --produtos 100000 --repeticoes 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from db import abrir_conexao  # noqa: E402
+from migracoes import aplicar_migracoes  # noqa: E402
+from models import montar_consulta_produtos  # noqa: E402
+from dados import popular  # noqa: E402
+
+TERMOS = [
+    ("nome", "cadeira"), ("nome", "cad"), ("nome", "gamer pro"), ("nome", "xt1234"),
+    ("nome", "xt999"), ("categoria", "perif"), ("nome", "inexistente"),
+]
+
+
+def medir(conn, query, params, repeticoes):
+    """Retorna (tempo médio em ms, quantidade de linhas) da consulta."""
+    linhas = 0
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        linhas = len(conn.execute(query, params).fetchall())
+    return (time.perf_counter() - inicio) * 1000 / repeticoes, linhas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark da busca FTS5 x LIKE.")
+    parser.add_argument("--produtos", type=int, default=1_000_000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--limite", type=int, default=50, help="limite de resultados por busca (0 = sem limite)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        conn = abrir_conexao(os.path.join(pasta, "bench.db"))
+        aplicar_migracoes(conn)
+
+        inicio = time.perf_counter()
+        popular(conn, args.produtos)
+        print(f"{args.produtos} produtos inseridos em {time.perf_counter() - inicio:.1f}s\n")
+
+        limite = args.limite or None
+        print(f"{'filtro':<24}{'LIKE (ms)':>12}{'FTS5 (ms)':>12}{'linhas LIKE/FTS':>20}")
+        for coluna, termo in TERMOS:
+            filtros = {coluna: termo, "limite": limite}
+            like_ms, like_linhas = medir(conn, *montar_consulta_produtos(**filtros, usar_fts=False), args.repeticoes)
+            fts_ms, fts_linhas = medir(conn, *montar_consulta_produtos(**filtros, usar_fts=True), args.repeticoes)
+            print(f"{coluna + '=' + termo:<24}{like_ms:>12.2f}{fts_ms:>12.2f}{f'{like_linhas}/{fts_linhas}':>20}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
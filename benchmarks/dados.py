@@ -0,0 +1,42 @@
+"""Geração de catálogos sintéticos para os benchmarks."""
+import random
+
+PALAVRAS = [
+    "cadeira", "mesa", "monitor", "teclado", "mouse", "notebook", "cabo", "fone",
+    "gamer", "sem", "fio", "usb", "hdmi", "ergonomica", "mecanico", "pro", "ultra",
+    "preto", "branco", "azul", "compacto", "portatil", "digital", "smart",
+]
+CATEGORIAS = ["Móveis", "Periféricos", "Monitores", "Áudio", "Cabos", "Informática", "Acessórios"]
+# Modelos sintéticos dão ao catálogo um vocabulário grande, com termos seletivos
+MODELOS = 20000
+
+
+def gerar_produtos(total, semente=42):
+    """Gera `total` tuplas (nome, categoria, preco_unitario, quantidade) reprodutíveis."""
+    aleatorio = random.Random(semente)
+    for _ in range(total):
+        nome = " ".join(aleatorio.choice(PALAVRAS) for _ in range(3)) + f" XT{aleatorio.randrange(MODELOS)}"
+        yield nome, aleatorio.choice(CATEGORIAS), round(aleatorio.uniform(1, 5000), 2), aleatorio.randint(0, 500)
+
+
+def popular(conn, total, semente=42, tamanho_lote=50000):
+    """Insere `total` produtos sintéticos (com o estoque inicial no histórico) em lotes."""
+    lote = []
+    for produto in gerar_produtos(total, semente):
+        lote.append(produto)
+        if len(lote) == tamanho_lote:
+            _inserir(conn, lote)
+            lote = []
+    if lote:
+        _inserir(conn, lote)
+
+
+def _inserir(conn, lote):
+    with conn:
+        conn.executemany('INSERT INTO produtos (nome, categoria, preco_unitario, quantidade) VALUES (?, ?, ?, ?)', lote)
+        ultimo_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        conn.execute(
+            "INSERT INTO movimentacoes (produto_id, tipo, quantidade) "
+            "SELECT id, 'inicial', quantidade FROM produtos WHERE id BETWEEN ? AND ?",
+            (ultimo_id - len(lote) + 1, ultimo_id)
+        )
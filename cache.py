@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache em memória, limitado por capacidade (LRU) e por tempo de vida (TTL).
+
+    Toda invalidação incrementa uma versão interna; `guardar` só aceita valores
+    lidos antes da última invalidação se a versão informada ainda for a atual,
+    evitando que uma leitura lenta recoloque no cache um dado já alterado.
+    """
+
+    def __init__(self, capacidade=1024, ttl=30.0):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._versao = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    def configurar(self, capacidade=None, ttl=None):
+        """Ajusta capacidade e TTL, descartando o conteúdo atual."""
+        with self._lock:
+            if capacidade is not None:
+                self.capacidade = capacidade
+            if ttl is not None:
+                self.ttl = ttl
+            self._itens.clear()
+            self._versao += 1
+
+    def versao(self):
+        """Retorna a versão atual, a ser passada para `guardar` após a leitura."""
+        return self._versao
+
+    def obter(self, chave):
+        """Retorna o valor em cache ou None, contabilizando acertos e falhas."""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[1] > time.monotonic():
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return item[0]
+            if item is not None:
+                del self._itens[chave]
+            self.falhas += 1
+            return None
+
+    def guardar(self, chave, valor, versao=None):
+        """Guarda um valor; ignora se houve invalidação desde `versao`."""
+        if self.capacidade <= 0:
+            return
+        with self._lock:
+            if versao is not None and versao != self._versao:
+                return
+            self._itens[chave] = (valor, time.monotonic() + self.ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, *chaves):
+        """Remove as chaves informadas do cache."""
+        with self._lock:
+            self._versao += 1
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def limpar(self):
+        """Remove todos os itens do cache."""
+        with self._lock:
+            self._versao += 1
+            self._itens.clear()
+
+    def estatisticas(self):
+        """Retorna tamanho, capacidade e contadores de acerto/falha."""
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                "itens": len(self._itens),
+                "capacidade": self.capacidade,
+                "ttl": self.ttl,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": round(self.acertos / total, 4) if total else 0.0,
+            }
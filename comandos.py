@@ -0,0 +1,45 @@
+"""
+Comandos de manutenção do banco, disponíveis pela CLI do Flask:
+
+    flask --app app reconstruir-busca
+    flask --app app verificar-resumo [--corrigir]
+    flask --app app recuperar-transferencias [--idade-minima SEGUNDOS]
+"""
+import click
+
+from models import IDADE_MINIMA_RECUPERACAO, reconstruir_indice_busca, recuperar_transferencias, verificar_resumo_estoque
+
+
+@click.command("reconstruir-busca")
+def reconstruir_busca_comando():
+    """Reconstrói o índice de busca textual (FTS5) dos produtos."""
+    reconstruir_indice_busca()
+    click.echo("Índice de busca reconstruído com sucesso!")
+
+
+@click.command("verificar-resumo")
+@click.option("--corrigir", is_flag=True, help="Reconstrói o resumo caso haja divergências.")
+def verificar_resumo_comando(corrigir):
+    """Confere o resumo de estoque por categoria contra a tabela de produtos."""
+    divergencias = verificar_resumo_estoque(corrigir=corrigir)
+    if not divergencias:
+        click.echo("Resumo de estoque consistente.")
+        return
+    for d in divergencias:
+        click.echo(f"Divergência na categoria '{d['categoria']}': esperado {d['esperado']}, atual {d['atual']}")
+    if corrigir:
+        click.echo("Resumo de estoque reconstruído a partir dos produtos.")
+    else:
+        raise SystemExit(1)
+
+
+@click.command("recuperar-transferencias")
+@click.option("--idade-minima", default=IDADE_MINIMA_RECUPERACAO, show_default=True,
+              help="Só trata as transferências pendentes há mais segundos que isto.")
+def recuperar_transferencias_comando(idade_minima):
+    """Conclui ou cancela as transferências entre armazéns interrompidas no meio."""
+    concluidas, canceladas = recuperar_transferencias(idade_minima)
+    click.echo(f"Transferências concluídas: {concluidas}; canceladas: {canceladas}.")
+
+
+COMANDOS = [reconstruir_busca_comando, verificar_resumo_comando, recuperar_transferencias_comando]
@@ -0,0 +1,338 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from functools import lru_cache
+
+from flask import current_app, g, has_app_context
+
+from metricas import consultas_lentas, duracao_sql, linhas_sql
+from migracoes import aplicar_migracoes
+
+DATABASE = 'database.db'
+# Valor de DATABASE que cria um banco em memória isolado para a aplicação
+BANCO_MEMORIA = ':memory:'
+
+# Configurações padrão da conexão SQLite (podem ser sobrescritas em app.config)
+CONFIG_SQLITE = {
+    'DATABASE': DATABASE,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE': -16000,        # valor negativo = tamanho em KiB (16 MB)
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_CACHED_STATEMENTS': 256,    # cache de comandos preparados por conexão
+    'SQLITE_METRICAS': True,            # mede tempo e linhas de cada comando (/metrics)
+    'SQLITE_LIMITE_CONSULTA_LENTA_MS': 100,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,     # espera pelo lock de escrita de outro processo
+    'SQLITE_TENTATIVAS_ESCRITA': 3,     # tentativas de cada escrita se o banco seguir ocupado
+}
+
+_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+_SYNCHRONOUS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+# Conexões reutilizadas fora de um contexto Flask (scripts, testes, threads)
+_local = threading.local()
+
+logger_sql = logging.getLogger('inventario.sql')
+
+# Bancos modelo (schema + semente) já montados, por função de semente
+_modelos = {}
+_lock_modelos = threading.Lock()
+# Conexões âncora dos bancos em memória, por uri (mantêm os bancos vivos)
+_ancoras = weakref.WeakValueDictionary()
+
+# Tabelas de cada armazém, criadas no arquivo próprio do armazém ao anexá-lo.
+# O resumo (produtos e unidades) é mantido por triggers, como resumo_categorias.
+# Tudo é idempotente: arquivos criados por versões anteriores ganham só o que falta.
+SCHEMA_ARMAZEM = """
+CREATE TABLE IF NOT EXISTS {esquema}.estoque (
+    produto_id INTEGER PRIMARY KEY,
+    quantidade INTEGER NOT NULL DEFAULT 0 CHECK (quantidade >= 0),
+    atualizado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS {esquema}.movimentacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    produto_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    quantidade INTEGER NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+CREATE INDEX IF NOT EXISTS {esquema}.idx_movimentacoes_produto ON movimentacoes (produto_id, id);
+CREATE TABLE IF NOT EXISTS {esquema}.resumo (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_produtos INTEGER NOT NULL,
+    total_unidades INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO {esquema}.resumo (id, total_produtos, total_unidades) VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS {esquema}.resumo_insert AFTER INSERT ON estoque BEGIN
+    UPDATE resumo SET total_produtos = total_produtos + 1, total_unidades = total_unidades + new.quantidade;
+END;
+CREATE TRIGGER IF NOT EXISTS {esquema}.resumo_delete AFTER DELETE ON estoque BEGIN
+    UPDATE resumo SET total_produtos = total_produtos - 1, total_unidades = total_unidades - old.quantidade;
+END;
+CREATE TRIGGER IF NOT EXISTS {esquema}.resumo_update AFTER UPDATE OF quantidade ON estoque BEGIN
+    UPDATE resumo SET total_unidades = total_unidades - old.quantidade + new.quantidade;
+END;
+CREATE TABLE IF NOT EXISTS {esquema}.transferencias_etapas (
+    transferencia_id INTEGER NOT NULL,
+    etapa TEXT NOT NULL CHECK (etapa IN ('saida', 'entrada')),
+    aplicada INTEGER NOT NULL,
+    PRIMARY KEY (transferencia_id, etapa)
+) WITHOUT ROWID;
+"""
+
+
+class Conexao(sqlite3.Connection):
+    """Conexão SQLite usada pela aplicação."""
+
+    caminho = None
+    journal_mode = 'WAL'
+    synchronous = 'NORMAL'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Códigos dos armazéns cujos arquivos já estão anexados a esta conexão
+        self.armazens_anexados = set()
+
+
+@lru_cache(maxsize=1024)
+def _classificar_comando(sql):
+    """Extrai (operação, tabela principal) de um comando SQL, usados como rótulos das métricas."""
+    operacao = re.match(r'\s*(\w+)', sql)
+    tabela = re.search(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', sql, re.IGNORECASE)
+    return (operacao.group(1).upper() if operacao else 'OUTRO'), (tabela.group(1).lower() if tabela else '')
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """Cursor que contabiliza as linhas lidas nos fetch*."""
+
+    rotulos = None
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        super().execute(sql, parametros)
+        self.connection._registrar_comando(sql, time.perf_counter() - inicio, self)
+        return self
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        super().executemany(sql, parametros)
+        self.connection._registrar_comando(sql, time.perf_counter() - inicio, self)
+        return self
+
+    def fetchone(self):
+        linha = super().fetchone()
+        if linha is not None and self.rotulos:
+            linhas_sql.incrementar(*self.rotulos)
+        return linha
+
+    def fetchmany(self, *args, **kwargs):
+        linhas = super().fetchmany(*args, **kwargs)
+        if linhas and self.rotulos:
+            linhas_sql.incrementar(*self.rotulos, valor=len(linhas))
+        return linhas
+
+    def fetchall(self):
+        linhas = super().fetchall()
+        if linhas and self.rotulos:
+            linhas_sql.incrementar(*self.rotulos, valor=len(linhas))
+        return linhas
+
+
+class ConexaoInstrumentada(Conexao):
+    """
+    Conexão que mede a latência de cada comando, conta as linhas afetadas ou
+    lidas e registra no log os comandos acima do limite de consulta lenta.
+    """
+
+    limite_consulta_lenta = 0.1
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    # Connection.execute não passa por cursor(); o atalho é refeito aqui para medir
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def _registrar_comando(self, sql, duracao, cursor):
+        rotulos = _classificar_comando(sql)
+        duracao_sql.observar(duracao, *rotulos)
+        if rotulos[0] in ('SELECT', 'WITH', 'PRAGMA'):
+            # Em leituras as linhas são contadas à medida que o cursor é consumido
+            cursor.rotulos = rotulos
+        elif cursor.rowcount > 0:
+            linhas_sql.incrementar(*rotulos, valor=cursor.rowcount)
+        if duracao >= self.limite_consulta_lenta:
+            consultas_lentas.incrementar(*rotulos)
+            logger_sql.warning("Consulta lenta (%.1f ms): %s", duracao * 1000, ' '.join(sql.split()))
+
+
+def _config():
+    """Retorna as configurações da conexão, priorizando as da aplicação."""
+    config = dict(CONFIG_SQLITE)
+    if has_app_context():
+        config.update({chave: current_app.config[chave]
+                       for chave in CONFIG_SQLITE if chave in current_app.config})
+    return config
+
+
+
+def _banco_modelo(semente=None):
+    """Retorna o banco modelo com as migrações e a semente aplicadas, montado uma vez por processo."""
+    modelo = _modelos.get(semente)
+    if modelo is None:
+        modelo = sqlite3.connect(':memory:', check_same_thread=False)
+        aplicar_migracoes(modelo)
+        if semente is not None:
+            semente(modelo)
+            modelo.commit()
+        _modelos[semente] = modelo
+    return modelo
+
+
+def criar_banco_memoria(semente=None):
+    """
+    Cria um banco em memória isolado, copiado do banco modelo com a API de backup.
+
+    `semente(conn)` opcional grava dados iniciais no modelo. Retorna (uri,
+    conexão âncora): o banco existe enquanto a âncora estiver aberta e pode ser
+    aberto por outras conexões do mesmo processo pela uri (VFS memdb).
+    """
+    uri = f'file:/inventario-{uuid.uuid4().hex}?vfs=memdb'
+    ancora = sqlite3.connect(uri, uri=True, factory=Conexao, check_same_thread=False)
+    ancora.caminho = uri
+    with _lock_modelos:
+        _banco_modelo(semente).backup(ancora)
+    _ancoras[uri] = ancora
+    return uri, ancora
+
+
+def caminho_armazem(caminho_principal, codigo):
+    """
+    Retorna o arquivo do armazém `codigo`, ao lado do banco principal
+    (database.db -> database-armazem-<codigo>.db; bancos em memória ganham outra uri).
+    """
+    if caminho_principal.startswith('file:'):
+        nome, _, parametros = caminho_principal.partition('?')
+        return f'{nome}-armazem-{codigo}?{parametros}'
+    base, extensao = os.path.splitext(caminho_principal)
+    return f'{base}-armazem-{codigo}{extensao or ".db"}'
+
+
+def _anexar(conn, codigo):
+    esquema = f'armazem_{codigo}'
+    conn.execute(f'ATTACH DATABASE ? AS {esquema}', (caminho_armazem(conn.caminho, codigo),))
+    conn.execute(f'PRAGMA {esquema}.journal_mode = {conn.journal_mode}')
+    conn.execute(f'PRAGMA {esquema}.synchronous = {conn.synchronous}')
+    # Só cria as tabelas quando falta a última do schema, para não abrir uma escrita a cada conexão
+    if conn.execute(f"SELECT 1 FROM {esquema}.sqlite_master WHERE name = 'transferencias_etapas'").fetchone() is None:
+        conn.executescript(SCHEMA_ARMAZEM.format(esquema=esquema))
+    conn.armazens_anexados.add(codigo)
+
+
+def anexar_armazens(conn, codigos):
+    """
+    Anexa à conexão os arquivos dos armazéns informados que ainda não estejam
+    anexados (esquema `armazem_<codigo>`), criando as tabelas se preciso.
+    Deve ser chamada fora de transação: o SQLite não aceita ATTACH dentro de uma.
+    """
+    for codigo in codigos:
+        if codigo in conn.armazens_anexados:
+            continue
+        # Bancos em memória deixam de existir quando a última conexão fecha:
+        # a âncora do banco principal também anexa o armazém para mantê-lo vivo
+        ancora = _ancoras.get(conn.caminho)
+        if ancora is not None:
+            with _lock_modelos:
+                if codigo not in ancora.armazens_anexados:
+                    _anexar(ancora, codigo)
+        _anexar(conn, codigo)
+
+
+def desanexar_armazens(conn):
+    """Desanexa da conexão todos os arquivos de armazéns. Também deve ser chamada fora de transação."""
+    for codigo in list(conn.armazens_anexados):
+        conn.execute(f'DETACH DATABASE armazem_{codigo}')
+        conn.armazens_anexados.discard(codigo)
+
+
+def limite_armazens(conn):
+    """
+    Quantidade máxima de armazéns com arquivo próprio. Operações como remover
+    um produto anexam todos de uma vez, então o total fica abaixo do limite de
+    bancos anexados do SQLite (SQLITE_LIMIT_ATTACHED), com um anexo livre.
+    """
+    return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - 1
+
+
+def abrir_conexao(caminho=None):
+    """
+    Abre uma nova conexão já com as pragmas de desempenho aplicadas.
+    Sem `caminho`, usa o banco configurado em DATABASE.
+    """
+    config = _config()
+    caminho = caminho or config['DATABASE']
+    journal_mode = str(config['SQLITE_JOURNAL_MODE']).upper()
+    synchronous = str(config['SQLITE_SYNCHRONOUS']).upper()
+    if journal_mode not in _JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE inválido: {journal_mode}")
+    if synchronous not in _SYNCHRONOUS:
+        raise ValueError(f"SQLITE_SYNCHRONOUS inválido: {synchronous}")
+
+    conn = sqlite3.connect(
+        caminho,
+        uri=caminho.startswith('file:'),
+        timeout=float(config['SQLITE_BUSY_TIMEOUT_MS']) / 1000,
+        factory=ConexaoInstrumentada if config['SQLITE_METRICAS'] else Conexao,
+        cached_statements=int(config['SQLITE_CACHED_STATEMENTS']),
+    )
+    if config['SQLITE_METRICAS']:
+        conn.limite_consulta_lenta = float(config['SQLITE_LIMITE_CONSULTA_LENTA_MS']) / 1000
+    conn.caminho, conn.journal_mode, conn.synchronous = caminho, journal_mode, synchronous
+    # Retorna as linhas como dicionários em vez de tuplas
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+    conn.execute(f'PRAGMA synchronous = {synchronous}')
+    conn.execute(f'PRAGMA cache_size = {int(config["SQLITE_CACHE_SIZE"])}')
+    conn.execute(f'PRAGMA mmap_size = {int(config["SQLITE_MMAP_SIZE"])}')
+    return conn
+
+
+def get_db():
+    """
+    Retorna a conexão reutilizável do contexto atual.
+
+    Dentro de uma requisição a conexão fica em `flask.g` e é fechada no
+    teardown; fora dela (scripts e testes) é mantida uma conexão por thread.
+    """
+    if has_app_context():
+        if 'db' not in g:
+            g.db = abrir_conexao()
+        return g.db
+
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = abrir_conexao()
+    return conn
+
+
+def fechar_db(exc=None):
+    """Fecha a conexão da requisição (registrado como teardown do app)."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
+
+def fechar_conexao_thread():
+    """Fecha a conexão reutilizada pela thread atual fora do contexto Flask."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
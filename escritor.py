@@ -0,0 +1,143 @@
+"""
+Escritor único com commit em grupo (group commit).
+
+Com muitas operações de estoque simultâneas, cada uma disputando o lock de
+escrita do SQLite e fazendo o próprio commit, a vazão despenca. No modo de
+escrita agrupada as operações de `models.py` são enfileiradas para uma thread
+dedicada, que junta tudo o que chega dentro de uma janela curta em uma única
+transação. Cada operação roda em um SAVEPOINT próprio, então a falha de uma
+não desfaz as demais; quem chamou espera o próprio resultado em um Future.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from db import abrir_conexao, anexar_armazens, desanexar_armazens
+from metricas import registro
+
+logger = logging.getLogger('inventario.escritor')
+
+tamanho_grupos = registro.histograma(
+    'escrita_agrupada_operacoes', 'Operações gravadas em cada transação do escritor agrupado.',
+    limites=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+class EscritorAgrupado:
+    """Thread única de escrita que agrupa operações em transações compartilhadas."""
+
+    def __init__(self, app, janela=0.002, max_operacoes=500):
+        self.app = app
+        self.janela = janela
+        self.max_operacoes = max_operacoes
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def executar(self, operacao, armazens=(), escreve_principal=True):
+        """
+        Enfileira `operacao(conn)` e bloqueia até o commit do grupo em que ela entrou.
+        `armazens` lista os armazéns que a operação usa, anexados antes da transação;
+        com `escreve_principal=False` ela só grava nesses arquivos.
+        """
+        futuro = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar_laco, name='escritor-agrupado', daemon=True)
+                self._thread.start()
+            self._fila.put((operacao, futuro, armazens, escreve_principal))
+        return futuro.result()
+
+    def encerrar(self, timeout=None):
+        """Grava o que já estiver na fila e encerra a thread de escrita."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._fila.put(None)
+        thread.join(timeout)
+
+    def _executar_laco(self):
+        # A conexão é aberta com as configurações da aplicação e usada só por esta thread
+        try:
+            with self.app.app_context():
+                conn = abrir_conexao()
+        except BaseException as e:
+            self._falhar_pendentes(e)
+            return
+        try:
+            encerrar = False
+            while not encerrar:
+                item = self._fila.get()
+                if item is None:
+                    break
+                grupo = [item]
+                prazo = time.monotonic() + self.janela
+                while len(grupo) < self.max_operacoes:
+                    restante = prazo - time.monotonic()
+                    try:
+                        item = self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        encerrar = True
+                        break
+                    grupo.append(item)
+                self._gravar_grupo(conn, grupo)
+        finally:
+            conn.close()
+
+    def _falhar_pendentes(self, erro):
+        """
+        Sem conexão a thread termina: as operações na fila recebem o erro em vez
+        de esperarem para sempre, e a próxima chamada de `executar` cria outra thread.
+        """
+        with self._lock:
+            if self._thread is threading.current_thread():
+                self._thread = None
+            while True:
+                try:
+                    item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[1].set_exception(erro)
+
+    def _gravar_grupo(self, conn, grupo):
+        concluidas = []
+        try:
+            anexar_armazens(conn, {codigo for _, _, armazens, _ in grupo for codigo in armazens})
+            # BEGIN explícito: fora de uma transação o RELEASE do savepoint já faria o commit.
+            # IMMEDIATE trava todos os bancos anexados, então só é usado se alguém grava no principal
+            principal = any(escreve_principal for _, _, _, escreve_principal in grupo)
+            conn.execute('BEGIN IMMEDIATE' if principal else 'BEGIN')
+            for operacao, futuro, _, _ in grupo:
+                conn.execute('SAVEPOINT operacao')
+                try:
+                    resultado = operacao(conn)
+                except BaseException as e:
+                    conn.execute('ROLLBACK TO operacao')
+                    conn.execute('RELEASE operacao')
+                    futuro.set_exception(e)
+                else:
+                    conn.execute('RELEASE operacao')
+                    concluidas.append((futuro, resultado))
+            conn.commit()
+        except BaseException as e:
+            # Falha no commit (ou na própria transação): nenhuma operação do grupo foi gravada
+            conn.rollback()
+            for _, futuro, _, _ in grupo:
+                if not futuro.done():
+                    futuro.set_exception(e)
+        else:
+            tamanho_grupos.observar(len(grupo))
+            for futuro, resultado in concluidas:
+                futuro.set_result(resultado)
+        # A conexão é longa: sem desanexar, o próximo BEGIN IMMEDIATE travaria todos os
+        # armazéns já usados por algum grupo, e os anexos chegariam ao limite do SQLite
+        try:
+            desanexar_armazens(conn)
+        except sqlite3.Error:
+            logger.exception("Falha ao desanexar os armazéns da conexão do escritor")
@@ -0,0 +1,38 @@
+"""
+Configuração do Gunicorn para produção:
+
+    INVENTARIO_SECRET_KEY=... gunicorn -c gunicorn.conf.py wsgi:app
+
+Cada worker é um processo com a própria aplicação, conexões e threads
+(escritor agrupado, varredura de reservas); dentro dele, `threads` requisições
+são atendidas ao mesmo tempo. Os processos compartilham o banco SQLite em modo
+WAL, esperando o lock de escrita pelo busy timeout.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('INVENTARIO_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('INVENTARIO_WORKERS', multiprocessing.cpu_count()))
+# gthread: as conexões de streaming (SSE, long-poll, exportação) ocupam uma thread, não o worker inteiro;
+# o limite de fluxos SSE abaixo impede que elas tomem todas as threads
+worker_class = 'gthread'
+threads = int(os.environ.get('INVENTARIO_THREADS', 8))
+# Cada fluxo SSE prende uma thread enquanto o cliente estiver conectado: limita os
+# fluxos a metade das threads, para sobrar vaga às demais requisições do worker
+os.environ.setdefault('INVENTARIO_MUDANCAS_SSE_MAXIMO', str(max(1, threads // 2)))
+# No SIGTERM cada worker para de aceitar conexões e tem este prazo para terminar as em andamento
+graceful_timeout = int(os.environ.get('INVENTARIO_PRAZO_ENCERRAMENTO', 30))
+keepalive = 5
+accesslog = '-'
+
+# A aplicação é criada em cada worker, depois do fork: conexões SQLite e
+# threads não podem ser herdadas do processo mestre
+preload_app = False
+
+
+def worker_exit(server, worker):
+    """Encerra as threads da aplicação do worker, gravando as escritas ainda na fila."""
+    from app import encerrar_app
+    app = getattr(worker, 'wsgi', None)
+    if app is not None:
+        encerrar_app(app, timeout=graceful_timeout)
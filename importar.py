@@ -0,0 +1,160 @@
+"""
+Importação em massa de produtos a partir de arquivos CSV ou NDJSON.
+
+O arquivo é lido em fluxo, linha a linha, e os produtos válidos são gravados
+em lotes de tamanho fixo; assim o uso de memória não depende do tamanho do
+arquivo. Pode ser usado pela API (POST /produtos/importar) ou pela linha de
+comando:
+
+    python importar.py catalogo.csv
+    python importar.py catalogo.ndjson --formato ndjson --lote 10000
+
+A linha de comando usa o banco configurado para a aplicação (INVENTARIO_DATABASE).
+"""
+import argparse
+import codecs
+import csv
+import json
+import sys
+
+from models import validar_produto, inserir_produtos_lote
+
+FORMATOS = ("csv", "ndjson")
+TAMANHO_LOTE = 5000
+# Limite de erros detalhados no relatório (os demais são apenas contados)
+MAX_ERROS_RELATADOS = 1000
+
+
+def _converter_numero(valor, tipo):
+    """Converte o texto de uma célula CSV; mantém o valor original se não for numérico."""
+    try:
+        return tipo(valor.strip().replace(',', '.') if tipo is float else valor.strip())
+    except (AttributeError, ValueError):
+        return valor
+
+
+def _linhas_csv(arquivo):
+    """Gera (número da linha, dados) para cada registro de um CSV com cabeçalho."""
+    leitor = csv.DictReader(arquivo)
+    for registro in leitor:
+        dados = {chave: valor for chave, valor in registro.items() if chave is not None and valor is not None}
+        if "preco_unitario" in dados:
+            dados["preco_unitario"] = _converter_numero(dados["preco_unitario"], float)
+        if "quantidade_inicial" in dados:
+            dados["quantidade_inicial"] = _converter_numero(dados["quantidade_inicial"], int)
+        if dados.get("estoque_minimo"):
+            dados["estoque_minimo"] = _converter_numero(dados["estoque_minimo"], int)
+        else:
+            dados.pop("estoque_minimo", None)
+        yield leitor.line_num, dados
+
+
+def _linhas_ndjson(arquivo):
+    """Gera (número da linha, dados) para cada objeto JSON do arquivo; ignora linhas em branco."""
+    for numero, linha in enumerate(arquivo, start=1):
+        if not linha.strip():
+            continue
+        try:
+            dados = json.loads(linha)
+        except ValueError:
+            dados = None
+        yield numero, dados
+
+
+def importar_produtos(arquivo, formato="csv", tamanho_lote=TAMANHO_LOTE):
+    """
+    Importa produtos de um arquivo de texto já aberto.
+
+    Cada linha passa pelas mesmas validações de `criar_produto`; as válidas são
+    inseridas em transações de até `tamanho_lote` produtos e as inválidas são
+    relatadas com o número da linha. Retorna um resumo da importação; uma linha
+    que não é UTF-8 interrompe a importação e o resumo ganha 'erro' e 'linha'.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato}. Use 'csv' ou 'ndjson'.")
+
+    # Linhas lidas do arquivo, para apontar a linha de um erro de codificação
+    lidas = 0
+    def contar_linhas():
+        nonlocal lidas
+        for linha in arquivo:
+            lidas += 1
+            yield linha
+
+    fonte = contar_linhas()
+    linhas = _linhas_csv(fonte) if formato == "csv" else _linhas_ndjson(fonte)
+    resumo = {"importados": 0, "rejeitados": 0, "erros": []}
+    lote = []
+
+    try:
+        for numero, dados in linhas:
+            if not isinstance(dados, dict):
+                valores, erro = None, "Linha não contém um objeto JSON válido."
+            else:
+                valores, erro = validar_produto(dados)
+
+            if erro:
+                resumo["rejeitados"] += 1
+                if len(resumo["erros"]) < MAX_ERROS_RELATADOS:
+                    resumo["erros"].append({"linha": numero, "erro": erro})
+                continue
+
+            lote.append(valores)
+            if len(lote) >= tamanho_lote:
+                resumo["importados"] += inserir_produtos_lote(lote)
+                lote = []
+    except UnicodeDecodeError:
+        # Os lotes anteriores já foram gravados: as linhas válidas antes da inválida
+        # também são, para a importação poder ser retomada a partir dela
+        resumo["linha"] = lidas + 1
+        resumo["erro"] = f"Linha {lidas + 1} não é texto UTF-8 válido; importação interrompida."
+
+    if lote:
+        resumo["importados"] += inserir_produtos_lote(lote)
+    return resumo
+
+
+def abrir_texto(fluxo_binario):
+    """
+    Lê um fluxo binário (upload ou arquivo) como linhas de texto UTF-8. Cada
+    linha é decodificada separadamente, então um UnicodeDecodeError acontece
+    exatamente na linha inválida, e não em um bloco lido adiante.
+    """
+    for numero, linha in enumerate(fluxo_binario):
+        if numero == 0 and linha.startswith(codecs.BOM_UTF8):
+            linha = linha[len(codecs.BOM_UTF8):]
+        yield linha.decode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa produtos de um arquivo CSV ou NDJSON.")
+    parser.add_argument("arquivo", help="caminho do arquivo a importar")
+    parser.add_argument("--formato", choices=FORMATOS, help="formato do arquivo (padrão: pela extensão)")
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE, help="produtos por transação")
+    args = parser.parse_args(argv)
+
+    formato = args.formato or ("ndjson" if args.arquivo.endswith((".ndjson", ".jsonl")) else "csv")
+    # Mesmo banco e migrações da aplicação (INVENTARIO_DATABASE etc.); importado aqui
+    # porque app -> routes -> importar
+    from app import create_app, encerrar_app
+    app = create_app()
+    try:
+        with app.app_context(), open(args.arquivo, "rb") as f:
+            resumo = importar_produtos(abrir_texto(f), formato, args.lote)
+    finally:
+        encerrar_app(app)
+
+    for erro in resumo["erros"]:
+        print(f"Linha {erro['linha']}: {erro['erro']}", file=sys.stderr)
+    if "erro" in resumo:
+        print(resumo["erro"], file=sys.stderr)
+        print(f"Importação interrompida: {resumo['importados']} produto(s) importado(s), "
+              f"{resumo['rejeitados']} linha(s) rejeitada(s) antes da linha {resumo['linha']}.")
+        return 1
+    print(f"Importação concluída: {resumo['importados']} produto(s) importado(s), "
+          f"{resumo['rejeitados']} linha(s) rejeitada(s).")
+    return 0 if resumo["rejeitados"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,16 @@
+from app import create_app, encerrar_app
+from db import get_db
+from migracoes import versao_banco
 
-# Conecta ao banco de dados (cria o arquivo se não existir)
-connection = sqlite3.connect('database.db')
+# A aplicação cria o banco configurado (INVENTARIO_DATABASE, padrão database.db)
+# ou aplica as migrações pendentes, sem apagar os dados existentes
+app = create_app()
+with app.app_context():
+    versao = versao_banco(get_db())
+encerrar_app(app)
 
-# Abre o arquivo com o schema SQL
-with open('schema.sql') as f:
-    connection.executescript(f.read())
-
-connection.commit()
-connection.close()
-
-print("Banco de dados inicializado com sucesso!")
\ No newline at end of file
+aplicadas = app.extensions['migracoes_aplicadas']
+if aplicadas:
+    print(f"Banco de dados atualizado para a versão {versao} (migrações aplicadas: {aplicadas}).")
+else:
+    print(f"Banco de dados já está na versão {versao}.")
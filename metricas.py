@@ -0,0 +1,148 @@
+"""
+Métricas de desempenho da aplicação no formato texto do Prometheus.
+
+Contadores e histogramas ficam em memória, protegidos por lock, e são
+renderizados sob demanda pela rota /metrics. O custo por observação é uma
+busca binária nos limites do histograma e algumas somas.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+
+LIMITES_PADRAO = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Contador:
+    """Contador monotônico, opcionalmente separado por rótulos."""
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores_rotulos, valor=1):
+        with self._lock:
+            self._valores[valores_rotulos] = self._valores.get(valores_rotulos, 0) + valor
+
+    def renderizar(self):
+        linhas = [f'# HELP {self.nome} {self.descricao}', f'# TYPE {self.nome} counter']
+        with self._lock:
+            for rotulos, valor in sorted(self._valores.items()):
+                linhas.append(f'{self.nome}{_formatar_rotulos(self.rotulos, rotulos)} {valor}')
+        return linhas
+
+
+class Histograma:
+    """Histograma com limites fixos (em segundos), separado por rótulos."""
+
+    def __init__(self, nome, descricao, rotulos=(), limites=LIMITES_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(limites)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_rotulos):
+        indice = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            if serie is None:
+                serie = self._series[valores_rotulos] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def renderizar(self):
+        linhas = [f'# HELP {self.nome} {self.descricao}', f'# TYPE {self.nome} histogram']
+        with self._lock:
+            for rotulos, (baldes, soma, total) in sorted(self._series.items()):
+                acumulado = 0
+                for limite, quantidade in zip(self.limites + (float('inf'),), baldes):
+                    acumulado += quantidade
+                    le = 'le="+Inf"' if limite == float('inf') else f'le="{limite!r}"'
+                    linhas.append(f'{self.nome}_bucket{_formatar_rotulos(self.rotulos, rotulos, le)} {acumulado}')
+                linhas.append(f'{self.nome}_sum{_formatar_rotulos(self.rotulos, rotulos)} {soma}')
+                linhas.append(f'{self.nome}_count{_formatar_rotulos(self.rotulos, rotulos)} {total}')
+        return linhas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas da aplicação, mais coletores chamados a cada leitura."""
+
+    def __init__(self):
+        self._metricas = {}
+        self._coletores = {}
+
+    def contador(self, nome, descricao, rotulos=()):
+        return self._metricas.setdefault(nome, Contador(nome, descricao, rotulos))
+
+    def histograma(self, nome, descricao, rotulos=(), limites=LIMITES_PADRAO):
+        return self._metricas.setdefault(nome, Histograma(nome, descricao, rotulos, limites))
+
+    def registrar_coletor(self, nome, funcao):
+        """Registra uma função que retorna linhas extras (ex.: medidas lidas na hora)."""
+        self._coletores[nome] = funcao
+
+    def renderizar(self):
+        linhas = []
+        for metrica in self._metricas.values():
+            linhas.extend(metrica.renderizar())
+        for funcao in self._coletores.values():
+            linhas.extend(funcao())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = RegistroMetricas()
+
+duracao_requisicoes = registro.histograma(
+    'http_requisicao_duracao_segundos', 'Duração das requisições HTTP até o envio dos cabeçalhos.',
+    ('endpoint', 'metodo', 'status'))
+duracao_sql = registro.histograma(
+    'sql_comando_duracao_segundos', 'Duração da execução dos comandos SQL.', ('operacao', 'tabela'))
+linhas_sql = registro.contador(
+    'sql_linhas_total', 'Linhas lidas ou alteradas pelos comandos SQL.', ('operacao', 'tabela'))
+consultas_lentas = registro.contador(
+    'sql_consultas_lentas_total', 'Comandos SQL acima do limite de consulta lenta.', ('operacao', 'tabela'))
+
+
+def iniciar_medicao():
+    """Hook before_request: marca o início da requisição."""
+    g.inicio_requisicao = time.perf_counter()
+
+
+def registrar_requisicao(resposta):
+    """Hook after_request: registra a duração da requisição por rota, método e status."""
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        # Usa a regra da rota (ex.: /produtos/<int:produto_id>) para não criar uma série por id
+        endpoint = request.url_rule.rule if request.url_rule else 'desconhecido'
+        duracao_requisicoes.observar(time.perf_counter() - inicio, endpoint, request.method, str(resposta.status_code))
+    return resposta
+
+
+def coletor_cache(nome, cache):
+    """Cria um coletor com os contadores e o tamanho de um CacheLRU."""
+    def coletar():
+        estatisticas = cache.estatisticas()
+        return [
+            f'# TYPE {nome}_acertos_total counter', f'{nome}_acertos_total {estatisticas["acertos"]}',
+            f'# TYPE {nome}_falhas_total counter', f'{nome}_falhas_total {estatisticas["falhas"]}',
+            f'# TYPE {nome}_itens gauge', f'{nome}_itens {estatisticas["itens"]}',
+        ]
+    return coletar
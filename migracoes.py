@@ -0,0 +1,273 @@
+"""
+Migrações numeradas do schema, controladas pelo `PRAGMA user_version`.
+
+O número gravado no cabeçalho do banco é a última migração aplicada. Na
+inicialização (`create_app`) basta ler esse número: com o banco em dia não há
+nenhuma outra consulta. As pendentes rodam em ordem, cada uma na sua própria
+transação junto com a atualização do `user_version`, então um banco nunca fica
+com uma migração pela metade. Migrações já publicadas não devem ser alteradas;
+qualquer mudança nova de schema entra como uma nova função no fim de MIGRACOES.
+"""
+import logging
+import os
+import sqlite3
+
+# Schema da versão 1 (banco completo antes das migrações seguintes)
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+logger = logging.getLogger('inventario.migracoes')
+
+
+def _comandos(script):
+    """Separa um script SQL em comandos, respeitando os ';' dentro dos triggers."""
+    comando = ''
+    for linha in script.splitlines(keepends=True):
+        comando += linha
+        if sqlite3.complete_statement(comando):
+            yield comando
+            comando = ''
+    sobra = [linha for linha in comando.splitlines() if linha.strip() and not linha.strip().startswith('--')]
+    if sobra:
+        raise ValueError(f"Comando SQL incompleto no fim do script: {sobra[0].strip()}")
+
+
+def _executar_script(conn, script):
+    # executescript faria COMMIT antes de começar; comando a comando tudo fica na transação da migração
+    for comando in _comandos(script):
+        conn.execute(comando)
+
+
+def _sequencia(conn, tabela):
+    linha = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (tabela,)).fetchone()
+    return linha[0] if linha else 0
+
+
+def _ajustar_sequencia(conn, tabela, seq):
+    # Mantém o próximo id acima de todos os já usados (inclusive de produtos removidos)
+    conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (seq, tabela))
+
+
+def _reconstruir_tabela(conn, tabela, criar):
+    """
+    Troca a definição de `tabela` pela de `criar` (com `{tabela}` no lugar do
+    nome), como recomenda o SQLite para mudar restrições: cria a tabela nova,
+    copia as linhas, remove a antiga, renomeia e recria índices e triggers.
+    """
+    objetos = [linha[0] for linha in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (tabela,))]
+    # table_xinfo marca as colunas geradas com hidden 2 ou 3; elas não são copiadas
+    colunas = ', '.join(c[1] for c in conn.execute(f'PRAGMA table_xinfo({tabela})') if c[6] == 0)
+    seq = _sequencia(conn, tabela)
+    nova = f'{tabela}_nova'
+    conn.execute(criar.format(tabela=nova))
+    conn.execute(f'INSERT INTO {nova} ({colunas}) SELECT {colunas} FROM {tabela}')
+    conn.execute(f'DROP TABLE {tabela}')
+    conn.execute(f'ALTER TABLE {nova} RENAME TO {tabela}')
+    _ajustar_sequencia(conn, tabela, seq)
+    for sql in objetos:
+        conn.execute(sql)
+
+
+def _migracao_esquema_base(conn):
+    """Cria o schema completo; bancos do schema original (só 'produtos') têm os produtos preservados."""
+    existentes = {linha[0] for linha in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'reservas' in existentes:
+        # Banco criado pelo schema.sql atual antes da existência das migrações
+        return
+    legado = 'produtos' in existentes
+    if legado:
+        seq = _sequencia(conn, 'produtos')
+        conn.execute('ALTER TABLE produtos RENAME TO produtos_antigo')
+    with open(SCHEMA) as f:
+        _executar_script(conn, f.read())
+    if legado:
+        # Os triggers preenchem a busca, o resumo por categoria e as mudanças de cada produto copiado
+        conn.execute(
+            'INSERT INTO produtos (id, nome, categoria, preco_unitario, quantidade) '
+            'SELECT id, nome, categoria, preco_unitario, quantidade FROM produtos_antigo ORDER BY id')
+        conn.execute(
+            "INSERT INTO movimentacoes (produto_id, tipo, quantidade) "
+            "SELECT id, 'inicial', quantidade FROM produtos ORDER BY id")
+        conn.execute('DROP TABLE produtos_antigo')
+        _ajustar_sequencia(conn, 'produtos', seq)
+
+
+def _migracao_indices_categoria_nome(conn):
+    """Índices em categoria e nome (agrupamentos e filtros por categoria, ordenação por nome)."""
+    conn.execute('CREATE INDEX idx_produtos_categoria_nome ON produtos (categoria, nome)')
+    conn.execute('CREATE INDEX idx_produtos_nome ON produtos (nome)')
+
+
+def _migracao_restricoes_estoque(conn):
+    """Faz o próprio banco recusar quantidade, reservado ou estoque mínimo negativos."""
+    _reconstruir_tabela(conn, 'produtos', """
+        CREATE TABLE {tabela} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            preco_unitario REAL NOT NULL,
+            quantidade INTEGER NOT NULL CHECK (quantidade >= 0),
+            estoque_minimo INTEGER NOT NULL DEFAULT 0 CHECK (estoque_minimo >= 0),
+            reservado INTEGER NOT NULL DEFAULT 0 CHECK (reservado >= 0),
+            disponivel INTEGER GENERATED ALWAYS AS (quantidade - reservado) VIRTUAL,
+            atualizado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+
+SQL_MOVIMENTACOES_DIARIAS = """
+-- Entradas e saídas somadas por produto e por dia (UTC), mantidas pelo trigger
+-- abaixo na mesma transação de cada movimentação. As análises de consumo leem
+-- só os dias da janela pedida, sem percorrer o histórico de movimentações.
+CREATE TABLE movimentacoes_diarias (
+    produto_id INTEGER NOT NULL,
+    dia TEXT NOT NULL,
+    entradas INTEGER NOT NULL,
+    saidas INTEGER NOT NULL,
+    operacoes INTEGER NOT NULL,
+    PRIMARY KEY (produto_id, dia)
+) WITHOUT ROWID;
+
+-- Janela de dias de todos os produtos (mais movimentados, previsão de ruptura), sem ler a tabela
+CREATE INDEX idx_movimentacoes_diarias_dia ON movimentacoes_diarias (dia, saidas, entradas, operacoes);
+
+-- Os mesmos totais por categoria (a do produto no momento da movimentação)
+CREATE TABLE movimentacoes_diarias_categorias (
+    dia TEXT NOT NULL,
+    categoria TEXT NOT NULL,
+    entradas INTEGER NOT NULL,
+    saidas INTEGER NOT NULL,
+    operacoes INTEGER NOT NULL,
+    PRIMARY KEY (dia, categoria)
+) WITHOUT ROWID;
+
+CREATE TRIGGER movimentacoes_diarias_insert AFTER INSERT ON movimentacoes
+WHEN new.tipo IN ('entrada', 'saida') BEGIN
+    INSERT INTO movimentacoes_diarias (produto_id, dia, entradas, saidas, operacoes)
+    VALUES (new.produto_id, substr(new.criado_em, 1, 10),
+            CASE new.tipo WHEN 'entrada' THEN new.quantidade ELSE 0 END,
+            CASE new.tipo WHEN 'saida' THEN new.quantidade ELSE 0 END, 1)
+    ON CONFLICT (produto_id, dia) DO UPDATE SET
+        entradas = entradas + excluded.entradas,
+        saidas = saidas + excluded.saidas,
+        operacoes = operacoes + 1;
+    INSERT INTO movimentacoes_diarias_categorias (dia, categoria, entradas, saidas, operacoes)
+    SELECT substr(new.criado_em, 1, 10), categoria,
+           CASE new.tipo WHEN 'entrada' THEN new.quantidade ELSE 0 END,
+           CASE new.tipo WHEN 'saida' THEN new.quantidade ELSE 0 END, 1
+    FROM produtos WHERE id = new.produto_id
+    ON CONFLICT (dia, categoria) DO UPDATE SET
+        entradas = entradas + excluded.entradas,
+        saidas = saidas + excluded.saidas,
+        operacoes = operacoes + 1;
+END;
+
+INSERT INTO movimentacoes_diarias (produto_id, dia, entradas, saidas, operacoes)
+SELECT produto_id, substr(criado_em, 1, 10),
+       SUM(CASE tipo WHEN 'entrada' THEN quantidade ELSE 0 END),
+       SUM(CASE tipo WHEN 'saida' THEN quantidade ELSE 0 END), COUNT(*)
+FROM movimentacoes WHERE tipo IN ('entrada', 'saida')
+GROUP BY produto_id, substr(criado_em, 1, 10);
+
+INSERT INTO movimentacoes_diarias_categorias (dia, categoria, entradas, saidas, operacoes)
+SELECT d.dia, p.categoria, SUM(d.entradas), SUM(d.saidas), SUM(d.operacoes)
+FROM movimentacoes_diarias d JOIN produtos p ON p.id = d.produto_id
+GROUP BY d.dia, p.categoria;
+"""
+
+
+def _migracao_movimentacoes_diarias(conn):
+    """Totais diários de entradas e saídas por produto e por categoria, preenchidos com o histórico."""
+    _executar_script(conn, SQL_MOVIMENTACOES_DIARIAS)
+
+
+SQL_TRANSFERENCIAS = """
+-- Registro das transferências entre armazéns. Cada etapa (saída na origem,
+-- entrada no destino) é uma transação no arquivo do seu armazém; a situação
+-- fica 'pendente' até as duas terminarem, para a recuperação após uma queda.
+CREATE TABLE transferencias (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    produto_id INTEGER NOT NULL,
+    origem TEXT NOT NULL,
+    destino TEXT NOT NULL,
+    quantidade INTEGER NOT NULL CHECK (quantidade > 0),
+    situacao TEXT NOT NULL DEFAULT 'pendente' CHECK (situacao IN ('pendente', 'concluida', 'cancelada')),
+    criado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_transferencias_pendentes ON transferencias (criado_em) WHERE situacao = 'pendente';
+
+-- Etapas gravadas no banco principal quando ele é a origem ou o destino
+-- (os arquivos dos armazéns têm a mesma tabela)
+CREATE TABLE transferencias_etapas (
+    transferencia_id INTEGER NOT NULL,
+    etapa TEXT NOT NULL CHECK (etapa IN ('saida', 'entrada')),
+    aplicada INTEGER NOT NULL,
+    PRIMARY KEY (transferencia_id, etapa)
+) WITHOUT ROWID;
+"""
+
+
+def _migracao_transferencias(conn):
+    """Registro das transferências entre armazéns e das etapas já aplicadas."""
+    _executar_script(conn, SQL_TRANSFERENCIAS)
+
+
+# Em ordem: a migração de índice i leva o banco para a versão i + 1
+MIGRACOES = [
+    _migracao_esquema_base,
+    _migracao_indices_categoria_nome,
+    _migracao_restricoes_estoque,
+    _migracao_movimentacoes_diarias,
+    _migracao_transferencias,
+]
+VERSAO_ATUAL = len(MIGRACOES)
+
+
+def versao_banco(conn):
+    """Retorna a versão do schema gravada no banco (PRAGMA user_version)."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def aplicar_migracoes(conn):
+    """
+    Aplica as migrações pendentes e retorna as versões aplicadas (lista vazia
+    se o banco já estava em dia). Recusa bancos de uma versão mais nova que a
+    da aplicação, para não rodar código antigo sobre um schema desconhecido.
+    """
+    versao = versao_banco(conn)
+    if versao == VERSAO_ATUAL:
+        return []
+    if versao > VERSAO_ATUAL:
+        raise RuntimeError(f"Banco na versão {versao}, mais nova que a da aplicação ({VERSAO_ATUAL}).")
+
+    aplicadas = []
+    while True:
+        # BEGIN IMMEDIATE serializa processos iniciando juntos; a versão é relida já com o lock
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            versao = versao_banco(conn)
+            if versao >= VERSAO_ATUAL:
+                conn.rollback()
+                return aplicadas
+            MIGRACOES[versao](conn)
+            conn.execute(f'PRAGMA user_version = {versao + 1}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logger.info("Migração %d aplicada: %s", versao + 1, MIGRACOES[versao].__doc__.strip())
+        aplicadas.append(versao + 1)
+
+
+def recriar_banco(conn):
+    """Apaga todas as tabelas e aplica as migrações do zero (usado em testes e benchmarks)."""
+    tabelas = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY sql LIKE 'CREATE VIRTUAL%' DESC").fetchall()
+    with conn:
+        # As tabelas virtuais vão primeiro e levam junto as tabelas internas (produtos_fts_data...)
+        for (nome,) in tabelas:
+            conn.execute(f'DROP TABLE IF EXISTS "{nome}"')
+        conn.execute('PRAGMA user_version = 0')
+    return aplicar_migracoes(conn)
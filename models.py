@@ -1,28 +1,143 @@
+import json
+import random
+import re
 import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 
-DATABASE = 'database.db'
+from flask import current_app, has_app_context
+from werkzeug.local import LocalProxy
 
-def get_db_connection():
-    """Cria e retorna uma conexão com o banco de dados."""
-    conn = sqlite3.connect(DATABASE)
-    # Retorna as linhas como dicionários em vez de tuplas
-    conn.row_factory = sqlite3.Row
-    return conn
+from cache import CacheLRU
+from db import CONFIG_SQLITE, anexar_armazens, get_db, limite_armazens
+from metricas import registro
+from migracoes import VERSAO_ATUAL, recriar_banco, versao_banco
+
+# Movimentos de estoque em um único comando: a condição do WHERE garante que a
+# saída nunca deixe o estoque negativo, mesmo com vários workers concorrentes.
+SQL_ENTRADA = (
+    'UPDATE produtos SET quantidade = quantidade + ?, atualizado_em = CURRENT_TIMESTAMP '
+    'WHERE id = ? RETURNING *'
+)
+SQL_SAIDA = (
+    'UPDATE produtos SET quantidade = quantidade - ?, atualizado_em = CURRENT_TIMESTAMP '
+    'WHERE id = ? AND quantidade - reservado >= ? RETURNING *'
+)
+
+# Instante atual no mesmo formato das colunas criado_em/expira_em
+SQL_AGORA = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Cache de leitura de produtos por id; toda escrita invalida as entradas afetadas.
+# Cada aplicação tem o seu (app.extensions['cache_produtos'], criado em create_app),
+# já que duas aplicações no mesmo processo podem usar bancos diferentes; fora de
+# um contexto de aplicação (scripts) é usado um cache do processo.
+_cache_sem_aplicacao = CacheLRU()
+
+def _cache_atual():
+    if has_app_context():
+        return current_app.extensions.get('cache_produtos', _cache_sem_aplicacao)
+    return _cache_sem_aplicacao
+
+cache_produtos = LocalProxy(_cache_atual)
+
+# A cada quantas movimentações de um produto é gravado um snapshot do seu saldo
+INTERVALO_SNAPSHOT = 100
+
+# Avisa as conexões de streaming (SSE/long-poll) de que houve uma escrita neste processo
+_sinal_escritas = threading.Condition()
+_total_escritas = 0
+# Intervalo máximo entre verificações da tabela de mudanças, para perceber
+# escritas feitas por outros processos (workers) que não passam pelo sinal
+INTERVALO_VERIFICACAO_MUDANCAS = 1.0
+
+def _notificar_escrita():
+    global _total_escritas
+    with _sinal_escritas:
+        _total_escritas += 1
+        _sinal_escritas.notify_all()
+
+# Espera base e máxima (segundos) antes de repetir uma escrita que encontrou o banco ocupado
+ESPERA_BASE_TENTATIVA = 0.05
+ESPERA_MAXIMA_TENTATIVA = 1.0
+
+escritas_repetidas = registro.contador(
+    'sql_escritas_repetidas_total', 'Escritas repetidas porque o banco estava ocupado por outro processo.')
+
+def banco_ocupado(erro):
+    # SQLITE_BUSY ("database is locked") e SQLITE_LOCKED ("database table is locked")
+    return isinstance(erro, sqlite3.OperationalError) and 'locked' in str(erro)
+
+def _executar_escrita(operacao, armazens=(), escreve_principal=True):
+    """
+    Executa `operacao(conn)` dentro de uma única transação, com os arquivos
+    dos `armazens` informados já anexados à conexão.
+
+    `escreve_principal=False` indica que a operação só grava nos arquivos dos
+    armazéns: a transação começa adiada (BEGIN), sem pegar o lock de escrita
+    do banco principal, que o BEGIN IMMEDIATE pegaria em todos os anexados.
+
+    Com a escrita agrupada ativa (ESCRITA_AGRUPADA) a operação é entregue à
+    thread de escrita da aplicação e pode dividir a transação com outras.
+    Se outro processo segurar o lock além do busy timeout, a transação inteira
+    é desfeita e repetida (SQLITE_TENTATIVAS_ESCRITA vezes, com espera crescente).
+    """
+    config = current_app.config if has_app_context() else CONFIG_SQLITE
+    escritor = current_app.extensions.get('escritor_agrupado') if has_app_context() else None
+    tentativas = max(1, int(config.get('SQLITE_TENTATIVAS_ESCRITA', CONFIG_SQLITE['SQLITE_TENTATIVAS_ESCRITA'])))
+    for tentativa in range(tentativas):
+        try:
+            if escritor is not None:
+                resultado = escritor.executar(operacao, armazens, escreve_principal)
+            else:
+                conn = get_db()
+                anexar_armazens(conn, armazens)
+                with conn:
+                    # IMMEDIATE pega o lock de escrita antes de qualquer leitura da operação:
+                    # a espera acontece aqui, sob o busy timeout, e não no meio da transação
+                    conn.execute('BEGIN IMMEDIATE' if escreve_principal else 'BEGIN')
+                    resultado = operacao(conn)
+            break
+        except sqlite3.OperationalError as e:
+            if not banco_ocupado(e) or tentativa == tentativas - 1:
+                raise
+            escritas_repetidas.incrementar()
+            time.sleep(random.uniform(0, min(ESPERA_MAXIMA_TENTATIVA, ESPERA_BASE_TENTATIVA * 2 ** tentativa)))
+    _notificar_escrita()
+    return resultado
+
+def _primeira_linha(cursor):
+    """Consome o cursor e retorna a primeira linha como dicionário (ou None)."""
+    linhas = cursor.fetchall()
+    return dict(linhas[0]) if linhas else None
+
+def verificar_banco():
+    """
+    Confere se o banco responde e está na versão de schema desta aplicação
+    (usado pela verificação de saúde). Retorna (versao, erro).
+    """
+    try:
+        versao = versao_banco(get_db())
+    except sqlite3.Error as e:
+        return None, f"Banco de dados indisponível: {e}"
+    if versao != VERSAO_ATUAL:
+        return versao, f"Schema na versão {versao}; a aplicação espera a versão {VERSAO_ATUAL}."
+    return versao, None
 
 def resetar_estoque():
     """
     Função para limpar e recriar o banco de dados durante os testes.
     Importante: Esta função não deve ser usada em produção.
     """
-    conn = get_db_connection()
-    with open('schema.sql') as f:
-        conn.executescript(f.read())
-    conn.commit()
-    conn.close()
+    recriar_banco(get_db())
+    cache_produtos.limpar()
+    _notificar_escrita()
 
-def criar_produto(dados):
-    """Cria um novo produto no banco de dados."""
-    # Validações de negócio (permanecem as mesmas)
+def validar_produto(dados):
+    """
+    Aplica as validações de negócio de um novo produto.
+    Retorna (valores, None) prontos para o INSERT ou (None, mensagem de erro).
+    """
     campos_obrigatorios = ["nome", "categoria", "preco_unitario", "quantidade_inicial"]
     for campo in campos_obrigatorios:
         if campo not in dados:
@@ -41,114 +156,1086 @@ def criar_produto(dados):
         return None, "O preço unitário deve ser um número positivo."
     if not isinstance(qtd, int) or qtd < 0:
         return None, "A quantidade inicial deve ser um número inteiro maior ou igual a zero."
+    estoque_minimo, erro = _validar_estoque_minimo(dados.get("estoque_minimo", 0))
+    if erro:
+        return None, erro
+
+    return (nome.strip(), categoria.strip(), preco, qtd, estoque_minimo), None
+
+def _validar_estoque_minimo(valor):
+    """Valida o estoque mínimo (ponto de reposição) de um produto."""
+    if isinstance(valor, bool) or not isinstance(valor, int) or valor < 0:
+        return None, "O estoque mínimo deve ser um número inteiro maior ou igual a zero."
+    return valor, None
+
+def criar_produto(dados):
+    """Cria um novo produto no banco de dados."""
+    valores, erro = validar_produto(dados)
+    if erro:
+        return None, erro
+
+    def operacao(conn):
+        # Retorna o produto recém-criado direto do INSERT, sem nova consulta
+        produto = _primeira_linha(conn.execute(
+            'INSERT INTO produtos (nome, categoria, preco_unitario, quantidade, estoque_minimo) '
+            'VALUES (?, ?, ?, ?, ?) RETURNING *',
+            valores
+        ))
+        _registrar_movimentacao(conn, produto["id"], "inicial", produto["quantidade"], produto["quantidade"])
+        return produto
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO produtos (nome, categoria, preco_unitario, quantidade) VALUES (?, ?, ?, ?)',
-            (nome.strip(), categoria.strip(), preco, qtd)
-        )
-        produto_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        # Retorna o produto recém-criado
-        return obter_produto_por_id(produto_id), None
+        return _executar_escrita(operacao), None
     except sqlite3.Error as e:
         return None, f"Erro no banco de dados: {e}"
 
-def listar_produtos(nome=None, categoria=None):
-    """Lista produtos do banco de dados, com suporte a filtros."""
-    conn = get_db_connection()
-    query = 'SELECT * FROM produtos'
-    params = []
-    
+def inserir_produtos_lote(lote):
+    """
+    Insere de uma vez uma lista de produtos já validados por `validar_produto`,
+    em uma única transação. Retorna a quantidade de produtos inseridos.
+    """
+    def operacao(conn):
+        conn.executemany(
+            'INSERT INTO produtos (nome, categoria, preco_unitario, quantidade, estoque_minimo) VALUES (?, ?, ?, ?, ?)',
+            lote
+        )
+        # Dentro da transação os ids do lote são consecutivos: registra o estoque inicial de todos
+        ultimo_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        conn.execute(
+            "INSERT INTO movimentacoes (produto_id, tipo, quantidade) "
+            "SELECT id, 'inicial', quantidade FROM produtos WHERE id BETWEEN ? AND ?",
+            (ultimo_id - len(lote) + 1, ultimo_id)
+        )
+
+    _executar_escrita(operacao)
+    return len(lote)
+
+def _expressao_fts(coluna, termo):
+    """Monta a expressão FTS5 de busca por prefixo de cada palavra do termo, restrita à coluna."""
+    palavras = re.findall(r'\w+', termo)
+    if not palavras:
+        return None
+    return f'{coluna} : (' + ' '.join(f'"{palavra}"*' for palavra in palavras) + ')'
+
+def montar_consulta_produtos(nome=None, categoria=None, limite=None, apos_id=None, usar_fts=True):
+    """
+    Monta o SQL da listagem de produtos e seus parâmetros.
+
+    Os filtros de texto usam o índice FTS5 (`produtos_fts`), com busca por
+    prefixo e resultados ordenados por relevância; com `usar_fts=False`, ou se
+    o termo não tiver palavras, cai no `LIKE '%termo%'` original.
+    """
+    expressoes = []
     conditions = []
-    if nome:
-        conditions.append('nome LIKE ?')
-        params.append(f'%{nome}%')
-    if categoria:
-        conditions.append('categoria LIKE ?')
-        params.append(f'%{categoria}%')
+    params = []
+    for coluna, termo in (('nome', nome), ('categoria', categoria)):
+        if not termo:
+            continue
+        expressao = _expressao_fts(coluna, termo) if usar_fts else None
+        if expressao:
+            expressoes.append(expressao)
+        else:
+            conditions.append(f'p.{coluna} LIKE ?')
+            params.append(f'%{termo}%')
+
+    if expressoes:
+        query = 'SELECT p.* FROM produtos_fts JOIN produtos p ON p.id = produtos_fts.rowid'
+        conditions.insert(0, 'produtos_fts MATCH ?')
+        params.insert(0, ' AND '.join(expressoes))
+    else:
+        query = 'SELECT p.* FROM produtos p'
+
+    if apos_id is not None:
+        conditions.append(('produtos_fts.rowid' if expressoes else 'p.id') + ' > ?')
+        params.append(apos_id)
         
     if conditions:
         query += ' WHERE ' + ' AND '.join(conditions)
 
+    # A paginação por chave exige ordem de id; a busca simples sai por relevância.
+    # Com FTS a ordem de id vem do próprio índice (rowid), sem etapa de ordenação.
+    if expressoes and limite is None and apos_id is None:
+        query += ' ORDER BY produtos_fts.rank, p.id'
+    elif expressoes:
+        query += ' ORDER BY produtos_fts.rowid'
+    else:
+        query += ' ORDER BY p.id'
+    if limite is not None:
+        query += ' LIMIT ?'
+        params.append(limite)
+    return query, params
+
+def listar_produtos(nome=None, categoria=None, limite=None, apos_id=None):
+    """
+    Lista produtos do banco de dados, com suporte a filtros.
+
+    Com `limite` e `apos_id` a listagem é paginada por chave (keyset): retorna
+    até `limite` produtos com id maior que `apos_id`, sempre em ordem de id.
+    """
+    conn = get_db()
+    query, params = montar_consulta_produtos(nome, categoria, limite, apos_id)
     produtos_raw = conn.execute(query, params).fetchall()
-    conn.close()
     
     # Converte os objetos Row para dicionários
     produtos = [dict(p) for p in produtos_raw]
     return produtos
 
+def reconstruir_indice_busca():
+    """Reconstrói do zero o índice de busca textual a partir da tabela de produtos."""
+    _executar_escrita(lambda conn: conn.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')"))
+
+def iterar_produtos(nome=None, categoria=None, tamanho_lote=1000):
+    """
+    Percorre todos os produtos (com os mesmos filtros de `listar_produtos`)
+    buscando uma página por vez, para que a memória usada não cresça com o catálogo.
+    """
+    apos_id = None
+    while True:
+        pagina = listar_produtos(nome=nome, categoria=categoria, limite=tamanho_lote, apos_id=apos_id)
+        yield from pagina
+        if len(pagina) < tamanho_lote:
+            return
+        apos_id = pagina[-1]["id"]
+
+def colunas_produtos():
+    """Retorna os nomes das colunas da tabela de produtos, na ordem do schema."""
+    return [coluna[0] for coluna in get_db().execute('SELECT * FROM produtos LIMIT 0').description]
+
+# Com vários processos (workers) cada um tem o próprio cache; as escritas feitas
+# pelos outros são percebidas pela tabela de mudanças, lida no máximo uma vez por
+# intervalo (CACHE_PRODUTOS_SINCRONIZACAO_MS). Acima de LIMITE_SINCRONIZACAO_CACHE
+# mudanças pendentes é mais barato esvaziar o cache do que invalidar uma a uma.
+# O estado da sincronização é de cada aplicação, como o cache.
+LIMITE_SINCRONIZACAO_CACHE = 1000
+_lock_sincronizacao = threading.Lock()
+
+def _sincronizar_cache():
+    intervalo = current_app.config.get('CACHE_PRODUTOS_SINCRONIZACAO_MS') if has_app_context() else None
+    if not intervalo:
+        return
+    agora = time.monotonic()
+    with _lock_sincronizacao:
+        sincronizacao = current_app.extensions.setdefault('cache_produtos_sincronizacao', {"seq": None, "proxima": 0.0})
+        if agora < sincronizacao["proxima"]:
+            return
+        sincronizacao["proxima"] = agora + intervalo / 1000
+        anterior = sincronizacao["seq"]
+
+    conn = get_db()
+    atual = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM mudancas').fetchone()[0]
+    if anterior is None or atual < anterior or atual - anterior > LIMITE_SINCRONIZACAO_CACHE:
+        # Primeira leitura, banco recriado ou mudanças demais desde a última
+        cache_produtos.limpar()
+    elif atual > anterior:
+        alterados = conn.execute(
+            'SELECT DISTINCT produto_id FROM mudancas WHERE seq > ? AND seq <= ?', (anterior, atual)
+        ).fetchall()
+        cache_produtos.invalidar(*(linha[0] for linha in alterados))
+    with _lock_sincronizacao:
+        sincronizacao["seq"] = atual
+
 def obter_produto_por_id(produto_id):
-    """Retorna um único produto pelo seu ID do banco de dados."""
-    conn = get_db_connection()
+    """Retorna um único produto pelo seu ID, consultando primeiro o cache."""
+    _sincronizar_cache()
+    produto = cache_produtos.obter(produto_id)
+    if produto is not None:
+        return dict(produto)
+
+    versao = cache_produtos.versao()
+    conn = get_db()
     produto_raw = conn.execute('SELECT * FROM produtos WHERE id = ?', (produto_id,)).fetchone()
-    conn.close()
     if produto_raw is None:
         return None
-    return dict(produto_raw)
+    produto = dict(produto_raw)
+    cache_produtos.guardar(produto_id, produto, versao)
+    return dict(produto)
+
+def obter_produtos_por_ids(ids):
+    """
+    Retorna os produtos dos ids informados, na ordem pedida e sem repetições.
+    Os que estão no cache não vão ao banco; os demais são lidos em uma única
+    consulta, com a lista de ids passada como um só parâmetro JSON (json_each).
+    """
+    _sincronizar_cache()
+    ids = list(dict.fromkeys(ids))
+    encontrados = {}
+    faltantes = []
+    for produto_id in ids:
+        produto = cache_produtos.obter(produto_id)
+        if produto is not None:
+            encontrados[produto_id] = dict(produto)
+        else:
+            faltantes.append(produto_id)
+
+    if faltantes:
+        versao = cache_produtos.versao()
+        linhas = get_db().execute(
+            'SELECT * FROM produtos WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(faltantes),)
+        ).fetchall()
+        for linha in linhas:
+            produto = dict(linha)
+            cache_produtos.guardar(produto["id"], produto, versao)
+            encontrados[produto["id"]] = dict(produto)
+    return [encontrados[produto_id] for produto_id in ids if produto_id in encontrados]
 
 def atualizar_produto(produto_id, dados):
     """Atualiza os dados de um produto no banco de dados."""
-    produto_atual = obter_produto_por_id(produto_id)
-    if not produto_atual:
-        return None, "Produto não encontrado."
-    
     # Prepara os campos para atualização
     campos_para_atualizar = {}
     if "nome" in dados: campos_para_atualizar['nome'] = dados['nome'].strip()
     if "categoria" in dados: campos_para_atualizar['categoria'] = dados['categoria'].strip()
     if "preco_unitario" in dados: campos_para_atualizar['preco_unitario'] = dados['preco_unitario']
+    if "estoque_minimo" in dados:
+        estoque_minimo, erro = _validar_estoque_minimo(dados['estoque_minimo'])
+        if erro:
+            return None, erro
+        campos_para_atualizar['estoque_minimo'] = estoque_minimo
 
     if not campos_para_atualizar:
-        return produto_atual, None # Nenhum dado para atualizar
+        # Nenhum dado para atualizar
+        produto_atual = obter_produto_por_id(produto_id)
+        if not produto_atual:
+            return None, "Produto não encontrado."
+        return produto_atual, None
 
     set_clause = ', '.join([f'{campo} = ?' for campo in campos_para_atualizar])
     params = list(campos_para_atualizar.values())
     params.append(produto_id)
 
-    conn = get_db_connection()
-    conn.execute(f'UPDATE produtos SET {set_clause} WHERE id = ?', params)
-    conn.commit()
-    conn.close()
-
-    return obter_produto_por_id(produto_id), None
+    produto = _executar_escrita(lambda conn: _primeira_linha(conn.execute(
+        f'UPDATE produtos SET {set_clause}, atualizado_em = CURRENT_TIMESTAMP WHERE id = ? RETURNING *', params
+    )))
+    cache_produtos.invalidar(produto_id)
+    if not produto:
+        return None, "Produto não encontrado."
+    return produto, None
 
 def remover_produto(produto_id):
-    """Remove um produto do banco de dados."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM produtos WHERE id = ?', (produto_id,))
-    conn.commit()
-    removido = cursor.rowcount > 0
-    conn.close()
-    return removido
+    """Remove um produto do banco de dados, junto com o estoque dele nos demais armazéns."""
+    armazens = _codigos_armazens()
+
+    def operacao(conn):
+        for codigo in armazens:
+            conn.execute(f'DELETE FROM armazem_{codigo}.estoque WHERE produto_id = ?', (produto_id,))
+        conn.execute(
+            f"UPDATE reservas SET status = 'cancelada', finalizada_em = {SQL_AGORA} "
+            "WHERE produto_id = ? AND status = 'ativa'", (produto_id,)
+        )
+        return conn.execute('DELETE FROM produtos WHERE id = ?', (produto_id,)).rowcount
+
+    removidos = _executar_escrita(operacao, armazens)
+    cache_produtos.invalidar(produto_id)
+    return removidos > 0
+
+def _validar_produto_id(produto_id):
+    """Retorna a mensagem de erro se o id do produto não for um número inteiro, ou None."""
+    if isinstance(produto_id, bool) or not isinstance(produto_id, int):
+        return "O campo 'produto_id' deve ser um número inteiro."
+    return None
+
+def _validar_operacao_estoque(tipo, quantidade):
+    """Valida o tipo e a quantidade de uma operação de estoque. Retorna a mensagem de erro ou None."""
+    if not isinstance(quantidade, int) or quantidade <= 0:
+        return "A quantidade deve ser um número inteiro positivo."
+    if tipo not in ("entrada", "saida"):
+        return "Tipo de operação inválida. Use 'entrada' ou 'saida'."
+    return None
+
+def _aplicar_movimento(conn, produto_id, tipo, quantidade):
+    """
+    Aplica uma operação já validada com um único UPDATE condicional.
+    Deve ser chamada dentro de uma transação aberta em `conn`.
+    """
+    if tipo == "entrada":
+        produto = _primeira_linha(conn.execute(SQL_ENTRADA, (quantidade, produto_id)))
+    else:
+        produto = _primeira_linha(conn.execute(SQL_SAIDA, (quantidade, produto_id, quantidade)))
+
+    if produto is None:
+        # Nenhuma linha alterada: o produto não existe ou não há saldo suficiente
+        if conn.execute('SELECT 1 FROM produtos WHERE id = ?', (produto_id,)).fetchone() is None:
+            return None, "Produto não encontrado."
+        return None, "Estoque insuficiente para a saída."
+
+    _registrar_movimentacao(conn, produto_id, tipo, quantidade, produto["quantidade"])
+    anterior = produto["quantidade"] - quantidade if tipo == "entrada" else produto["quantidade"] + quantidade
+    _verificar_estoque_minimo(conn, produto, anterior)
+    return produto, None
+
+def _verificar_estoque_minimo(conn, produto, anterior):
+    """
+    Grava um alerta quando a movimentação cruza o estoque mínimo do produto.
+    Só é chamada no caminho das movimentações: não há varredura periódica.
+    """
+    minimo = produto["estoque_minimo"]
+    if anterior >= minimo > produto["quantidade"]:
+        tipo = "baixo"
+    elif anterior < minimo <= produto["quantidade"]:
+        tipo = "normalizado"
+    else:
+        return
+    conn.execute(
+        'INSERT INTO alertas_estoque (produto_id, tipo, quantidade, estoque_minimo) VALUES (?, ?, ?, ?)',
+        (produto["id"], tipo, produto["quantidade"], minimo)
+    )
+
+def _registrar_movimentacao(conn, produto_id, tipo, quantidade, saldo):
+    """
+    Grava a movimentação no histórico, na mesma transação da alteração de estoque.
+    A cada INTERVALO_SNAPSHOT movimentações do produto grava também um snapshot do saldo.
+    """
+    movimentacao = conn.execute(
+        'INSERT INTO movimentacoes (produto_id, tipo, quantidade) VALUES (?, ?, ?) RETURNING id, criado_em',
+        (produto_id, tipo, quantidade)
+    ).fetchall()[0]
+
+    ultimo_snapshot = conn.execute(
+        'SELECT COALESCE(MAX(movimentacao_id), 0) FROM estoque_snapshots WHERE produto_id = ?', (produto_id,)
+    ).fetchone()[0]
+    pendentes = conn.execute(
+        'SELECT COUNT(*) FROM movimentacoes WHERE produto_id = ? AND id > ?', (produto_id, ultimo_snapshot)
+    ).fetchone()[0]
+    if pendentes >= INTERVALO_SNAPSHOT:
+        conn.execute(
+            'INSERT INTO estoque_snapshots (produto_id, movimentacao_id, saldo, criado_em) VALUES (?, ?, ?, ?)',
+            (produto_id, movimentacao["id"], saldo, movimentacao["criado_em"])
+        )
 
 def registrar_operacao_estoque(produto_id, tipo, quantidade):
     """Registra entrada ou saída de estoque no banco de dados."""
-    produto = obter_produto_por_id(produto_id)
-    if not produto:
+    erro = _validar_operacao_estoque(tipo, quantidade)
+    if erro:
+        # Produto inexistente continua tendo precedência sobre os demais erros
+        if obter_produto_por_id(produto_id) is None:
+            return None, "Produto não encontrado."
+        return None, erro
+
+    resultado = _executar_escrita(lambda conn: _aplicar_movimento(conn, produto_id, tipo, quantidade))
+    cache_produtos.invalidar(produto_id)
+    return resultado
+
+def registrar_operacoes_estoque_lote(operacoes, atomico=True):
+    """
+    Aplica uma lista de operações de estoque em uma única transação.
+
+    Cada operação é um dicionário com 'produto_id', 'tipo' e 'quantidade' e
+    passa pelas mesmas validações de `registrar_operacao_estoque`. No modo
+    atômico (tudo ou nada) qualquer falha desfaz o lote inteiro; caso
+    contrário as linhas válidas são aplicadas e as inválidas apenas relatadas.
+    Retorna (resultados, aplicado), com um resultado por linha.
+    """
+    def operacao(conn):
+        # Savepoint próprio: desfazer o lote não afeta outras operações da mesma transação
+        conn.execute('SAVEPOINT lote_estoque')
+        resultados = []
+        for linha, op in enumerate(operacoes, start=1):
+            resultado = {"linha": linha}
+            if not isinstance(op, dict) or not all(c in op for c in ("produto_id", "tipo", "quantidade")):
+                resultado.update(status="rejeitada", erro="Campos 'produto_id', 'tipo' e 'quantidade' são obrigatórios.")
+                resultados.append(resultado)
+                continue
+            erro = _validar_produto_id(op["produto_id"])
+            if erro:
+                resultado.update(status="rejeitada", erro=erro)
+                resultados.append(resultado)
+                continue
+
+            produto_id, tipo, quantidade = op["produto_id"], op["tipo"], op["quantidade"]
+            resultado["produto_id"] = produto_id
+            erro = _validar_operacao_estoque(tipo, quantidade)
+            if erro:
+                if conn.execute('SELECT 1 FROM produtos WHERE id = ?', (produto_id,)).fetchone() is None:
+                    erro = "Produto não encontrado."
+                produto = None
+            else:
+                produto, erro = _aplicar_movimento(conn, produto_id, tipo, quantidade)
+
+            if erro:
+                resultado.update(status="rejeitada", erro=erro)
+            else:
+                resultado.update(status="aplicada", produto=produto)
+            resultados.append(resultado)
+
+        if atomico and any(r["status"] == "rejeitada" for r in resultados):
+            conn.execute('ROLLBACK TO lote_estoque')
+            conn.execute('RELEASE lote_estoque')
+            for r in resultados:
+                if r["status"] == "aplicada":
+                    r["status"] = "revertida"
+                    del r["produto"]
+            return resultados, False
+        conn.execute('RELEASE lote_estoque')
+        return resultados, True
+
+    resultados, aplicado = _executar_escrita(operacao)
+    cache_produtos.invalidar(*{r["produto"]["id"] for r in resultados if r["status"] == "aplicada"})
+    return resultados, aplicado
+
+
+def listar_produtos_baixo_estoque(limite=None, apos_id=None):
+    """
+    Lista os produtos com quantidade abaixo do estoque mínimo, em ordem de id.
+    A condição é a mesma do índice parcial idx_produtos_baixo_estoque.
+    """
+    query = 'SELECT * FROM produtos WHERE quantidade < estoque_minimo'
+    params = []
+    if apos_id is not None:
+        query += ' AND id > ?'
+        params.append(apos_id)
+    query += ' ORDER BY id'
+    if limite is not None:
+        query += ' LIMIT ?'
+        params.append(limite)
+    return [dict(p) for p in get_db().execute(query, params).fetchall()]
+
+def listar_alertas_estoque(apos_id=None, limite=100):
+    """Lista os alertas de estoque mínimo gravados depois do alerta `apos_id`."""
+    return [dict(a) for a in get_db().execute(
+        'SELECT * FROM alertas_estoque WHERE id > ? ORDER BY id LIMIT ?', (apos_id or 0, limite)
+    ).fetchall()]
+
+def listar_movimentacoes(produto_id, de=None, ate=None, limite=100, apos_id=None, decrescente=False):
+    """
+    Lista as movimentações de um produto, opcionalmente entre os instantes
+    `de` e `ate` (texto 'AAAA-MM-DD HH:MM:SS.sss', UTC), paginadas por id.
+    """
+    query = 'SELECT * FROM movimentacoes WHERE produto_id = ?'
+    params = [produto_id]
+    if de is not None:
+        query += ' AND criado_em >= ?'
+        params.append(de)
+    if ate is not None:
+        query += ' AND criado_em <= ?'
+        params.append(ate)
+    if apos_id is not None:
+        query += ' AND id < ?' if decrescente else ' AND id > ?'
+        params.append(apos_id)
+    query += ' ORDER BY id DESC' if decrescente else ' ORDER BY id'
+    query += ' LIMIT ?'
+    params.append(limite)
+    return [dict(m) for m in get_db().execute(query, params).fetchall()]
+
+def saldo_em(produto_id, instante):
+    """
+    Retorna o estoque do produto no instante informado (texto, UTC).
+
+    Parte do snapshot mais recente até o instante e soma apenas as
+    movimentações entre ele e o instante, sem percorrer o histórico inteiro.
+    """
+    conn = get_db()
+    snapshot = conn.execute(
+        'SELECT movimentacao_id, saldo, criado_em FROM estoque_snapshots '
+        'WHERE produto_id = ? AND criado_em <= ? ORDER BY criado_em DESC, movimentacao_id DESC LIMIT 1',
+        (produto_id, instante)
+    ).fetchone()
+    base_id, saldo, base_data = (snapshot["movimentacao_id"], snapshot["saldo"], snapshot["criado_em"]) if snapshot else (0, 0, '')
+
+    delta = conn.execute(
+        "SELECT COALESCE(SUM(CASE tipo WHEN 'saida' THEN -quantidade ELSE quantidade END), 0) "
+        "FROM movimentacoes WHERE produto_id = ? AND criado_em >= ? AND criado_em <= ? AND id > ?",
+        (produto_id, base_data, instante, base_id)
+    ).fetchone()[0]
+    return saldo + delta
+
+def resumo_estoque():
+    """
+    Retorna os totais de estoque (produtos, unidades e valor) por categoria e
+    gerais, lidos da tabela de resumo mantida incrementalmente pelos triggers.
+    """
+    categorias = [dict(c) for c in get_db().execute(
+        'SELECT categoria, total_produtos, total_unidades, ROUND(valor_total, 2) AS valor_total '
+        'FROM resumo_categorias ORDER BY categoria'
+    ).fetchall()]
+    total = {
+        "total_produtos": sum(c["total_produtos"] for c in categorias),
+        "total_unidades": sum(c["total_unidades"] for c in categorias),
+        "valor_total": round(sum(c["valor_total"] for c in categorias), 2),
+    }
+    return {"categorias": categorias, "total": total}
+
+def verificar_resumo_estoque(corrigir=False):
+    """
+    Compara a tabela de resumo com os totais calculados do zero a partir de
+    'produtos'. Retorna a lista de categorias divergentes; com `corrigir=True`
+    reconstrói o resumo inteiro na mesma transação.
+    """
+    def operacao(conn):
+        esperado = {c["categoria"]: c for c in conn.execute(
+            'SELECT categoria, COUNT(*) AS total_produtos, SUM(quantidade) AS total_unidades, '
+            'SUM(preco_unitario * quantidade) AS valor_total FROM produtos GROUP BY categoria'
+        ).fetchall()}
+        atual = {c["categoria"]: c for c in conn.execute('SELECT * FROM resumo_categorias').fetchall()}
+
+        divergencias = []
+        for categoria in sorted(set(esperado) | set(atual)):
+            e, a = esperado.get(categoria), atual.get(categoria)
+            if (e is None or a is None
+                    or e["total_produtos"] != a["total_produtos"]
+                    or e["total_unidades"] != a["total_unidades"]
+                    or abs(e["valor_total"] - a["valor_total"]) > 0.005):
+                divergencias.append({
+                    "categoria": categoria,
+                    "esperado": dict(e) if e else None,
+                    "atual": dict(a) if a else None,
+                })
+
+        if corrigir and divergencias:
+            conn.execute('DELETE FROM resumo_categorias')
+            conn.execute(
+                'INSERT INTO resumo_categorias (categoria, total_produtos, total_unidades, valor_total) '
+                'SELECT categoria, COUNT(*), SUM(quantidade), SUM(preco_unitario * quantidade) '
+                'FROM produtos GROUP BY categoria'
+            )
+        return divergencias
+
+    return _executar_escrita(operacao)
+
+# --- Consumo e previsão de ruptura ---
+
+# Critérios aceitos na lista de produtos mais movimentados
+CRITERIOS_MOVIMENTACAO = ("saidas", "entradas", "operacoes")
+
+# Sem o índice por dia, o planejador prefere varrer a tabela inteira na ordem de
+# produto_id para evitar ordenar o GROUP BY; com ele, só os dias da janela são lidos
+SQL_JANELA_DIARIA = 'INDEXED BY idx_movimentacoes_diarias_dia'
+
+def _inicio_janela(dias):
+    """Primeiro dia (UTC) de uma janela de `dias` dias terminando hoje."""
+    return (datetime.now(timezone.utc).date() - timedelta(days=dias - 1)).isoformat()
+
+def _dias_ate_ruptura(disponivel, saidas, dias):
+    """Dias até zerar o disponível no ritmo médio de saídas da janela (None se não houve saídas)."""
+    if not saidas:
+        return None
+    return round(max(disponivel, 0) / (saidas / dias), 1)
+
+def velocidade_produto(produto_id, dias=30):
+    """
+    Retorna o consumo de um produto nos últimos `dias` dias (média móvel
+    diária de entradas e saídas), a série diária e a previsão de ruptura.
+    Lê só os totais diários da janela, nunca as movimentações individuais.
+    """
+    conn = get_db()
+    produto = conn.execute('SELECT id, disponivel FROM produtos WHERE id = ?', (produto_id,)).fetchone()
+    if produto is None:
+        return None
+    desde = _inicio_janela(dias)
+    serie = [dict(d) for d in conn.execute(
+        'SELECT dia, entradas, saidas FROM movimentacoes_diarias WHERE produto_id = ? AND dia >= ? ORDER BY dia',
+        (produto_id, desde)
+    ).fetchall()]
+    entradas = sum(d["entradas"] for d in serie)
+    saidas = sum(d["saidas"] for d in serie)
+    return {
+        "produto_id": produto_id,
+        "dias": dias,
+        "desde": desde,
+        "entradas": entradas,
+        "saidas": saidas,
+        "media_diaria_entradas": round(entradas / dias, 2),
+        "media_diaria_saidas": round(saidas / dias, 2),
+        "disponivel": produto["disponivel"],
+        "dias_ate_ruptura": _dias_ate_ruptura(produto["disponivel"], saidas, dias),
+        "serie": serie,
+    }
+
+def previsao_ruptura(dias=30, limite=50, categoria=None):
+    """
+    Lista os produtos com saídas nos últimos `dias` dias, do que vai zerar o
+    disponível primeiro ao último, no ritmo médio de saídas da janela.
+    """
+    query = (
+        'SELECT p.id AS produto_id, p.nome, p.categoria, p.disponivel, SUM(d.saidas) AS saidas '
+        f'FROM movimentacoes_diarias d {SQL_JANELA_DIARIA} JOIN produtos p ON p.id = d.produto_id WHERE d.dia >= ?'
+    )
+    params = [_inicio_janela(dias)]
+    if categoria:
+        query += ' AND p.categoria = ?'
+        params.append(categoria)
+    query += (
+        ' GROUP BY d.produto_id HAVING SUM(d.saidas) > 0 '
+        'ORDER BY MAX(p.disponivel, 0) * 1.0 / SUM(d.saidas), p.id LIMIT ?'
+    )
+    params.append(limite)
+    produtos = [dict(p) for p in get_db().execute(query, params).fetchall()]
+    for produto in produtos:
+        produto["media_diaria_saidas"] = round(produto["saidas"] / dias, 2)
+        produto["dias_ate_ruptura"] = _dias_ate_ruptura(produto["disponivel"], produto["saidas"], dias)
+    return produtos
+
+def produtos_mais_movimentados(dias=30, limite=10, criterio="saidas"):
+    """Lista os produtos com mais saídas, entradas ou operações nos últimos `dias` dias."""
+    if criterio not in CRITERIOS_MOVIMENTACAO:
+        raise ValueError(f"Critério inválido: {criterio}")
+    return [dict(p) for p in get_db().execute(
+        'SELECT p.id AS produto_id, p.nome, p.categoria, SUM(d.entradas) AS entradas, '
+        'SUM(d.saidas) AS saidas, SUM(d.operacoes) AS operacoes '
+        f'FROM movimentacoes_diarias d {SQL_JANELA_DIARIA} JOIN produtos p ON p.id = d.produto_id WHERE d.dia >= ? '
+        f'GROUP BY d.produto_id ORDER BY {criterio} DESC, p.id LIMIT ?',
+        (_inicio_janela(dias), limite)
+    ).fetchall()]
+
+def velocidade_categorias(dias=30):
+    """
+    Retorna, por categoria, as entradas e saídas dos últimos `dias` dias, a
+    média diária de saídas e por quantos dias o estoque atual da categoria
+    (do resumo por categoria) dura nesse ritmo.
+    """
+    categorias = [dict(c) for c in get_db().execute(
+        'SELECT c.categoria, SUM(c.entradas) AS entradas, SUM(c.saidas) AS saidas, '
+        'COALESCE(MAX(r.total_unidades), 0) AS total_unidades '
+        'FROM movimentacoes_diarias_categorias c LEFT JOIN resumo_categorias r ON r.categoria = c.categoria '
+        'WHERE c.dia >= ? GROUP BY c.categoria ORDER BY c.categoria',
+        (_inicio_janela(dias),)
+    ).fetchall()]
+    for categoria in categorias:
+        categoria["media_diaria_saidas"] = round(categoria["saidas"] / dias, 2)
+        categoria["dias_ate_ruptura"] = _dias_ate_ruptura(categoria["total_unidades"], categoria["saidas"], dias)
+    return categorias
+
+# --- Reservas de estoque ---
+
+# Prazo padrão e máximo (em segundos) de uma reserva
+TTL_RESERVA_PADRAO = 900
+TTL_RESERVA_MAXIMO = 86400
+
+def reservar_estoque(produto_id, quantidade, ttl=None):
+    """
+    Reserva unidades do produto por `ttl` segundos. A reserva só é aceita se
+    houver disponível (quantidade - reservado) suficiente, checado no próprio UPDATE.
+    """
+    ttl = TTL_RESERVA_PADRAO if ttl is None else ttl
+    erro = _validar_operacao_estoque("saida", quantidade)
+    if not erro and (isinstance(ttl, bool) or not isinstance(ttl, int) or not 1 <= ttl <= TTL_RESERVA_MAXIMO):
+        erro = f"O prazo da reserva (ttl) deve ser um número inteiro de 1 a {TTL_RESERVA_MAXIMO} segundos."
+    if erro:
+        if obter_produto_por_id(produto_id) is None:
+            return None, "Produto não encontrado."
+        return None, erro
+
+    def operacao(conn):
+        produto = _primeira_linha(conn.execute(
+            'UPDATE produtos SET reservado = reservado + ?, atualizado_em = CURRENT_TIMESTAMP '
+            'WHERE id = ? AND quantidade - reservado >= ? RETURNING id',
+            (quantidade, produto_id, quantidade)
+        ))
+        if produto is None:
+            if conn.execute('SELECT 1 FROM produtos WHERE id = ?', (produto_id,)).fetchone() is None:
+                return None, "Produto não encontrado."
+            return None, "Estoque disponível insuficiente para a reserva."
+        return _primeira_linha(conn.execute(
+            "INSERT INTO reservas (produto_id, quantidade, expira_em) "
+            "VALUES (?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now', ?)) RETURNING *",
+            (produto_id, quantidade, f'+{ttl} seconds')
+        )), None
+
+    resultado = _executar_escrita(operacao)
+    cache_produtos.invalidar(produto_id)
+    return resultado
+
+def obter_reserva(reserva_id):
+    """Retorna uma reserva pelo seu ID."""
+    reserva = get_db().execute('SELECT * FROM reservas WHERE id = ?', (reserva_id,)).fetchone()
+    return dict(reserva) if reserva else None
+
+def _finalizar_reserva(conn, reserva_id, status):
+    """
+    Finaliza uma reserva ativa e ainda no prazo com o novo status.
+    Retorna (reserva, erro); uma reserva vencida encontrada aqui já é liberada.
+    """
+    reserva = _primeira_linha(conn.execute(
+        f"UPDATE reservas SET status = ?, finalizada_em = {SQL_AGORA} "
+        f"WHERE id = ? AND status = 'ativa' AND expira_em > {SQL_AGORA} RETURNING *",
+        (status, reserva_id)
+    ))
+    if reserva is not None:
+        return reserva, None
+
+    atual = conn.execute('SELECT status FROM reservas WHERE id = ?', (reserva_id,)).fetchone()
+    if atual is None:
+        return None, "Reserva não encontrada."
+    if atual["status"] == "ativa":
+        # Venceu e a varredura ainda não passou: libera agora
+        _liberar_reservas(conn, f"id = {int(reserva_id)}")
+        return None, "Reserva expirada."
+    return None, f"Reserva já {atual['status']}."
+
+def _invalidar_produto_da_reserva(reserva_id):
+    # A reserva vencida foi liberada pela transação que recusou a operação
+    cache_produtos.invalidar(obter_reserva(reserva_id)["produto_id"])
+
+def confirmar_reserva(reserva_id):
+    """Confirma a reserva, transformando as unidades reservadas em uma saída de estoque."""
+    def operacao(conn):
+        reserva, erro = _finalizar_reserva(conn, reserva_id, "confirmada")
+        if erro:
+            return None, erro
+        produto = _primeira_linha(conn.execute(
+            'UPDATE produtos SET quantidade = quantidade - ?, reservado = reservado - ?, '
+            'atualizado_em = CURRENT_TIMESTAMP WHERE id = ? RETURNING *',
+            (reserva["quantidade"], reserva["quantidade"], reserva["produto_id"])
+        ))
+        _registrar_movimentacao(conn, produto["id"], "saida", reserva["quantidade"], produto["quantidade"])
+        _verificar_estoque_minimo(conn, produto, produto["quantidade"] + reserva["quantidade"])
+        return {"reserva": reserva, "produto": produto}, None
+
+    resultado, erro = _executar_escrita(operacao)
+    if resultado:
+        cache_produtos.invalidar(resultado["produto"]["id"])
+    elif erro == "Reserva expirada.":
+        _invalidar_produto_da_reserva(reserva_id)
+    return resultado, erro
+
+def cancelar_reserva(reserva_id):
+    """Cancela a reserva e devolve as unidades ao disponível."""
+    def operacao(conn):
+        reserva, erro = _finalizar_reserva(conn, reserva_id, "cancelada")
+        if erro:
+            return None, erro
+        conn.execute('UPDATE produtos SET reservado = reservado - ?, atualizado_em = CURRENT_TIMESTAMP WHERE id = ?',
+                     (reserva["quantidade"], reserva["produto_id"]))
+        return reserva, None
+
+    reserva, erro = _executar_escrita(operacao)
+    if reserva:
+        cache_produtos.invalidar(reserva["produto_id"])
+    elif erro == "Reserva expirada.":
+        _invalidar_produto_da_reserva(reserva_id)
+    return reserva, erro
+
+def _liberar_reservas(conn, condicao, limite=-1):
+    """Marca como expiradas as reservas ativas vencidas que atendem à condição e devolve as unidades."""
+    liberadas = conn.execute(
+        f"UPDATE reservas SET status = 'expirada', finalizada_em = {SQL_AGORA} WHERE id IN ("
+        f"SELECT id FROM reservas WHERE status = 'ativa' AND expira_em <= {SQL_AGORA} AND {condicao} "
+        "ORDER BY expira_em LIMIT ?) RETURNING produto_id, quantidade",
+        (limite,)
+    ).fetchall()
+    por_produto = {}
+    for reserva in liberadas:
+        por_produto[reserva["produto_id"]] = por_produto.get(reserva["produto_id"], 0) + reserva["quantidade"]
+    conn.executemany('UPDATE produtos SET reservado = reservado - ?, atualizado_em = CURRENT_TIMESTAMP WHERE id = ?',
+                     [(quantidade, produto_id) for produto_id, quantidade in por_produto.items()])
+    return len(liberadas), list(por_produto)
+
+def liberar_reservas_expiradas(limite=500):
+    """
+    Libera em uma transação até `limite` reservas vencidas, usando o índice
+    parcial das reservas ativas. Retorna quantas foram liberadas.
+    """
+    # Verificação só de leitura antes: sem reservas vencidas, nenhuma transação de escrita é aberta
+    if get_db().execute(
+        f"SELECT 1 FROM reservas WHERE status = 'ativa' AND expira_em <= {SQL_AGORA} LIMIT 1"
+    ).fetchone() is None:
+        return 0
+    liberadas, produtos = _executar_escrita(lambda conn: _liberar_reservas(conn, "1", limite))
+    if produtos:
+        cache_produtos.invalidar(*produtos)
+    return liberadas
+
+# --- Mudanças de produtos ---
+
+def ultima_mudanca():
+    """Retorna o número de sequência da mudança mais recente (0 se não houver)."""
+    return get_db().execute('SELECT COALESCE(MAX(seq), 0) FROM mudancas').fetchone()[0]
+
+def listar_mudancas(desde=0, limite=1000):
+    """
+    Lista as mudanças de produtos com sequência maior que `desde`, em ordem.
+    Cada mudança traz o estado atual do produto (None se ele já foi removido).
+    """
+    cursor = get_db().execute(
+        'SELECT m.seq, m.tipo, m.produto_id, m.criado_em, p.* FROM mudancas m '
+        'LEFT JOIN produtos p ON p.id = m.produto_id WHERE m.seq > ? ORDER BY m.seq LIMIT ?',
+        (desde, limite)
+    )
+    colunas = [c[0] for c in cursor.description[4:]]
+    mudancas = []
+    for linha in cursor.fetchall():
+        produto = dict(zip(colunas, tuple(linha)[4:])) if linha["id"] is not None else None
+        mudancas.append({"seq": linha["seq"], "tipo": linha["tipo"], "produto_id": linha["produto_id"],
+                         "criado_em": linha["criado_em"], "produto": produto})
+    return mudancas
+
+def aguardar_mudancas(desde, timeout):
+    """
+    Bloqueia até existir uma mudança depois de `desde` ou até `timeout`
+    segundos. Acorda a cada escrita deste processo e, no máximo a cada
+    INTERVALO_VERIFICACAO_MUDANCAS, consulta a tabela. Retorna a última sequência.
+    """
+    prazo = time.monotonic() + timeout
+    while True:
+        with _sinal_escritas:
+            vistas = _total_escritas
+        ultima = ultima_mudanca()
+        restante = prazo - time.monotonic()
+        if ultima > desde or restante <= 0:
+            return ultima
+        with _sinal_escritas:
+            _sinal_escritas.wait_for(lambda: _total_escritas != vistas,
+                                     timeout=min(restante, INTERVALO_VERIFICACAO_MUDANCAS))
+
+# --- Armazéns ---
+
+# Armazém original, cujo estoque é a coluna produtos.quantidade do banco principal
+ARMAZEM_PRINCIPAL = "principal"
+_CODIGO_ARMAZEM = re.compile(r'^[a-z0-9_]{1,32}$')
+
+def _codigos_armazens():
+    """Códigos dos armazéns com arquivo próprio (todos exceto o principal)."""
+    return [a["codigo"] for a in get_db().execute('SELECT codigo FROM armazens ORDER BY codigo').fetchall()]
+
+def listar_armazens():
+    """Lista os armazéns, começando pelo principal."""
+    armazens = [dict(a) for a in get_db().execute('SELECT codigo, nome FROM armazens ORDER BY codigo').fetchall()]
+    return [{"codigo": ARMAZEM_PRINCIPAL, "nome": "Principal"}] + armazens
+
+def criar_armazem(dados):
+    """Cadastra um armazém e cria o arquivo SQLite com o estoque dele."""
+    codigo = dados.get("codigo")
+    nome = dados.get("nome")
+    if not isinstance(codigo, str) or not _CODIGO_ARMAZEM.match(codigo):
+        return None, "O código do armazém deve ter de 1 a 32 letras minúsculas, números ou '_'."
+    if not isinstance(nome, str) or not nome.strip():
+        return None, "O campo 'nome' não pode ser vazio."
+    if codigo == ARMAZEM_PRINCIPAL:
+        return None, "Armazém já cadastrado."
+
+    limite = limite_armazens(get_db())
+
+    def operacao(conn):
+        # Contado dentro da transação de escrita: cadastros simultâneos não passam do limite
+        if conn.execute('SELECT COUNT(*) FROM armazens').fetchone()[0] >= limite:
+            return f"Limite de {limite} armazéns atingido."
+        conn.execute('INSERT INTO armazens (codigo, nome) VALUES (?, ?)', (codigo, nome.strip()))
+        return None
+
+    try:
+        erro = _executar_escrita(operacao)
+    except sqlite3.IntegrityError:
+        return None, "Armazém já cadastrado."
+    if erro:
+        return None, erro
+    anexar_armazens(get_db(), [codigo])
+    return {"codigo": codigo, "nome": nome.strip()}, None
+
+def _aplicar_movimento_armazem(conn, codigo, produto_id, tipo, quantidade):
+    """
+    Aplica uma operação já validada no estoque de um armazém com arquivo próprio.
+    Só escreve no arquivo do armazém; o banco principal é apenas lido.
+    """
+    if conn.execute('SELECT 1 FROM main.produtos WHERE id = ?', (produto_id,)).fetchone() is None:
         return None, "Produto não encontrado."
 
-    if not isinstance(quantidade, int) or quantidade <= 0:
-        return None, "A quantidade deve ser um número inteiro positivo."
-        
-    nova_quantidade = produto["quantidade"]
+    esquema = f'armazem_{codigo}'
     if tipo == "entrada":
-        nova_quantidade += quantidade
-    elif tipo == "saida":
-        if produto["quantidade"] < quantidade:
-            return None, "Estoque insuficiente para a saída."
-        nova_quantidade -= quantidade
+        estoque = _primeira_linha(conn.execute(
+            f'INSERT INTO {esquema}.estoque (produto_id, quantidade) VALUES (?, ?) '
+            'ON CONFLICT (produto_id) DO UPDATE SET quantidade = quantidade + excluded.quantidade, '
+            'atualizado_em = CURRENT_TIMESTAMP RETURNING quantidade',
+            (produto_id, quantidade)
+        ))
     else:
-        return None, "Tipo de operação inválida. Use 'entrada' ou 'saida'."
+        estoque = _primeira_linha(conn.execute(
+            f'UPDATE {esquema}.estoque SET quantidade = quantidade - ?, atualizado_em = CURRENT_TIMESTAMP '
+            'WHERE produto_id = ? AND quantidade >= ? RETURNING quantidade',
+            (quantidade, produto_id, quantidade)
+        ))
+        if estoque is None:
+            return None, "Estoque insuficiente para a saída."
 
-    conn = get_db_connection()
-    conn.execute('UPDATE produtos SET quantidade = ? WHERE id = ?', (nova_quantidade, produto_id))
-    conn.commit()
-    conn.close()
-    
-    return obter_produto_por_id(produto_id), None
\ No newline at end of file
+    conn.execute(
+        f'INSERT INTO {esquema}.movimentacoes (produto_id, tipo, quantidade) VALUES (?, ?, ?)',
+        (produto_id, tipo, quantidade)
+    )
+    return {"produto_id": produto_id, "armazem": codigo, "quantidade": estoque["quantidade"]}, None
+
+def _movimentar(conn, codigo, produto_id, tipo, quantidade):
+    """Aplica a operação no armazém informado, seja ele o principal ou não."""
+    if codigo != ARMAZEM_PRINCIPAL:
+        return _aplicar_movimento_armazem(conn, codigo, produto_id, tipo, quantidade)
+    produto, erro = _aplicar_movimento(conn, produto_id, tipo, quantidade)
+    if erro:
+        return None, erro
+    return {"produto_id": produto_id, "armazem": codigo, "quantidade": produto["quantidade"]}, None
+
+def _validar_armazens(*codigos):
+    """Retorna a mensagem de erro se algum dos armazéns não existir, ou None."""
+    existentes = set(_codigos_armazens()) | {ARMAZEM_PRINCIPAL}
+    if any(not isinstance(codigo, str) or codigo not in existentes for codigo in codigos):
+        return "Armazém não encontrado."
+    return None
+
+def registrar_operacao_estoque_armazem(produto_id, codigo, tipo, quantidade):
+    """Registra entrada ou saída no estoque de um armazém específico."""
+    erro = _validar_armazens(codigo) or _validar_operacao_estoque(tipo, quantidade)
+    if erro:
+        if obter_produto_por_id(produto_id) is None:
+            return None, "Produto não encontrado."
+        return None, erro
+
+    armazens = [] if codigo == ARMAZEM_PRINCIPAL else [codigo]
+    resultado = _executar_escrita(lambda conn: _movimentar(conn, codigo, produto_id, tipo, quantidade), armazens,
+                                  escreve_principal=codigo == ARMAZEM_PRINCIPAL)
+    if codigo == ARMAZEM_PRINCIPAL:
+        cache_produtos.invalidar(produto_id)
+    return resultado
+
+# Transferências pendentes há menos tempo que isto (segundos) ainda podem estar em andamento
+IDADE_MINIMA_RECUPERACAO = 30
+
+def _marcar_etapa(conn, codigo, transferencia_id, etapa, aplicada=1):
+    """
+    Grava a etapa da transferência no banco do armazém `codigo`, na mesma
+    transação do movimento. Retorna False se a etapa já estava gravada: cada
+    etapa é aplicada (ou cancelada) uma única vez, mesmo repetida na recuperação.
+    """
+    esquema = 'main' if codigo == ARMAZEM_PRINCIPAL else f'armazem_{codigo}'
+    return bool(conn.execute(
+        f'INSERT INTO {esquema}.transferencias_etapas (transferencia_id, etapa, aplicada) VALUES (?, ?, ?) '
+        'ON CONFLICT DO NOTHING RETURNING 1',
+        (transferencia_id, etapa, aplicada)
+    ).fetchall())
+
+def _escrever_no_armazem(operacao, codigo):
+    """Executa `operacao` em uma transação que só escreve no banco do armazém `codigo`."""
+    if codigo == ARMAZEM_PRINCIPAL:
+        return _executar_escrita(operacao)
+    return _executar_escrita(operacao, [codigo], escreve_principal=False)
+
+def _etapa_transferencia(transferencia, etapa):
+    """Aplica a saída na origem ou a entrada no destino, uma transação no arquivo do armazém."""
+    codigo = transferencia["origem"] if etapa == "saida" else transferencia["destino"]
+
+    def operacao(conn):
+        conn.execute('SAVEPOINT transferencia')
+        if not _marcar_etapa(conn, codigo, transferencia["id"], etapa):
+            conn.execute('RELEASE transferencia')
+            return None, None
+        movimento, erro = _movimentar(conn, codigo, transferencia["produto_id"], etapa, transferencia["quantidade"])
+        if erro:
+            conn.execute('ROLLBACK TO transferencia')
+        conn.execute('RELEASE transferencia')
+        return movimento, erro
+
+    return _escrever_no_armazem(operacao, codigo)
+
+def _finalizar_transferencia(transferencia_id, situacao):
+    _executar_escrita(lambda conn: conn.execute(
+        "UPDATE transferencias SET situacao = ? WHERE id = ? AND situacao = 'pendente'", (situacao, transferencia_id)
+    ))
+
+def transferir_estoque(produto_id, origem, destino, quantidade):
+    """
+    Transfere unidades de um produto entre dois armazéns: uma saída na origem
+    e uma entrada no destino, cada uma no seu histórico.
+
+    O SQLite não garante atomicidade em um commit que envolve vários arquivos
+    em modo WAL, então a transferência não é uma única transação. Ela é
+    registrada como pendente no banco principal e cada etapa é uma transação
+    só no arquivo do seu armazém, que grava junto a marca da etapa. Se o
+    processo cair no meio, `recuperar_transferencias` conclui a entrada de
+    uma saída já feita ou cancela a transferência, sem perder unidades.
+    """
+    erro = _validar_produto_id(produto_id)
+    if erro:
+        return None, erro
+    erro = _validar_armazens(origem, destino) or _validar_operacao_estoque("saida", quantidade)
+    if not erro and origem == destino:
+        erro = "Origem e destino da transferência devem ser diferentes."
+    if erro:
+        if obter_produto_por_id(produto_id) is None:
+            return None, "Produto não encontrado."
+        return None, erro
+
+    transferencia = {"produto_id": produto_id, "origem": origem, "destino": destino, "quantidade": quantidade}
+    transferencia["id"] = _executar_escrita(lambda conn: conn.execute(
+        'INSERT INTO transferencias (produto_id, origem, destino, quantidade) VALUES (?, ?, ?, ?) RETURNING id',
+        (produto_id, origem, destino, quantidade)
+    ).fetchone()[0])
+
+    saida, erro = _etapa_transferencia(transferencia, "saida")
+    if saida is None:
+        _finalizar_transferencia(transferencia["id"], "cancelada")
+        return None, erro or "Transferência cancelada pela recuperação."
+    entrada, erro = _etapa_transferencia(transferencia, "entrada")
+    cache_produtos.invalidar(produto_id)
+    if erro:
+        # A saída já foi feita; a transferência fica pendente para a recuperação
+        return None, erro
+    _finalizar_transferencia(transferencia["id"], "concluida")
+    return {"id": transferencia["id"], "produto_id": produto_id, "quantidade": quantidade,
+            "origem": saida, "destino": entrada}, None
+
+def recuperar_transferencias(idade_minima=IDADE_MINIMA_RECUPERACAO):
+    """
+    Finaliza as transferências pendentes há mais de `idade_minima` segundos,
+    interrompidas por uma queda entre as etapas. Se a saída foi gravada na
+    origem, aplica a entrada no destino (se ainda não estiver lá) e conclui;
+    senão grava a saída como cancelada, o que impede que ela ainda aconteça,
+    e cancela. Retorna a quantidade de transferências concluídas e canceladas.
+    """
+    pendentes = [dict(t) for t in get_db().execute(
+        "SELECT id, produto_id, origem, destino, quantidade FROM transferencias "
+        "WHERE situacao = 'pendente' AND criado_em <= datetime('now', ?) ORDER BY id",
+        (f'-{int(idade_minima)} seconds',)
+    ).fetchall()]
+    concluidas = canceladas = 0
+    for transferencia in pendentes:
+        origem = transferencia["origem"]
+        esquema = 'main' if origem == ARMAZEM_PRINCIPAL else f'armazem_{origem}'
+
+        def reivindicar_saida(conn):
+            _marcar_etapa(conn, origem, transferencia["id"], "saida", aplicada=0)
+            return conn.execute(
+                f"SELECT aplicada FROM {esquema}.transferencias_etapas WHERE transferencia_id = ? AND etapa = 'saida'",
+                (transferencia["id"],)
+            ).fetchone()[0]
+
+        if not _escrever_no_armazem(reivindicar_saida, origem):
+            _finalizar_transferencia(transferencia["id"], "cancelada")
+            canceladas += 1
+            continue
+        _, erro = _etapa_transferencia(transferencia, "entrada")
+        if erro:
+            continue
+        cache_produtos.invalidar(transferencia["produto_id"])
+        _finalizar_transferencia(transferencia["id"], "concluida")
+        concluidas += 1
+    return concluidas, canceladas
+
+def estoque_por_armazem(produto_id):
+    """
+    Retorna o estoque do produto em cada armazém e o total geral. Cada armazém
+    é uma busca pela chave primária no seu arquivo, somadas em uma só consulta.
+    """
+    armazens = _codigos_armazens()
+    conn = get_db()
+    anexar_armazens(conn, armazens)
+    partes = ["SELECT ? AS armazem, quantidade FROM main.produtos WHERE id = ?"]
+    params = [ARMAZEM_PRINCIPAL, produto_id]
+    for codigo in armazens:
+        partes.append(f"SELECT ?, quantidade FROM armazem_{codigo}.estoque WHERE produto_id = ?")
+        params += [codigo, produto_id]
+    linhas = [dict(l) for l in conn.execute(' UNION ALL '.join(partes), params).fetchall()]
+    if not linhas or linhas[0]["armazem"] != ARMAZEM_PRINCIPAL:
+        return None
+    return {"produto_id": produto_id, "armazens": linhas, "total": sum(l["quantidade"] for l in linhas)}
+
+def totais_por_armazem():
+    """
+    Retorna produtos e unidades em estoque por armazém e no geral, lidos dos
+    resumos mantidos por triggers (resumo_categorias e o resumo de cada armazém).
+    """
+    armazens = _codigos_armazens()
+    conn = get_db()
+    anexar_armazens(conn, armazens)
+    partes = ["SELECT ? AS armazem, COALESCE(SUM(total_produtos), 0) AS total_produtos, "
+              "COALESCE(SUM(total_unidades), 0) AS total_unidades FROM main.resumo_categorias"]
+    params = [ARMAZEM_PRINCIPAL]
+    for codigo in armazens:
+        partes.append(f"SELECT ?, total_produtos, total_unidades FROM armazem_{codigo}.resumo")
+        params.append(codigo)
+    linhas = [dict(l) for l in conn.execute(' UNION ALL '.join(partes), params).fetchall()]
+    total = {"total_unidades": sum(l["total_unidades"] for l in linhas)}
+    return {"armazens": linhas, "total": total}
@@ -1,11 +1,226 @@
-from flask import Blueprint, jsonify, request
+import csv
+import gzip
+import io
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+
+from flask import Blueprint, Response, current_app, json, jsonify, request, stream_with_context
+from werkzeug.routing import IntegerConverter
+from importar import FORMATOS, abrir_texto, importar_produtos
+from metricas import registro
 from models import (
-    criar_produto, listar_produtos, obter_produto_por_id,
-    atualizar_produto, remover_produto, registrar_operacao_estoque
+    cache_produtos, colunas_produtos, criar_produto, listar_produtos, iterar_produtos, obter_produto_por_id,
+    obter_produtos_por_ids,
+    listar_movimentacoes, saldo_em, resumo_estoque, listar_produtos_baixo_estoque, listar_alertas_estoque,
+    atualizar_produto, remover_produto, registrar_operacao_estoque,
+    registrar_operacoes_estoque_lote, listar_armazens, criar_armazem, registrar_operacao_estoque_armazem,
+    transferir_estoque, estoque_por_armazem, totais_por_armazem, listar_mudancas, aguardar_mudancas,
+    reservar_estoque, obter_reserva, confirmar_reserva, cancelar_reserva, verificar_banco,
+    CRITERIOS_MOVIMENTACAO, velocidade_produto, previsao_ruptura, produtos_mais_movimentados,
+    velocidade_categorias, banco_ocupado
 )
 
+try:
+    import brotli
+except ImportError:  # Brotli é opcional; sem ele a negociação oferece só gzip
+    brotli = None
+
 inventario_routes = Blueprint("inventario", __name__)
 
+# Quantidade máxima de operações aceitas em um único lote de estoque
+LIMITE_OPERACOES_LOTE = 10000
+MODOS_LOTE = ("tudo_ou_nada", "melhor_esforco")
+# Tamanho máximo de página na listagem paginada de produtos
+LIMITE_PAGINA = 1000
+# Quantidade máxima de ids na busca em lote por GET (?ids=) e por POST (/produtos/consulta)
+LIMITE_IDS_GET = 1000
+LIMITE_IDS_POST = 10000
+# Janela (em dias) das análises de consumo: padrão e máximo
+JANELA_PADRAO_DIAS = 30
+JANELA_MAXIMA_DIAS = 365
+# Segundos sugeridos ao cliente (Retry-After) quando o banco continua ocupado após as tentativas
+ESPERA_BANCO_OCUPADO = 1
+# Respostas JSON menores que isto não são comprimidas (o ganho não compensa)
+TAMANHO_MINIMO_COMPRESSAO = 1024
+# Maior inteiro que o SQLite guarda (INTEGER de 64 bits com sinal)
+MAXIMO_INTEIRO_SQLITE = 2 ** 63 - 1
+
+class ConversorInteiro(IntegerConverter):
+    """Conversor <int:...> das rotas limitado a 64 bits: ids maiores dão 404, não OverflowError."""
+    def __init__(self, mapa, *args, **kwargs):
+        kwargs.setdefault('max', MAXIMO_INTEIRO_SQLITE)
+        super().__init__(mapa, *args, **kwargs)
+
+def _parametro_inteiro(nome, minimo=None, maximo=None):
+    """Lê um parâmetro inteiro da query string. Retorna (valor, erro)."""
+    valor = request.args.get(nome)
+    if valor is None:
+        return None, None
+    try:
+        valor = int(valor)
+    except ValueError:
+        return None, f"Parâmetro '{nome}' deve ser um número inteiro."
+    if minimo is not None and valor < minimo:
+        return None, f"Parâmetro '{nome}' deve ser maior ou igual a {minimo}."
+    # Valores acima de 64 bits não cabem em um parâmetro SQLite (OverflowError)
+    maximo = MAXIMO_INTEIRO_SQLITE if maximo is None else min(maximo, MAXIMO_INTEIRO_SQLITE)
+    if valor > maximo:
+        return None, f"Parâmetro '{nome}' deve ser menor ou igual a {maximo}."
+    return valor, None
+
+def _parametro_instante(nome):
+    """Lê uma data/hora ISO 8601 da query string no formato do histórico (UTC). Retorna (valor, erro)."""
+    valor = request.args.get(nome)
+    if valor is None:
+        return None, None
+    try:
+        instante = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    except ValueError:
+        return None, f"Parâmetro '{nome}' deve ser uma data/hora ISO 8601 (ex.: 2025-06-07T10:30:00)."
+    if instante.tzinfo:
+        instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    return instante.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3], None
+
+def _data_http(atualizado_em):
+    """Converte o 'atualizado_em' do banco (UTC) para datetime, usado no Last-Modified."""
+    return datetime.strptime(atualizado_em, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+def _resposta_condicional(dados, atualizado_em=None):
+    """
+    Monta a resposta JSON com ETag e Last-Modified e responde 304 quando o
+    cliente já tem a versão atual (If-None-Match). O Last-Modified é apenas
+    informativo e não é usado na validação: a data HTTP só tem precisão de
+    segundos, então uma mudança no mesmo segundo de uma leitura não a altera
+    (e, nas listas, remoções não mudam a data máxima).
+    """
+    resposta = jsonify(dados)
+    resposta.add_etag()
+    resposta.make_conditional(request)
+    if atualizado_em:
+        resposta.last_modified = _data_http(atualizado_em)
+    return resposta
+
+# Espera máxima (segundos) do long-poll e intervalo entre os comentários de keep-alive do SSE
+ESPERA_MAXIMA_MUDANCAS = 60
+INTERVALO_KEEPALIVE_SSE = 15
+# Segundos sugeridos ao cliente (Retry-After) quando todos os fluxos SSE do worker estão ocupados
+ESPERA_FLUXO_SSE = 30
+
+def _gerar_eventos_mudancas(desde):
+    """Gera o fluxo SSE: envia as mudanças pendentes e espera pelas próximas."""
+    yield "retry: 3000\n\n"
+    while True:
+        mudancas = listar_mudancas(desde, LIMITE_PAGINA)
+        for mudanca in mudancas:
+            yield f"id: {mudanca['seq']}\nevent: {mudanca['tipo']}\ndata: {json.dumps(mudanca)}\n\n"
+        if mudancas:
+            desde = mudancas[-1]["seq"]
+        elif aguardar_mudancas(desde, INTERVALO_KEEPALIVE_SSE) <= desde:
+            # Comentário SSE: mantém a conexão viva e detecta clientes desconectados
+            yield ": keep-alive\n\n"
+
+# Tamanho aproximado (em bytes) de cada bloco enviado na exportação
+TAMANHO_BLOCO_EXPORTACAO = 64 * 1024
+
+def _gerar_csv(colunas, produtos):
+    """Gera o CSV em blocos de texto, começando pelo cabeçalho."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(colunas)
+    for produto in produtos:
+        escritor.writerow([produto[coluna] for coluna in colunas])
+        if buffer.tell() >= TAMANHO_BLOCO_EXPORTACAO:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _gerar_ndjson(produtos):
+    """Gera um objeto JSON por linha, agrupando as linhas em blocos."""
+    bloco = []
+    tamanho = 0
+    for produto in produtos:
+        linha = json.dumps(produto) + '\n'
+        bloco.append(linha)
+        tamanho += len(linha)
+        if tamanho >= TAMANHO_BLOCO_EXPORTACAO:
+            yield ''.join(bloco)
+            bloco, tamanho = [], 0
+    yield ''.join(bloco)
+
+def _comprimir_gzip(blocos):
+    """Comprime em gzip bloco a bloco, liberando cada parte assim que é gerada."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for bloco in blocos:
+        dados = compressor.compress(bloco.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+def _colunar(produtos):
+    """Formato colunar: nomes das colunas uma vez e um array de valores por coluna."""
+    colunas = list(produtos[0]) if produtos else colunas_produtos()
+    return {"colunas": colunas, "valores": [[produto[coluna] for produto in produtos] for coluna in colunas]}
+
+def _formato_colunar():
+    return request.args.get('formato') == 'colunar'
+
+def _resposta_lote(ids):
+    """Resposta da busca em lote: produtos na ordem pedida e os ids não encontrados."""
+    produtos = obter_produtos_por_ids(ids)
+    encontrados = {produto["id"] for produto in produtos}
+    nao_encontrados = [produto_id for produto_id in dict.fromkeys(ids) if produto_id not in encontrados]
+    dados = {
+        "produtos": _colunar(produtos) if _formato_colunar() else produtos,
+        "nao_encontrados": nao_encontrados,
+    }
+    atualizado_em = max((p["atualizado_em"] for p in produtos), default=None)
+    return _resposta_condicional(dados, atualizado_em)
+
+@inventario_routes.errorhandler(sqlite3.OperationalError)
+def _banco_ocupado(erro):
+    """
+    Escrita que esgotou as tentativas com o banco travado por outro processo:
+    responde 503 com Retry-After, para o cliente repetir, em vez de um erro 500.
+    """
+    if not banco_ocupado(erro):
+        raise erro
+    resposta = jsonify({"erro": "Banco de dados ocupado. Tente novamente em instantes."})
+    resposta.headers['Retry-After'] = str(ESPERA_BANCO_OCUPADO)
+    return resposta, 503
+
+@inventario_routes.after_request
+def _negociar_compressao(resposta):
+    """
+    Comprime respostas JSON com Brotli ou gzip, conforme o Accept-Encoding.
+    Respostas em streaming, pequenas ou já codificadas passam intactas.
+    """
+    if (resposta.direct_passthrough or resposta.is_streamed or resposta.status_code != 200
+            or resposta.mimetype != 'application/json' or 'Content-Encoding' in resposta.headers):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    corpo = resposta.get_data()
+    if len(corpo) < TAMANHO_MINIMO_COMPRESSAO:
+        return resposta
+    codificacao = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if codificacao is None:
+        return resposta
+    resposta.set_data(brotli.compress(corpo) if codificacao == 'br' else gzip.compress(corpo, 6))
+    resposta.headers['Content-Encoding'] = codificacao
+    # O ETag identifica o corpo sem compressão; a versão comprimida só é equivalente
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+def _gerar_array_json(itens):
+    """Gera um array JSON elemento por elemento, sem montar a lista em memória."""
+    yield '['
+    for indice, item in enumerate(itens):
+        yield (',' if indice else '') + json.dumps(item)
+    yield ']'
+
 # Rota para criar um novo produto (POST /produtos)
 @inventario_routes.route("/produtos", methods=["POST"])
 def rota_criar_produto():
@@ -24,16 +239,128 @@ def rota_criar_produto():
 def rota_listar_produtos():
     nome = request.args.get('nome')
     categoria = request.args.get('categoria')
-    
-    produtos = listar_produtos(nome=nome, categoria=categoria)
-    return jsonify(produtos), 200
+
+    # Busca em lote por ids (?ids=1,2,3): uma única consulta para todos os ids
+    if 'ids' in request.args:
+        try:
+            ids = [int(valor) for valor in request.args['ids'].split(',')]
+        except ValueError:
+            return jsonify({"erro": "Parâmetro 'ids' deve ser uma lista de inteiros separados por vírgula."}), 400
+        if len(ids) > LIMITE_IDS_GET:
+            return jsonify({"erro": f"Parâmetro 'ids' aceita no máximo {LIMITE_IDS_GET} ids."}), 400
+        return _resposta_lote(ids)
+
+    # Modo streaming: envia o array JSON à medida que as páginas são lidas
+    if request.args.get('stream') in ('1', 'true'):
+        produtos = iterar_produtos(nome=nome, categoria=categoria)
+        return Response(stream_with_context(_gerar_array_json(produtos)), mimetype='application/json')
+
+    limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    cursor, erro = _parametro_inteiro('cursor', 0)
+    if erro:
+        return jsonify({"erro": erro}), 400
+
+    # Sem 'limit' nem 'cursor' mantém a resposta original (lista completa)
+    if limite is None and cursor is None:
+        produtos = listar_produtos(nome=nome, categoria=categoria)
+        dados = _colunar(produtos) if _formato_colunar() else produtos
+    else:
+        limite = limite or LIMITE_PAGINA
+        produtos = listar_produtos(nome=nome, categoria=categoria, limite=limite, apos_id=cursor)
+        next_cursor = str(produtos[-1]["id"]) if len(produtos) == limite else None
+        dados = {"produtos": _colunar(produtos) if _formato_colunar() else produtos, "next_cursor": next_cursor}
+
+    atualizado_em = max((p["atualizado_em"] for p in produtos), default=None)
+    return _resposta_condicional(dados, atualizado_em)
+
+# Rota para buscar vários produtos de uma vez (POST /produtos/consulta com {"ids": [...]})
+@inventario_routes.route("/produtos/consulta", methods=["POST"])
+def rota_consultar_produtos():
+    dados = request.get_json(silent=True)
+    ids = dados.get("ids") if isinstance(dados, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({"erro": "Corpo deve conter 'ids' como uma lista de inteiros."}), 400
+    if len(ids) > LIMITE_IDS_POST:
+        return jsonify({"erro": f"A consulta aceita no máximo {LIMITE_IDS_POST} ids."}), 400
+    return _resposta_lote(ids)
+
+# Rota com as mudanças de produtos após uma sequência (GET /produtos/mudancas?desde=<seq>)
+@inventario_routes.route("/produtos/mudancas", methods=["GET"])
+def rota_mudancas_produtos():
+    desde, erro = _parametro_inteiro('desde', 0)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    # Reconexões do EventSource informam o último evento recebido neste cabeçalho
+    ultimo_evento = request.headers.get('Last-Event-ID', '')
+    if ultimo_evento.isascii() and ultimo_evento.isdigit() and int(ultimo_evento) <= MAXIMO_INTEIRO_SQLITE:
+        desde = int(ultimo_evento)
+    elif desde is None:
+        desde = 0
+
+    if request.args.get('stream') == 'sse':
+        # Cada fluxo prende uma thread do worker; acima do limite o cliente deve usar o long-poll
+        fluxos = current_app.extensions['fluxos_sse']
+        if not fluxos.acquire(blocking=False):
+            resposta = jsonify({"erro": "Limite de fluxos SSE atingido. Use o long-poll (?espera=)."})
+            resposta.headers['Retry-After'] = str(ESPERA_FLUXO_SSE)
+            return resposta, 503
+        resposta = Response(stream_with_context(_gerar_eventos_mudancas(desde)), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # Libera a vaga quando o servidor fecha a resposta (fim do fluxo ou cliente desconectado)
+        resposta.call_on_close(fluxos.release)
+        return resposta
+
+    limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    espera, erro = _parametro_inteiro('espera', 0, ESPERA_MAXIMA_MUDANCAS)
+    if erro:
+        return jsonify({"erro": erro}), 400
+
+    # Long-poll: sem mudanças pendentes, segura a resposta até a próxima ou até 'espera' segundos
+    if espera:
+        aguardar_mudancas(desde, espera)
+    mudancas = listar_mudancas(desde, limite or LIMITE_PAGINA)
+    ultimo_seq = mudancas[-1]["seq"] if mudancas else desde
+    return jsonify({"mudancas": mudancas, "ultimo_seq": ultimo_seq}), 200
+
+# Rota com os produtos abaixo do estoque mínimo (GET /produtos/baixo-estoque)
+@inventario_routes.route("/produtos/baixo-estoque", methods=["GET"])
+def rota_produtos_baixo_estoque():
+    limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    cursor, erro = _parametro_inteiro('cursor', 0)
+    if erro:
+        return jsonify({"erro": erro}), 400
+
+    limite = limite or LIMITE_PAGINA
+    produtos = listar_produtos_baixo_estoque(limite=limite, apos_id=cursor)
+    next_cursor = str(produtos[-1]["id"]) if len(produtos) == limite else None
+    return jsonify({"produtos": produtos, "next_cursor": next_cursor}), 200
+
+# Rota com os alertas de estoque mínimo gravados após o alerta 'desde' (GET /alertas/estoque)
+@inventario_routes.route("/alertas/estoque", methods=["GET"])
+def rota_alertas_estoque():
+    desde, erro = _parametro_inteiro('desde', 0)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if erro:
+        return jsonify({"erro": erro}), 400
+
+    alertas = listar_alertas_estoque(apos_id=desde, limite=limite or 100)
+    ultimo = alertas[-1]["id"] if alertas else (desde or 0)
+    return jsonify({"alertas": alertas, "ultimo": ultimo}), 200
 
 # Rota para obter um produto por ID (GET /produtos/<id>)
 @inventario_routes.route("/produtos/<int:produto_id>", methods=["GET"])
 def rota_obter_produto(produto_id):
     produto = obter_produto_por_id(produto_id)
     if produto:
-        return jsonify(produto), 200
+        return _resposta_condicional(produto, produto["atualizado_em"])
     return jsonify({"erro": "Produto não encontrado"}), 404
 
 # Rota para atualizar um produto (PUT /produtos/<id>)
@@ -75,4 +402,274 @@ def rota_operacao_estoque(produto_id):
     if erro:
         return jsonify({"erro": erro}), 400
     
-    return jsonify(produto), 200
\ No newline at end of file
+    return jsonify(produto), 200
+
+# Rota com o estoque do produto em cada armazém e o total (GET /produtos/<id>/estoque)
+@inventario_routes.route("/produtos/<int:produto_id>/estoque", methods=["GET"])
+def rota_estoque_por_armazem(produto_id):
+    estoque = estoque_por_armazem(produto_id)
+    if estoque is None:
+        return jsonify({"erro": "Produto não encontrado"}), 404
+    return jsonify(estoque), 200
+
+# Rota para operações de estoque em um armazém (POST /produtos/<id>/estoque/<armazem>)
+@inventario_routes.route("/produtos/<int:produto_id>/estoque/<armazem>", methods=["POST"])
+def rota_operacao_estoque_armazem(produto_id, armazem):
+    dados = request.get_json()
+    if not dados or "tipo" not in dados or "quantidade" not in dados:
+        return jsonify({"erro": "Campos 'tipo' e 'quantidade' são obrigatórios."}), 400
+
+    estoque, erro = registrar_operacao_estoque_armazem(produto_id, armazem, dados["tipo"], dados["quantidade"])
+    if erro in ("Produto não encontrado.", "Armazém não encontrado."):
+        return jsonify({"erro": erro}), 404
+    if erro:
+        return jsonify({"erro": erro}), 400
+    return jsonify(estoque), 200
+
+# Rota para transferência de estoque entre armazéns (POST /estoque/transferencias)
+@inventario_routes.route("/estoque/transferencias", methods=["POST"])
+def rota_transferir_estoque():
+    dados = request.get_json()
+    campos = ("produto_id", "origem", "destino", "quantidade")
+    if not isinstance(dados, dict) or not all(campo in dados for campo in campos):
+        return jsonify({"erro": "Campos 'produto_id', 'origem', 'destino' e 'quantidade' são obrigatórios."}), 400
+
+    transferencia, erro = transferir_estoque(dados["produto_id"], dados["origem"], dados["destino"], dados["quantidade"])
+    if erro in ("Produto não encontrado.", "Armazém não encontrado."):
+        return jsonify({"erro": erro}), 404
+    if erro:
+        return jsonify({"erro": erro}), 400
+    return jsonify(transferencia), 200
+
+# Rotas de armazéns (GET/POST /armazens)
+@inventario_routes.route("/armazens", methods=["GET"])
+def rota_listar_armazens():
+    return jsonify(listar_armazens()), 200
+
+@inventario_routes.route("/armazens", methods=["POST"])
+def rota_criar_armazem():
+    dados = request.get_json()
+    if not dados:
+        return jsonify({"erro": "Corpo da requisição não pode ser vazio"}), 400
+    armazem, erro = criar_armazem(dados)
+    if erro == "Armazém já cadastrado." or (erro or "").startswith("Limite de"):
+        return jsonify({"erro": erro}), 409
+    if erro:
+        return jsonify({"erro": erro}), 400
+    return jsonify(armazem), 201
+
+# Rota para reservar estoque por um prazo (POST /produtos/<id>/reservas)
+@inventario_routes.route("/produtos/<int:produto_id>/reservas", methods=["POST"])
+def rota_reservar_estoque(produto_id):
+    dados = request.get_json()
+    if not dados or "quantidade" not in dados:
+        return jsonify({"erro": "Campo 'quantidade' é obrigatório."}), 400
+
+    reserva, erro = reservar_estoque(produto_id, dados["quantidade"], dados.get("ttl"))
+    if erro == "Produto não encontrado.":
+        return jsonify({"erro": erro}), 404
+    if erro:
+        return jsonify({"erro": erro}), 400
+    return jsonify(reserva), 201
+
+# Rota para consultar uma reserva (GET /reservas/<id>)
+@inventario_routes.route("/reservas/<int:reserva_id>", methods=["GET"])
+def rota_obter_reserva(reserva_id):
+    reserva = obter_reserva(reserva_id)
+    if reserva is None:
+        return jsonify({"erro": "Reserva não encontrada"}), 404
+    return jsonify(reserva), 200
+
+# Rotas para confirmar ou cancelar uma reserva (POST /reservas/<id>/confirmar | /cancelar)
+@inventario_routes.route("/reservas/<int:reserva_id>/<acao>", methods=["POST"])
+def rota_finalizar_reserva(reserva_id, acao):
+    if acao not in ("confirmar", "cancelar"):
+        return jsonify({"erro": "Ação inválida. Use 'confirmar' ou 'cancelar'."}), 404
+
+    resultado, erro = confirmar_reserva(reserva_id) if acao == "confirmar" else cancelar_reserva(reserva_id)
+    if erro == "Reserva não encontrada.":
+        return jsonify({"erro": erro}), 404
+    if erro:
+        # Reserva já finalizada ou vencida
+        return jsonify({"erro": erro}), 409
+    return jsonify(resultado), 200
+
+# Rota para operações de estoque em lote (POST /estoque/lote)
+@inventario_routes.route("/estoque/lote", methods=["POST"])
+def rota_operacao_estoque_lote():
+    dados = request.get_json()
+    # Aceita tanto uma lista pura de operações quanto {"modo": ..., "operacoes": [...]}
+    if isinstance(dados, list):
+        dados = {"operacoes": dados}
+    if not isinstance(dados, dict) or not isinstance(dados.get("operacoes"), list) or not dados["operacoes"]:
+        return jsonify({"erro": "Campo 'operacoes' deve ser uma lista não vazia."}), 400
+
+    modo = dados.get("modo", "tudo_ou_nada")
+    if modo not in MODOS_LOTE:
+        return jsonify({"erro": "Modo inválido. Use 'tudo_ou_nada' ou 'melhor_esforco'."}), 400
+    if len(dados["operacoes"]) > LIMITE_OPERACOES_LOTE:
+        return jsonify({"erro": f"O lote aceita no máximo {LIMITE_OPERACOES_LOTE} operações."}), 400
+
+    resultados, aplicado = registrar_operacoes_estoque_lote(dados["operacoes"], atomico=modo == "tudo_ou_nada")
+    resposta = {
+        "modo": modo,
+        "aplicado": aplicado,
+        "aplicadas": sum(1 for r in resultados if r["status"] == "aplicada"),
+        "rejeitadas": sum(1 for r in resultados if r["status"] == "rejeitada"),
+        "resultados": resultados,
+    }
+    return jsonify(resposta), 200 if aplicado else 400
+
+# Rota para importação em massa de produtos (POST /produtos/importar)
+@inventario_routes.route("/produtos/importar", methods=["POST"])
+def rota_importar_produtos():
+    # O arquivo pode vir como upload (campo 'arquivo') ou direto no corpo da requisição
+    arquivo = request.files.get("arquivo")
+    formato = request.args.get("formato")
+    if not formato:
+        nome_arquivo = arquivo.filename if arquivo else ""
+        tipo_conteudo = arquivo.mimetype if arquivo else request.mimetype
+        formato = "ndjson" if "ndjson" in tipo_conteudo or nome_arquivo.endswith((".ndjson", ".jsonl")) else "csv"
+    if formato not in FORMATOS:
+        return jsonify({"erro": "Formato inválido. Use 'csv' ou 'ndjson'."}), 400
+
+    fluxo = arquivo.stream if arquivo else request.stream
+    resumo = importar_produtos(abrir_texto(fluxo), formato)
+    return jsonify(resumo), 400 if "erro" in resumo else 200
+
+# Rota com as estatísticas do cache de produtos (GET /cache/produtos)
+@inventario_routes.route("/cache/produtos", methods=["GET"])
+def rota_estatisticas_cache():
+    return jsonify(cache_produtos.estatisticas()), 200
+
+# Métricas de requisições, comandos SQL e cache no formato do Prometheus (GET /metrics)
+@inventario_routes.route("/metrics", methods=["GET"])
+def rota_metricas():
+    return Response(registro.renderizar(), mimetype="text/plain; version=0.0.4")
+
+# Verificação de saúde para o balanceador/orquestrador (GET /saude): 503 se o banco não responder
+@inventario_routes.route("/saude", methods=["GET"])
+def rota_saude():
+    versao, erro = verificar_banco()
+    if erro:
+        resposta = jsonify({"status": "indisponivel", "erro": erro})
+        resposta.status_code = 503
+    else:
+        resposta = jsonify({"status": "ok", "versao_schema": versao})
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
+
+# Rota para o histórico de movimentações de um produto (GET /produtos/<id>/historico)
+@inventario_routes.route("/produtos/<int:produto_id>/historico", methods=["GET"])
+def rota_historico_produto(produto_id):
+    if not obter_produto_por_id(produto_id):
+        return jsonify({"erro": "Produto não encontrado"}), 404
+
+    de, erro = _parametro_instante('de')
+    if not erro:
+        ate, erro = _parametro_instante('ate')
+    if not erro:
+        limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if not erro:
+        cursor, erro = _parametro_inteiro('cursor', 0)
+    if erro:
+        return jsonify({"erro": erro}), 400
+
+    limite = limite or 100
+    movimentacoes = listar_movimentacoes(produto_id, de=de, ate=ate, limite=limite, apos_id=cursor)
+    next_cursor = str(movimentacoes[-1]["id"]) if len(movimentacoes) == limite else None
+    return jsonify({"movimentacoes": movimentacoes, "next_cursor": next_cursor}), 200
+
+# Rota para o estoque de um produto em um instante (GET /produtos/<id>/historico/saldo?em=...)
+@inventario_routes.route("/produtos/<int:produto_id>/historico/saldo", methods=["GET"])
+def rota_saldo_historico(produto_id):
+    if not obter_produto_por_id(produto_id):
+        return jsonify({"erro": "Produto não encontrado"}), 404
+
+    em, erro = _parametro_instante('em')
+    if erro:
+        return jsonify({"erro": erro}), 400
+    if em is None:
+        em = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    return jsonify({"produto_id": produto_id, "em": em, "quantidade": saldo_em(produto_id, em)}), 200
+
+# Rota com o valor do estoque por categoria (GET /relatorios/estoque)
+@inventario_routes.route("/relatorios/estoque", methods=["GET"])
+def rota_relatorio_estoque():
+    return _resposta_condicional(resumo_estoque())
+
+# Rota com as unidades em estoque por armazém (GET /relatorios/estoque/armazens)
+@inventario_routes.route("/relatorios/estoque/armazens", methods=["GET"])
+def rota_relatorio_estoque_armazens():
+    return jsonify(totais_por_armazem()), 200
+
+# Rota com o consumo médio e a previsão de ruptura de um produto (GET /produtos/<id>/velocidade?dias=30)
+@inventario_routes.route("/produtos/<int:produto_id>/velocidade", methods=["GET"])
+def rota_velocidade_produto(produto_id):
+    dias, erro = _parametro_inteiro('dias', 1, JANELA_MAXIMA_DIAS)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    velocidade = velocidade_produto(produto_id, dias or JANELA_PADRAO_DIAS)
+    if velocidade is None:
+        return jsonify({"erro": "Produto não encontrado"}), 404
+    return jsonify(velocidade), 200
+
+# Rota com os produtos que vão zerar o estoque primeiro (GET /relatorios/ruptura?dias=30&limit=50&categoria=...)
+@inventario_routes.route("/relatorios/ruptura", methods=["GET"])
+def rota_previsao_ruptura():
+    dias, erro = _parametro_inteiro('dias', 1, JANELA_MAXIMA_DIAS)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    dias = dias or JANELA_PADRAO_DIAS
+    produtos = previsao_ruptura(dias, limite or 50, request.args.get('categoria'))
+    return jsonify({"dias": dias, "produtos": produtos}), 200
+
+# Rota com os produtos mais movimentados (GET /relatorios/mais-movimentados?dias=30&limit=10&por=saidas)
+@inventario_routes.route("/relatorios/mais-movimentados", methods=["GET"])
+def rota_mais_movimentados():
+    dias, erro = _parametro_inteiro('dias', 1, JANELA_MAXIMA_DIAS)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    limite, erro = _parametro_inteiro('limit', 1, LIMITE_PAGINA)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    criterio = request.args.get('por', 'saidas')
+    if criterio not in CRITERIOS_MOVIMENTACAO:
+        return jsonify({"erro": f"Parâmetro 'por' deve ser um de: {', '.join(CRITERIOS_MOVIMENTACAO)}."}), 400
+    dias = dias or JANELA_PADRAO_DIAS
+    produtos = produtos_mais_movimentados(dias, limite or 10, criterio)
+    return jsonify({"dias": dias, "por": criterio, "produtos": produtos}), 200
+
+# Rota com o consumo e a cobertura de estoque por categoria (GET /relatorios/velocidade/categorias?dias=30)
+@inventario_routes.route("/relatorios/velocidade/categorias", methods=["GET"])
+def rota_velocidade_categorias():
+    dias, erro = _parametro_inteiro('dias', 1, JANELA_MAXIMA_DIAS)
+    if erro:
+        return jsonify({"erro": erro}), 400
+    dias = dias or JANELA_PADRAO_DIAS
+    return jsonify({"dias": dias, "categorias": velocidade_categorias(dias)}), 200
+
+# Rota para exportação completa do catálogo (GET /produtos/exportar?formato=csv|ndjson&gzip=1)
+@inventario_routes.route("/produtos/exportar", methods=["GET"])
+def rota_exportar_produtos():
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({"erro": "Formato inválido. Use 'csv' ou 'ndjson'."}), 400
+
+    # Percorre o catálogo página a página: a memória do worker não cresce com o número de produtos
+    produtos = iterar_produtos()
+    if formato == 'csv':
+        blocos = _gerar_csv(colunas_produtos(), produtos)
+        mimetype, extensao = 'text/csv', 'csv'
+    else:
+        blocos = _gerar_ndjson(produtos)
+        mimetype, extensao = 'application/x-ndjson', 'ndjson'
+
+    headers = {"Content-Disposition": f"attachment; filename=produtos.{extensao}"}
+    if request.args.get('gzip') in ('1', 'true'):
+        blocos = _comprimir_gzip(blocos)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(blocos), mimetype=mimetype, headers=headers)
\ No newline at end of file
@@ -32,12 +32,12 @@ if [ $? -ne 0 ]; then
 fi
 
 # 4. Inicialização do Banco de Dados
-echo "-> 4/5: Verificando e inicializando o banco de dados..."
-if [ ! -f database.db ]; then
-    echo "   Arquivo 'database.db' não encontrado. Criando..."
-    python init_db.py
-else
-    echo "   Banco de dados já existe. Pulando a criação."
+echo "-> 4/5: Criando ou migrando o banco de dados..."
+# As migrações só aplicam o que falta: os dados de um banco existente são mantidos
+python init_db.py
+if [ $? -ne 0 ]; then
+    echo "❌ Falha ao migrar o banco de dados."
+    exit 1
 fi
 
 echo "✅ Setup concluído com sucesso!"
@@ -55,8 +55,17 @@ fi
 
 echo ""
 echo "====================================================="
-echo "🔥 Iniciando a aplicação Flask..."
+if [ "$1" = "producao" ]; then
+    # Vários workers com o Gunicorn; exige INVENTARIO_SECRET_KEY no ambiente
+    echo "🔥 Iniciando a aplicação com o Gunicorn..."
+    echo "A API estará disponível em: http://${INVENTARIO_BIND:-0.0.0.0:8000}"
+    echo "Pressione CTRL+C para parar o servidor."
+    echo "====================================================="
+    exec gunicorn -c gunicorn.conf.py wsgi:app
+fi
+
+echo "🔥 Iniciando a aplicação Flask (servidor de desenvolvimento)..."
 echo "A API estará disponível em: http://127.0.0.1:5000"
 echo "Pressione CTRL+C para parar o servidor."
 echo "====================================================="
-python app.py
+INVENTARIO_DEBUG=${INVENTARIO_DEBUG:-true} python app.py
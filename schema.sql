@@ -1,10 +1,172 @@
 -- schema.sql
-DROP TABLE IF EXISTS produtos;
+-- Versão 1 do schema, aplicada pela primeira migração (migracoes.py).
+-- Não edite este arquivo para mudar o schema: crie uma nova migração.
 
 CREATE TABLE produtos (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nome TEXT NOT NULL,
     categoria TEXT NOT NULL,
     preco_unitario REAL NOT NULL,
-    quantidade INTEGER NOT NULL
-);
\ No newline at end of file
+    quantidade INTEGER NOT NULL,
+    estoque_minimo INTEGER NOT NULL DEFAULT 0,
+    -- Unidades presas em reservas ativas; 'disponivel' é o disponível para promessa (ATP)
+    reservado INTEGER NOT NULL DEFAULT 0,
+    disponivel INTEGER GENERATED ALWAYS AS (quantidade - reservado) VIRTUAL,
+    atualizado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Índice parcial só com os produtos abaixo do estoque mínimo: a consulta de
+-- baixo estoque lê apenas essas entradas, sem varrer o catálogo.
+CREATE INDEX idx_produtos_baixo_estoque ON produtos (id) WHERE quantidade < estoque_minimo;
+
+-- Índice de busca textual (FTS5) sobre nome e categoria.
+-- Usa 'produtos' como conteúdo externo e é mantido em sincronia pelos triggers abaixo.
+CREATE VIRTUAL TABLE produtos_fts USING fts5(
+    nome,
+    categoria,
+    content='produtos',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER produtos_fts_insert AFTER INSERT ON produtos BEGIN
+    INSERT INTO produtos_fts (rowid, nome, categoria) VALUES (new.id, new.nome, new.categoria);
+END;
+
+CREATE TRIGGER produtos_fts_delete AFTER DELETE ON produtos BEGIN
+    INSERT INTO produtos_fts (produtos_fts, rowid, nome, categoria) VALUES ('delete', old.id, old.nome, old.categoria);
+END;
+
+CREATE TRIGGER produtos_fts_update AFTER UPDATE OF nome, categoria ON produtos BEGIN
+    INSERT INTO produtos_fts (produtos_fts, rowid, nome, categoria) VALUES ('delete', old.id, old.nome, old.categoria);
+    INSERT INTO produtos_fts (rowid, nome, categoria) VALUES (new.id, new.nome, new.categoria);
+END;
+
+
+-- Histórico de movimentações de estoque (somente inclusão, nunca alterado).
+-- 'inicial' registra o estoque com que o produto foi criado.
+CREATE TABLE movimentacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    produto_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    quantidade INTEGER NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE INDEX idx_movimentacoes_produto ON movimentacoes (produto_id, id);
+CREATE INDEX idx_movimentacoes_produto_data ON movimentacoes (produto_id, criado_em);
+
+-- Saldo periódico de cada produto: o estoque em um instante qualquer é o
+-- snapshot mais próximo somado às poucas movimentações posteriores a ele.
+CREATE TABLE estoque_snapshots (
+    produto_id INTEGER NOT NULL,
+    movimentacao_id INTEGER NOT NULL,
+    saldo INTEGER NOT NULL,
+    criado_em TEXT NOT NULL,
+    PRIMARY KEY (produto_id, movimentacao_id)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_estoque_snapshots_data ON estoque_snapshots (produto_id, criado_em);
+
+-- Totais de estoque por categoria, mantidos incrementalmente pelos triggers
+-- abaixo na mesma transação de cada escrita em 'produtos'.
+CREATE TABLE resumo_categorias (
+    categoria TEXT PRIMARY KEY,
+    total_produtos INTEGER NOT NULL,
+    total_unidades INTEGER NOT NULL,
+    valor_total REAL NOT NULL
+);
+
+CREATE TRIGGER resumo_categorias_insert AFTER INSERT ON produtos BEGIN
+    INSERT INTO resumo_categorias (categoria, total_produtos, total_unidades, valor_total)
+    VALUES (new.categoria, 1, new.quantidade, new.preco_unitario * new.quantidade)
+    ON CONFLICT (categoria) DO UPDATE SET
+        total_produtos = total_produtos + 1,
+        total_unidades = total_unidades + excluded.total_unidades,
+        valor_total = valor_total + excluded.valor_total;
+END;
+
+CREATE TRIGGER resumo_categorias_delete AFTER DELETE ON produtos BEGIN
+    UPDATE resumo_categorias SET
+        total_produtos = total_produtos - 1,
+        total_unidades = total_unidades - old.quantidade,
+        valor_total = valor_total - old.preco_unitario * old.quantidade
+    WHERE categoria = old.categoria;
+    DELETE FROM resumo_categorias WHERE categoria = old.categoria AND total_produtos = 0;
+END;
+
+CREATE TRIGGER resumo_categorias_update AFTER UPDATE OF categoria, preco_unitario, quantidade ON produtos BEGIN
+    UPDATE resumo_categorias SET
+        total_produtos = total_produtos - 1,
+        total_unidades = total_unidades - old.quantidade,
+        valor_total = valor_total - old.preco_unitario * old.quantidade
+    WHERE categoria = old.categoria;
+    INSERT INTO resumo_categorias (categoria, total_produtos, total_unidades, valor_total)
+    VALUES (new.categoria, 1, new.quantidade, new.preco_unitario * new.quantidade)
+    ON CONFLICT (categoria) DO UPDATE SET
+        total_produtos = total_produtos + 1,
+        total_unidades = total_unidades + excluded.total_unidades,
+        valor_total = valor_total + excluded.valor_total;
+    DELETE FROM resumo_categorias WHERE categoria = old.categoria AND total_produtos = 0;
+END;
+
+-- Alertas gravados quando uma movimentação cruza o estoque mínimo do produto
+-- ('baixo' ao ficar abaixo dele, 'normalizado' ao voltar ao mínimo ou acima).
+CREATE TABLE alertas_estoque (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    produto_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    quantidade INTEGER NOT NULL,
+    estoque_minimo INTEGER NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+-- Armazéns além do principal. O estoque de cada um fica em um arquivo SQLite
+-- próprio (anexado como armazem_<codigo>), para que escritas em armazéns
+-- diferentes não disputem o mesmo lock; o principal continua em produtos.quantidade.
+CREATE TABLE armazens (
+    codigo TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Sequência de mudanças dos produtos, gravada pelos triggers em toda escrita.
+-- Clientes acompanham o catálogo por GET /produtos/mudancas?desde=<seq>.
+CREATE TABLE mudancas (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    produto_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE TRIGGER mudancas_insert AFTER INSERT ON produtos BEGIN
+    INSERT INTO mudancas (produto_id, tipo) VALUES (new.id, 'criado');
+END;
+
+CREATE TRIGGER mudancas_update AFTER UPDATE OF nome, categoria, preco_unitario, estoque_minimo ON produtos BEGIN
+    INSERT INTO mudancas (produto_id, tipo) VALUES (new.id, 'atualizado');
+END;
+
+CREATE TRIGGER mudancas_estoque AFTER UPDATE OF quantidade, reservado ON produtos BEGIN
+    INSERT INTO mudancas (produto_id, tipo) VALUES (new.id, 'estoque');
+END;
+
+CREATE TRIGGER mudancas_delete AFTER DELETE ON produtos BEGIN
+    INSERT INTO mudancas (produto_id, tipo) VALUES (old.id, 'removido');
+END;
+
+-- Reservas de estoque com prazo: enquanto 'ativa', a quantidade fica somada em
+-- produtos.reservado; ao confirmar vira saída, ao cancelar ou expirar é liberada.
+CREATE TABLE reservas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    produto_id INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ativa',
+    expira_em TEXT NOT NULL,
+    criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    finalizada_em TEXT
+);
+
+-- Só as reservas ativas entram no índice usado pela varredura de expiradas
+CREATE INDEX idx_reservas_ativas_expiracao ON reservas (expira_em) WHERE status = 'ativa';
@@ -3,17 +3,19 @@
 import pytest
 import json
 from app import create_app
-from models import resetar_estoque
 
 @pytest.fixture
-def client():
+def app():
+    """Cria a aplicação com um banco em memória próprio, copiado do schema pronto."""
+    app = create_app({'TESTING': True, 'DATABASE': ':memory:', 'RESERVAS_VARREDURA_SEGUNDOS': 0})
+    # Sem contexto aberto: cada requisição do cliente tem a própria conexão, como em
+    # produção. Os testes que chamam os modelos diretamente abrem o contexto
+    yield app
+
+@pytest.fixture
+def client(app):
     """Cria um cliente de teste para a aplicação Flask."""
-    app = create_app()
-    app.config['TESTING'] = True
-    
     with app.test_client() as client:
-        # Reseta o estado do estoque antes de cada teste
-        resetar_estoque()
         yield client
 
 # === Testes de Criação de Produto (POST /produtos) ===
@@ -159,4 +161,1147 @@ def test_saida_estoque_insuficiente(client):
     response = client.post(f'/produtos/{produto_id}/estoque', data=json.dumps(operacao), content_type='application/json')
     
     assert response.status_code == 400
-    assert "Estoque insuficiente" in response.get_json()['erro']
\ No newline at end of file
+    assert "Estoque insuficiente" in response.get_json()['erro']
+
+# === Testes da Camada de Conexão ===
+
+def test_conexao_reutilizada_no_contexto(tmp_path):
+    """Testa que a conexão é reutilizada dentro do contexto e configurada com WAL."""
+    from db import get_db
+    app = create_app({'DATABASE': str(tmp_path / 'inventario.db')})
+    with app.app_context():
+        conn = get_db()
+        assert get_db() is conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+def semear_catalogo(conn):
+    """Semente usada no banco modelo dos testes em memória."""
+    conn.execute("INSERT INTO produtos (nome, categoria, preco_unitario, quantidade) VALUES ('Semente', 'Geral', 1, 3)")
+
+def semear_outro_catalogo(conn):
+    """Semente de um segundo banco modelo, com outro produto no mesmo id."""
+    conn.execute("INSERT INTO produtos (nome, categoria, preco_unitario, quantidade) VALUES ('Outra semente', 'Geral', 2, 5)")
+
+def test_banco_memoria_isolado_com_semente():
+    """Testa que cada aplicação em memória recebe uma cópia própria do banco modelo."""
+    primeira = create_app({'DATABASE': ':memory:', 'DATABASE_SEMENTE': semear_catalogo}).test_client()
+    segunda = create_app({'DATABASE': ':memory:', 'DATABASE_SEMENTE': semear_catalogo}).test_client()
+    assert primeira.application.config['DATABASE'] != segunda.application.config['DATABASE']
+    # O mesmo id lido por aplicações com bancos diferentes não vem do cache da outra
+    outra = create_app({'DATABASE': ':memory:', 'DATABASE_SEMENTE': semear_outro_catalogo}).test_client()
+    assert primeira.get('/produtos/1').get_json()['nome'] == "Semente"
+    assert outra.get('/produtos/1').get_json()['nome'] == "Outra semente"
+    assert primeira.get('/produtos/1').get_json()['nome'] == "Semente"
+
+    primeira.delete('/produtos/1')
+    assert primeira.get('/produtos').get_json() == []
+    assert [p['nome'] for p in segunda.get('/produtos').get_json()] == ["Semente"]
+    assert create_app({'DATABASE': ':memory:'}).test_client().get('/produtos').get_json() == []
+
+def test_operacao_estoque_produto_nao_existente(client):
+    """Testa que operações em produto inexistente retornam 404, mesmo com dados inválidos."""
+    response = client.post('/produtos/999/estoque', data=json.dumps({"tipo": "saida", "quantidade": 1}), content_type='application/json')
+    assert response.status_code == 404
+    response = client.post('/produtos/999/estoque', data=json.dumps({"tipo": "xyz", "quantidade": 1}), content_type='application/json')
+    assert response.status_code == 404
+
+def test_saidas_concorrentes_nao_perdem_atualizacoes(client):
+    """Testa que saídas simultâneas nunca deixam o estoque negativo."""
+    from concurrent.futures import ThreadPoolExecutor
+    from models import registrar_operacao_estoque
+
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Console", "categoria": "Games", "preco_unitario": 4000, "quantidade_inicial": 10}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+
+    def saida(_):
+        with client.application.app_context():
+            return registrar_operacao_estoque(produto_id, "saida", 1)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        resultados = list(executor.map(saida, range(25)))
+
+    assert sum(1 for produto, erro in resultados if erro is None) == 10
+    assert all(erro == "Estoque insuficiente para a saída." for produto, erro in resultados if erro)
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 0
+
+# === Testes de Operações de Estoque em Lote ===
+
+def test_lote_estoque_tudo_ou_nada(client):
+    """Testa que uma linha inválida desfaz o lote inteiro no modo atômico."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Cabo HDMI", "categoria": "Acessórios", "preco_unitario": 30, "quantidade_inicial": 5}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+
+    lote = {"operacoes": [
+        {"produto_id": produto_id, "tipo": "entrada", "quantidade": 10},
+        {"produto_id": produto_id, "tipo": "saida", "quantidade": 100},
+    ]}
+    response = client.post('/estoque/lote', data=json.dumps(lote), content_type='application/json')
+    assert response.status_code == 400
+    resultado = response.get_json()
+    assert resultado['aplicado'] is False
+    assert [r['status'] for r in resultado['resultados']] == ["revertida", "rejeitada"]
+    assert "Estoque insuficiente" in resultado['resultados'][1]['erro']
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 5
+
+def test_lote_estoque_melhor_esforco(client):
+    """Testa que o modo de melhor esforço aplica as linhas válidas e relata as demais."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Pendrive", "categoria": "Armazenamento", "preco_unitario": 40, "quantidade_inicial": 5}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+
+    lote = {"modo": "melhor_esforco", "operacoes": [
+        {"produto_id": produto_id, "tipo": "entrada", "quantidade": 10},
+        {"produto_id": 999, "tipo": "entrada", "quantidade": 1},
+        {"produto_id": produto_id, "tipo": "saida", "quantidade": 3},
+        {"produto_id": produto_id, "tipo": "saida"},
+        {"produto_id": {"id": produto_id}, "tipo": "entrada", "quantidade": 1},
+        {"produto_id": True, "tipo": "entrada", "quantidade": 1},
+    ]}
+    response = client.post('/estoque/lote', data=json.dumps(lote), content_type='application/json')
+    assert response.status_code == 200
+    resultado = response.get_json()
+    assert resultado['aplicadas'] == 2
+    assert resultado['rejeitadas'] == 4
+    assert resultado['resultados'][1]['erro'] == "Produto não encontrado."
+    assert resultado['resultados'][4]['erro'] == resultado['resultados'][5]['erro'] == "O campo 'produto_id' deve ser um número inteiro."
+    assert resultado['resultados'][2]['produto']['quantidade'] == 12
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 12
+
+def test_lote_estoque_corpo_nao_objeto(client):
+    """Testa que um corpo JSON que não é objeto nem lista é recusado com 400."""
+    for corpo in ('"abc"', '5', 'null', '{}'):
+        response = client.post('/estoque/lote', data=corpo, content_type='application/json')
+        assert response.status_code == 400, corpo
+        assert response.get_json()['erro'] == "Campo 'operacoes' deve ser uma lista não vazia."
+
+# === Testes de Importação em Massa ===
+
+def test_importar_produtos_csv(client):
+    """Testa a importação de um CSV com linhas válidas e inválidas."""
+    csv_conteudo = (
+        "nome,categoria,preco_unitario,quantidade_inicial\n"
+        "Teclado,Periféricos,120.50,10\n"
+        "Mouse,Periféricos,-5,3\n"
+        "Monitor,Monitores,\"899,90\",2\n"
+    )
+    response = client.post('/produtos/importar', data=csv_conteudo.encode('utf-8'), content_type='text/csv')
+    assert response.status_code == 200
+    resumo = response.get_json()
+    assert resumo['importados'] == 2
+    assert resumo['rejeitados'] == 1
+    assert resumo['erros'] == [{"linha": 3, "erro": "O preço unitário deve ser um número positivo."}]
+    assert len(client.get('/produtos').get_json()) == 2
+
+def test_importar_produtos_codificacao_invalida(client, tmp_path, capsys, monkeypatch):
+    """Testa que uma linha fora de UTF-8 interrompe a importação com 400, pela API e pela linha de comando."""
+    conteudo = (
+        "nome,categoria,preco_unitario,quantidade_inicial\n"
+        "Teclado,Periféricos,120.50,10\n"
+        "Mouse,Periféricos,-5,3\n"
+    ).encode('utf-8') + "Cadeira,Escritório,300,1\n".encode('latin-1') + b"Mesa,Escritorio,500,1\n"
+    response = client.post('/produtos/importar', data=conteudo, content_type='text/csv')
+    assert response.status_code == 400
+    resumo = response.get_json()
+    assert (resumo['linha'], resumo['importados'], resumo['rejeitados']) == (4, 1, 1)
+    assert resumo['erro'] == "Linha 4 não é texto UTF-8 válido; importação interrompida."
+    assert [p['nome'] for p in client.get('/produtos').get_json()] == ["Teclado"]
+
+    # A linha de comando cria a aplicação com o banco do ambiente, já migrado
+    import importar
+    monkeypatch.setenv('INVENTARIO_DATABASE', str(tmp_path / 'cli.db'))
+    arquivo = tmp_path / 'catalogo.csv'
+    arquivo.write_bytes(conteudo)
+    assert importar.main([str(arquivo)]) == 1
+    assert "Linha 4 não é texto UTF-8 válido" in capsys.readouterr().err
+    importado = create_app({'DATABASE': str(tmp_path / 'cli.db')})
+    assert [p['nome'] for p in importado.test_client().get('/produtos').get_json()] == ["Teclado"]
+
+def test_importar_produtos_ndjson_em_lotes(app):
+    """Testa a importação de NDJSON em vários lotes pequenos."""
+    import io
+    from importar import importar_produtos
+    from models import listar_produtos
+
+    linhas = [json.dumps({"nome": f"Item {i}", "categoria": "Geral", "preco_unitario": 1.5, "quantidade_inicial": i}) for i in range(7)]
+    linhas.insert(3, "{json inválido")
+    with app.app_context():
+        resumo = importar_produtos(io.StringIO("\n".join(linhas)), "ndjson", tamanho_lote=2)
+        assert resumo['importados'] == 7
+        assert resumo['erros'] == [{"linha": 4, "erro": "Linha não contém um objeto JSON válido."}]
+        assert len(listar_produtos()) == 7
+
+# === Testes de Paginação e Streaming da Listagem ===
+
+def test_listar_produtos_paginado(client):
+    """Testa a paginação por cursor (keyset) da listagem."""
+    for i in range(5):
+        client.post('/produtos', data=json.dumps({"nome": f"Cabo {i}", "categoria": "Cabos", "preco_unitario": 10, "quantidade_inicial": 1}), content_type='application/json')
+
+    response = client.get('/produtos?limit=2')
+    assert response.status_code == 200
+    pagina = response.get_json()
+    assert [p['nome'] for p in pagina['produtos']] == ["Cabo 0", "Cabo 1"]
+
+    nomes = [p['nome'] for p in pagina['produtos']]
+    while pagina['next_cursor']:
+        pagina = client.get(f"/produtos?limit=2&cursor={pagina['next_cursor']}").get_json()
+        nomes += [p['nome'] for p in pagina['produtos']]
+    assert nomes == [f"Cabo {i}" for i in range(5)]
+
+    assert client.get('/produtos?limit=0').status_code == 400
+
+def test_parametros_inteiros_acima_de_64_bits(client):
+    """Testa que cursores, sequências e ids acima de 2**63-1 dão 400/404, não erro 500."""
+    grande = 2 ** 63
+    for url in (f'/produtos?cursor={grande}', f'/produtos/mudancas?desde={grande}',
+                f'/alertas/estoque?desde={grande}', f'/produtos/baixo-estoque?cursor={grande}'):
+        response = client.get(url)
+        assert response.status_code == 400, url
+        assert "menor ou igual a 9223372036854775807" in response.get_json()['erro']
+    assert client.get(f'/produtos?cursor={grande - 1}').status_code == 200
+    assert client.get(f'/produtos/{grande}').status_code == 404
+    assert client.get('/produtos/mudancas', headers={"Last-Event-ID": str(grande)}).status_code == 200
+
+def test_listar_produtos_streaming(client):
+    """Testa a listagem em modo streaming."""
+    from models import iterar_produtos
+    for i in range(3):
+        client.post('/produtos', data=json.dumps({"nome": f"Cabo {i}", "categoria": "Cabos", "preco_unitario": 10, "quantidade_inicial": 1}), content_type='application/json')
+
+    response = client.get('/produtos?stream=1')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert [p['nome'] for p in json.loads(response.get_data(as_text=True))] == ["Cabo 0", "Cabo 1", "Cabo 2"]
+    assert client.get('/produtos?stream=1&nome=inexistente').get_json() == []
+
+    with client.application.app_context():
+        assert len(list(iterar_produtos(tamanho_lote=1))) == 3
+
+def test_busca_em_lote_por_ids(client):
+    """Testa a busca de vários produtos por id (GET ?ids= e POST /produtos/consulta)."""
+    from models import cache_produtos
+
+    def acertos_cache():
+        with client.application.app_context():
+            return cache_produtos.estatisticas()['acertos']
+
+    ids = [client.post('/produtos', data=json.dumps({"nome": f"Cabo {i}", "categoria": "Cabos", "preco_unitario": 10, "quantidade_inicial": i}), content_type='application/json').get_json()['id'] for i in range(3)]
+    client.get(f'/produtos/{ids[1]}')  # deixa um dos produtos no cache
+    acertos = acertos_cache()
+
+    lote = client.get(f'/produtos?ids={ids[2]},{ids[1]},999,{ids[2]}').get_json()
+    assert [p['nome'] for p in lote['produtos']] == ["Cabo 2", "Cabo 1"]
+    assert lote['nao_encontrados'] == [999]
+    assert acertos_cache() == acertos + 1
+
+    consulta = client.post('/produtos/consulta', data=json.dumps({"ids": ids}), content_type='application/json').get_json()
+    assert [p['quantidade'] for p in consulta['produtos']] == [0, 1, 2]
+    assert client.get('/produtos?ids=1,a').status_code == 400
+    assert client.post('/produtos/consulta', data=json.dumps({"ids": "1,2"}), content_type='application/json').status_code == 400
+
+def test_listagem_em_formato_colunar(client):
+    """Testa o formato colunar opcional na listagem e na busca em lote."""
+    for i in range(2):
+        client.post('/produtos', data=json.dumps({"nome": f"Cabo {i}", "categoria": "Cabos", "preco_unitario": 10 + i, "quantidade_inicial": 1}), content_type='application/json')
+
+    colunar = client.get('/produtos?formato=colunar').get_json()
+    assert colunar['valores'][colunar['colunas'].index('nome')] == ["Cabo 0", "Cabo 1"]
+    assert colunar['valores'][colunar['colunas'].index('preco_unitario')] == [10, 11]
+
+    pagina = client.get('/produtos?formato=colunar&limit=1').get_json()
+    assert pagina['produtos']['valores'][pagina['produtos']['colunas'].index('nome')] == ["Cabo 0"]
+    assert pagina['next_cursor'] is not None
+
+    vazio = client.get('/produtos?formato=colunar&nome=inexistente').get_json()
+    assert 'nome' in vazio['colunas'] and all(valores == [] for valores in vazio['valores'])
+    lote = client.get('/produtos?ids=1,2&formato=colunar').get_json()
+    assert lote['produtos']['valores'][0] == [1, 2]
+
+def test_compressao_negociada_por_accept_encoding(client):
+    """Testa a compressão gzip das respostas JSON maiores, conforme o Accept-Encoding."""
+    import gzip
+    for i in range(30):
+        client.post('/produtos', data=json.dumps({"nome": f"Cabo {i}", "categoria": "Cabos", "preco_unitario": 10, "quantidade_inicial": 1}), content_type='application/json')
+
+    simples = client.get('/produtos')
+    assert 'Content-Encoding' not in simples.headers
+    assert 'Accept-Encoding' in simples.headers['Vary']
+
+    comprimida = client.get('/produtos', headers={'Accept-Encoding': 'gzip'})
+    assert comprimida.headers['Content-Encoding'] == "gzip"
+    assert json.loads(gzip.decompress(comprimida.get_data())) == simples.get_json()
+    assert comprimida.headers['ETag'].startswith('W/')
+    assert client.get('/produtos', headers={'Accept-Encoding': 'gzip', 'If-None-Match': comprimida.headers['ETag']}).status_code == 304
+
+    # Respostas pequenas não são comprimidas
+    pequena = client.get('/produtos/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in pequena.headers
+
+# === Testes da Busca Textual (FTS5) ===
+
+def test_busca_por_prefixo_e_sem_acentos(client):
+    """Testa a busca por prefixo de palavra, ignorando acentos e maiúsculas."""
+    client.post('/produtos', data=json.dumps({"nome": "Cadeira Ergonômica", "categoria": "Móveis", "preco_unitario": 950, "quantidade_inicial": 3}), content_type='application/json')
+    client.post('/produtos', data=json.dumps({"nome": "Mesa de Escritório", "categoria": "Móveis", "preco_unitario": 800, "quantidade_inicial": 2}), content_type='application/json')
+
+    assert [p['nome'] for p in client.get('/produtos?nome=cad').get_json()] == ["Cadeira Ergonômica"]
+    assert [p['nome'] for p in client.get('/produtos?nome=ergonomica').get_json()] == ["Cadeira Ergonômica"]
+    assert len(client.get('/produtos?categoria=moveis').get_json()) == 2
+    assert client.get('/produtos?nome=escritorio&categoria=moveis').get_json()[0]['nome'] == "Mesa de Escritório"
+
+def test_busca_acompanha_atualizacao_e_remocao(client):
+    """Testa que o índice de busca é mantido em sincronia pelos triggers."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Roteador", "categoria": "Redes", "preco_unitario": 200, "quantidade_inicial": 1}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+
+    client.put(f'/produtos/{produto_id}', data=json.dumps({"nome": "Switch"}), content_type='application/json')
+    assert client.get('/produtos?nome=roteador').get_json() == []
+    assert len(client.get('/produtos?nome=switch').get_json()) == 1
+
+    client.delete(f'/produtos/{produto_id}')
+    assert client.get('/produtos?nome=switch').get_json() == []
+
+def test_reconstruir_indice_busca(client):
+    """Testa o comando de reconstrução do índice de busca."""
+    client.post('/produtos', data=json.dumps({"nome": "Impressora", "categoria": "Escritório", "preco_unitario": 700, "quantidade_inicial": 1}), content_type='application/json')
+    runner = client.application.test_cli_runner()
+    resultado = runner.invoke(args=['reconstruir-busca'])
+    assert "reconstruído" in resultado.output
+    assert len(client.get('/produtos?nome=impress').get_json()) == 1
+
+# === Testes de Cache e GET Condicional ===
+
+def test_cache_produto_invalidado_nas_escritas(client):
+    """Testa que leituras repetidas usam o cache e que as escritas o invalidam."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Hub USB", "categoria": "Periféricos", "preco_unitario": 80, "quantidade_inicial": 4}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+
+    client.get(f'/produtos/{produto_id}')
+    antes = client.get('/cache/produtos').get_json()
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 4
+    depois = client.get('/cache/produtos').get_json()
+    assert depois['acertos'] == antes['acertos'] + 1
+
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "saida", "quantidade": 1}), content_type='application/json')
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 3
+    client.put(f'/produtos/{produto_id}', data=json.dumps({"nome": "Hub USB-C"}), content_type='application/json')
+    assert client.get(f'/produtos/{produto_id}').get_json()['nome'] == "Hub USB-C"
+    client.delete(f'/produtos/{produto_id}')
+    assert client.get(f'/produtos/{produto_id}').status_code == 404
+
+def test_get_condicional_produto(client):
+    """Testa ETag/Last-Modified e a resposta 304 em GET /produtos/<id>."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Microfone", "categoria": "Audio", "preco_unitario": 300, "quantidade_inicial": 2}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+
+    response = client.get(f'/produtos/{produto_id}')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert client.get(f'/produtos/{produto_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "entrada", "quantidade": 1}), content_type='application/json')
+    response = client.get(f'/produtos/{produto_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['quantidade'] == 3
+
+    # Mudança no mesmo segundo da leitura: o Last-Modified não muda, então não valida sozinho
+    ultima_modificacao = client.get(f'/produtos/{produto_id}').headers['Last-Modified']
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "saida", "quantidade": 1}), content_type='application/json')
+    response = client.get(f'/produtos/{produto_id}', headers={'If-Modified-Since': ultima_modificacao})
+    assert response.status_code == 200
+    assert response.get_json()['quantidade'] == 2
+
+def test_get_condicional_listagem(client):
+    """Testa a resposta 304 da listagem enquanto nada muda, inclusive após remoções."""
+    client.post('/produtos', data=json.dumps({"nome": "Caixa de Som", "categoria": "Audio", "preco_unitario": 150, "quantidade_inicial": 2}), content_type='application/json')
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Soundbar", "categoria": "Audio", "preco_unitario": 900, "quantidade_inicial": 1}), content_type='application/json')
+
+    etag = client.get('/produtos').headers['ETag']
+    assert client.get('/produtos', headers={'If-None-Match': etag}).status_code == 304
+
+    client.delete(f"/produtos/{res_post.get_json()['id']}")
+    assert client.get('/produtos', headers={'If-None-Match': etag}).status_code == 200
+
+# === Testes do Histórico de Movimentações ===
+
+def test_historico_registra_movimentacoes(client):
+    """Testa que criação e operações de estoque ficam registradas no histórico."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Tablet", "categoria": "Eletrônicos", "preco_unitario": 1500, "quantidade_inicial": 5}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "entrada", "quantidade": 10}), content_type='application/json')
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "saida", "quantidade": 20}), content_type='application/json')  # recusada
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "saida", "quantidade": 3}), content_type='application/json')
+
+    response = client.get(f'/produtos/{produto_id}/historico')
+    assert response.status_code == 200
+    movimentacoes = response.get_json()['movimentacoes']
+    assert [(m['tipo'], m['quantidade']) for m in movimentacoes] == [("inicial", 5), ("entrada", 10), ("saida", 3)]
+
+    response = client.get(f'/produtos/{produto_id}/historico/saldo')
+    assert response.get_json()['quantidade'] == 12
+    assert client.get(f'/produtos/{produto_id}/historico/saldo?em=2000-01-01').get_json()['quantidade'] == 0
+    assert client.get(f'/produtos/{produto_id}/historico/saldo?em=ontem').status_code == 400
+    assert client.get('/produtos/999/historico').status_code == 404
+
+def test_saldo_em_instante_usa_snapshots(client, monkeypatch):
+    """Testa o saldo em instantes passados combinando snapshots e movimentações."""
+    import models
+    from db import get_db
+    monkeypatch.setattr(models, 'INTERVALO_SNAPSHOT', 2)
+
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Drone", "categoria": "Eletrônicos", "preco_unitario": 2500, "quantidade_inicial": 5}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+    for tipo, quantidade in [("entrada", 10), ("saida", 3), ("entrada", 1), ("saida", 4)]:
+        client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": tipo, "quantidade": quantidade}), content_type='application/json')
+
+    # Espalha as movimentações em dias diferentes: movimentação N no dia N de janeiro
+    with client.application.app_context():
+        conn = get_db()
+        with conn:
+            conn.execute("UPDATE movimentacoes SET criado_em = printf('2025-01-%02d 00:00:00.000', id)")
+            conn.execute("UPDATE estoque_snapshots SET criado_em = printf('2025-01-%02d 00:00:00.000', movimentacao_id)")
+        assert conn.execute('SELECT COUNT(*) FROM estoque_snapshots').fetchone()[0] == 2
+
+    saldos = [client.get(f'/produtos/{produto_id}/historico/saldo?em=2025-01-{dia:02d}T12:00:00').get_json()['quantidade'] for dia in range(1, 6)]
+    assert saldos == [5, 15, 12, 13, 9]
+
+    response = client.get(f'/produtos/{produto_id}/historico?de=2025-01-02&ate=2025-01-03T23:59:59')
+    assert [m['tipo'] for m in response.get_json()['movimentacoes']] == ["entrada", "saida"]
+
+def test_pagina_detalhe_exibe_historico(client):
+    """Testa o painel de histórico na página de detalhes do produto."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Smartwatch", "categoria": "Eletrônicos", "preco_unitario": 900, "quantidade_inicial": 7}), content_type='application/json')
+    produto_id = res_post.get_json()['id']
+    client.post('/login', data={"usuario": "admin", "senha": "1234"})
+
+    response = client.get(f'/produto/{produto_id}')
+    assert response.status_code == 200
+    assert "Histórico de Movimentações" in response.get_data(as_text=True)
+    assert "Estoque inicial" in response.get_data(as_text=True)
+
+# === Testes do Relatório de Valor do Estoque ===
+
+def test_relatorio_estoque_mantido_incrementalmente(client):
+    """Testa que o resumo por categoria acompanha criações, alterações, estoque e remoções."""
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Notebook", "categoria": "Informática", "preco_unitario": 4000, "quantidade_inicial": 2}), content_type='application/json')
+    notebook_id = res_post.get_json()['id']
+    res_post = client.post('/produtos', data=json.dumps({"nome": "Mouse", "categoria": "Periféricos", "preco_unitario": 50, "quantidade_inicial": 10}), content_type='application/json')
+    mouse_id = res_post.get_json()['id']
+
+    client.post(f'/produtos/{notebook_id}/estoque', data=json.dumps({"tipo": "entrada", "quantidade": 1}), content_type='application/json')
+    client.put(f'/produtos/{mouse_id}', data=json.dumps({"categoria": "Informática", "preco_unitario": 60}), content_type='application/json')
+
+    relatorio = client.get('/relatorios/estoque').get_json()
+    assert relatorio['categorias'] == [
+        {"categoria": "Informática", "total_produtos": 2, "total_unidades": 13, "valor_total": 12600.0}
+    ]
+    assert relatorio['total']['valor_total'] == 12600.0
+
+    client.delete(f'/produtos/{notebook_id}')
+    client.delete(f'/produtos/{mouse_id}')
+    assert client.get('/relatorios/estoque').get_json()['categorias'] == []
+
+def test_consumo_diario_e_previsao_de_ruptura(client):
+    """Testa a velocidade de consumo, a previsão de ruptura e os mais movimentados, lidos dos totais diários."""
+    from db import get_db
+    ids = {}
+    for nome, categoria, quantidade in (("Cabo", "Cabos", 100), ("Mouse", "Periféricos", 10), ("Teclado", "Periféricos", 50)):
+        ids[nome] = client.post('/produtos', data=json.dumps({"nome": nome, "categoria": categoria, "preco_unitario": 10, "quantidade_inicial": quantidade}), content_type='application/json').get_json()['id']
+    for nome, tipo, quantidade in (("Cabo", "saida", 30), ("Cabo", "entrada", 6), ("Mouse", "saida", 3), ("Mouse", "saida", 3), ("Teclado", "entrada", 5)):
+        client.post(f'/produtos/{ids[nome]}/estoque', data=json.dumps({"tipo": tipo, "quantidade": quantidade}), content_type='application/json')
+    # Saída antiga, fora da janela padrão de 30 dias
+    with client.application.app_context():
+        conn = get_db()
+        with conn:
+            conn.execute("INSERT INTO movimentacoes (produto_id, tipo, quantidade, criado_em) VALUES (?, 'saida', 60, strftime('%Y-%m-%d %H:%M:%f', 'now', '-40 days'))", (ids["Cabo"],))
+
+    velocidade = client.get(f'/produtos/{ids["Cabo"]}/velocidade').get_json()
+    assert (velocidade['saidas'], velocidade['entradas'], velocidade['media_diaria_saidas']) == (30, 6, 1.0)
+    assert velocidade['dias_ate_ruptura'] == 76.0
+    assert len(velocidade['serie']) == 1
+    assert client.get(f'/produtos/{ids["Cabo"]}/velocidade?dias=60').get_json()['saidas'] == 90
+    assert client.get(f'/produtos/{ids["Teclado"]}/velocidade').get_json()['dias_ate_ruptura'] is None
+    assert client.get('/produtos/999/velocidade').status_code == 404
+    assert client.get(f'/produtos/{ids["Cabo"]}/velocidade?dias=0').status_code == 400
+
+    ruptura = client.get('/relatorios/ruptura?dias=10').get_json()['produtos']
+    assert [(p['nome'], p['dias_ate_ruptura']) for p in ruptura] == [("Mouse", 6.7), ("Cabo", 25.3)]
+    assert [p['nome'] for p in client.get('/relatorios/ruptura?categoria=Cabos').get_json()['produtos']] == ["Cabo"]
+
+    assert [p['nome'] for p in client.get('/relatorios/mais-movimentados').get_json()['produtos']] == ["Cabo", "Mouse", "Teclado"]
+    por_entradas = client.get('/relatorios/mais-movimentados?por=entradas&limit=1').get_json()['produtos']
+    assert [(p['nome'], p['entradas']) for p in por_entradas] == [("Cabo", 6)]
+    assert client.get('/relatorios/mais-movimentados?por=valor').status_code == 400
+
+    categorias = client.get('/relatorios/velocidade/categorias').get_json()['categorias']
+    assert [(c['categoria'], c['saidas'], c['total_unidades']) for c in categorias] == [("Cabos", 30, 76), ("Periféricos", 6, 59)]
+    assert categorias[1]['dias_ate_ruptura'] == 295.0
+
+def test_migracao_preenche_totais_diarios_com_historico():
+    """Testa que a migração dos totais diários é preenchida com as movimentações já existentes."""
+    import sqlite3
+    from migracoes import MIGRACOES, aplicar_migracoes
+    conn = sqlite3.connect(':memory:')
+    for versao, migracao in enumerate(MIGRACOES[:3], start=1):
+        migracao(conn)
+        conn.execute(f'PRAGMA user_version = {versao}')
+    conn.execute("INSERT INTO produtos (nome, categoria, preco_unitario, quantidade) VALUES ('Cabo', 'Cabos', 5, 10)")
+    conn.executemany("INSERT INTO movimentacoes (produto_id, tipo, quantidade, criado_em) VALUES (1, ?, ?, ?)", [
+        ("inicial", 10, "2025-01-01 08:00:00.000"), ("saida", 2, "2025-01-01 09:00:00.000"),
+        ("saida", 3, "2025-01-01 18:00:00.000"), ("entrada", 4, "2025-01-02 10:00:00.000"),
+    ])
+    conn.commit()
+
+    aplicar_migracoes(conn)
+    assert conn.execute('SELECT dia, entradas, saidas, operacoes FROM movimentacoes_diarias ORDER BY dia').fetchall() == [
+        ("2025-01-01", 0, 5, 2), ("2025-01-02", 4, 0, 1)]
+    assert conn.execute('SELECT dia, categoria, saidas FROM movimentacoes_diarias_categorias ORDER BY dia').fetchall() == [
+        ("2025-01-01", "Cabos", 5), ("2025-01-02", "Cabos", 0)]
+
+def test_verificar_resumo_reconstroi(client):
+    """Testa a verificação de consistência e a reconstrução do resumo."""
+    from db import get_db
+    from models import verificar_resumo_estoque
+    client.post('/produtos', data=json.dumps({"nome": "Scanner", "categoria": "Escritório", "preco_unitario": 500, "quantidade_inicial": 3}), content_type='application/json')
+    with client.application.app_context():
+        assert verificar_resumo_estoque() == []
+
+        conn = get_db()
+        with conn:
+            conn.execute('DELETE FROM resumo_categorias')
+        assert len(verificar_resumo_estoque(corrigir=True)) == 1
+        assert verificar_resumo_estoque() == []
+    assert client.get('/relatorios/estoque').get_json()['total']['valor_total'] == 1500.0
+
+# === Testes de Exportação do Catálogo ===
+
+def test_exportar_produtos_csv_e_ndjson(client):
+    """Testa a exportação em CSV e NDJSON."""
+    import csv
+    import io
+    for i in range(3):
+        client.post('/produtos', data=json.dumps({"nome": f"Produto, {i}", "categoria": "Geral", "preco_unitario": 9.9, "quantidade_inicial": i}), content_type='application/json')
+
+    response = client.get('/produtos/exportar')
+    assert response.status_code == 200
+    assert response.is_streamed
+    linhas = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [l['nome'] for l in linhas] == ["Produto, 0", "Produto, 1", "Produto, 2"]
+    assert linhas[2]['quantidade'] == "2"
+
+    response = client.get('/produtos/exportar?formato=ndjson')
+    produtos = [json.loads(l) for l in response.get_data(as_text=True).splitlines()]
+    assert [p['quantidade'] for p in produtos] == [0, 1, 2]
+    assert client.get('/produtos/exportar?formato=xml').status_code == 400
+
+def test_exportar_produtos_gzip(client):
+    """Testa a exportação comprimida com gzip em fluxo."""
+    import gzip
+    client.post('/produtos', data=json.dumps({"nome": "Roteador", "categoria": "Redes", "preco_unitario": 300, "quantidade_inicial": 4}), content_type='application/json')
+
+    response = client.get('/produtos/exportar?formato=ndjson&gzip=1')
+    assert response.headers['Content-Encoding'] == "gzip"
+    produto = json.loads(gzip.decompress(response.get_data()))
+    assert produto['nome'] == "Roteador"
+
+    client.delete(f"/produtos/{produto['id']}")
+    vazio = client.get('/produtos/exportar?gzip=1&formato=csv')
+    assert gzip.decompress(vazio.get_data()).decode().startswith("id,nome,categoria")
+
+def test_metricas_prometheus(client):
+    """Testa a exposição das métricas de requisições, SQL e cache em /metrics."""
+    client.post('/produtos', data=json.dumps({"nome": "Switch", "categoria": "Redes", "preco_unitario": 150, "quantidade_inicial": 2}), content_type='application/json')
+    client.get('/produtos/1')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    texto = response.get_data(as_text=True)
+    assert 'http_requisicao_duracao_segundos_count{endpoint="/produtos/<int:produto_id>",metodo="GET",status="200"}' in texto
+    assert 'sql_comando_duracao_segundos_bucket{operacao="INSERT",tabela="produtos",le="+Inf"}' in texto
+    assert 'sql_linhas_total{operacao="SELECT",tabela="produtos"}' in texto
+    assert 'cache_produtos_falhas_total' in texto
+
+def test_log_consultas_lentas(client, caplog):
+    """Testa o registro de comandos acima do limite configurado de consulta lenta."""
+    client.application.config['SQLITE_LIMITE_CONSULTA_LENTA_MS'] = 0
+    with caplog.at_level("WARNING", logger="inventario.sql"):
+        client.get('/produtos')
+    assert any("Consulta lenta" in r.getMessage() and "FROM produtos" in r.getMessage() for r in caplog.records)
+    assert 'sql_consultas_lentas_total{operacao="SELECT",tabela="produtos"}' in client.get('/metrics').get_data(as_text=True)
+
+def test_escrita_agrupada_concorrente():
+    """Testa o modo de escrita agrupada com várias operações simultâneas."""
+    import re
+    from concurrent.futures import ThreadPoolExecutor
+    from models import registrar_operacao_estoque, registrar_operacoes_estoque_lote
+
+    app = create_app({'DATABASE': ':memory:', 'ESCRITA_AGRUPADA': True, 'ESCRITA_AGRUPADA_JANELA_MS': 20})
+    client = app.test_client()
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Redes", "preco_unitario": 10, "quantidade_inicial": 0}), content_type='application/json').get_json()['id']
+
+    def operar(i):
+        with app.app_context():
+            if i % 10 == 0:
+                # Lote atômico rejeitado no meio do grupo: só ele é desfeito
+                return registrar_operacoes_estoque_lote([
+                    {"produto_id": produto_id, "tipo": "entrada", "quantidade": 1},
+                    {"produto_id": 999, "tipo": "entrada", "quantidade": 1},
+                ])[1]
+            return registrar_operacao_estoque(produto_id, "entrada", 2)
+
+    try:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            resultados = list(executor.map(operar, range(100)))
+        assert all(r is False for r in resultados[::10])
+        assert all(r[1] is None for i, r in enumerate(resultados) if i % 10)
+
+        produto = client.get(f'/produtos/{produto_id}').get_json()
+        assert produto['quantidade'] == 180
+        assert len(client.get(f'/produtos/{produto_id}/historico?limit=1000').get_json()['movimentacoes']) == 91
+
+        with app.app_context():
+            assert registrar_operacao_estoque(produto_id, "saida", 1000) == (None, "Estoque insuficiente para a saída.")
+            assert registrar_operacao_estoque(999, "saida", 1) == (None, "Produto não encontrado.")
+        metricas = client.get('/metrics').get_data(as_text=True)
+        grupos = int(re.search(r'^escrita_agrupada_operacoes_count (\d+)', metricas, re.M).group(1))
+        operacoes = float(re.search(r'^escrita_agrupada_operacoes_sum (\S+)', metricas, re.M).group(1))
+        assert grupos < operacoes
+    finally:
+        app.extensions['escritor_agrupado'].encerrar()
+
+def test_escrita_agrupada_falha_ao_abrir_conexao():
+    """Testa que uma falha ao abrir a conexão do escritor chega a quem espera, sem travar as escritas."""
+    import threading
+    app = create_app({'DATABASE': ':memory:', 'RESERVAS_VARREDURA_SEGUNDOS': 0, 'ESCRITA_AGRUPADA': True})
+    escritor = app.extensions['escritor_agrupado']
+    erros = []
+
+    def escrever():
+        try:
+            escritor.executar(lambda conn: None)
+        except ValueError as e:
+            erros.append(e)
+
+    try:
+        app.config['SQLITE_JOURNAL_MODE'] = 'INVALIDO'
+        # Thread daemon: se a escrita travar, o teste falha em vez de travar junto
+        thread = threading.Thread(target=escrever, daemon=True)
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert "SQLITE_JOURNAL_MODE" in str(erros[0])
+
+        # Com a configuração corrigida, a próxima escrita cria outra thread
+        app.config['SQLITE_JOURNAL_MODE'] = 'WAL'
+        response = app.test_client().post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Redes", "preco_unitario": 10, "quantidade_inicial": 1}), content_type='application/json')
+        assert response.status_code == 201
+    finally:
+        escritor.encerrar(timeout=5)
+
+def test_produtos_baixo_estoque_e_alertas(client):
+    """Testa a listagem de baixo estoque e os alertas ao cruzar o estoque mínimo."""
+    def criar(nome, quantidade, minimo):
+        return client.post('/produtos', data=json.dumps({"nome": nome, "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": quantidade, "estoque_minimo": minimo}), content_type='application/json').get_json()
+
+    cabo = criar("Cabo HDMI", 10, 5)
+    criar("Cabo USB", 1, 3)
+    criar("Cabo VGA", 0, 0)
+    assert cabo['estoque_minimo'] == 5
+    assert [p['nome'] for p in client.get('/produtos/baixo-estoque').get_json()['produtos']] == ["Cabo USB"]
+
+    # 10 -> 6 não cruza o mínimo; 6 -> 4 cruza e gera alerta; 4 -> 3 continua abaixo
+    for tipo, quantidade in [("saida", 4), ("saida", 2), ("saida", 1), ("entrada", 2)]:
+        client.post(f"/produtos/{cabo['id']}/estoque", data=json.dumps({"tipo": tipo, "quantidade": quantidade}), content_type='application/json')
+    alertas = client.get('/alertas/estoque').get_json()
+    assert [(a['tipo'], a['quantidade']) for a in alertas['alertas']] == [("baixo", 4), ("normalizado", 5)]
+    assert client.get(f"/alertas/estoque?desde={alertas['ultimo']}").get_json()['alertas'] == []
+    assert [p['nome'] for p in client.get('/produtos/baixo-estoque').get_json()['produtos']] == ["Cabo USB"]
+
+    response = client.put(f"/produtos/{cabo['id']}", data=json.dumps({"estoque_minimo": -1}), content_type='application/json')
+    assert response.status_code == 400
+    client.put(f"/produtos/{cabo['id']}", data=json.dumps({"estoque_minimo": 50}), content_type='application/json')
+    assert len(client.get('/produtos/baixo-estoque?limit=1').get_json()['produtos']) == 1
+    assert client.get('/produtos/baixo-estoque?limit=1').get_json()['next_cursor'] is not None
+
+def test_pagina_inicial_filtra_baixo_estoque(client):
+    """Testa o selo e o filtro de baixo estoque na interface web."""
+    client.post('/produtos', data=json.dumps({"nome": "Mouse", "categoria": "Periféricos", "preco_unitario": 50, "quantidade_inicial": 1, "estoque_minimo": 2}), content_type='application/json')
+    client.post('/produtos', data=json.dumps({"nome": "Teclado", "categoria": "Periféricos", "preco_unitario": 90, "quantidade_inicial": 8}), content_type='application/json')
+    client.post('/login', data={"usuario": "admin", "senha": "1234"})
+
+    pagina = client.get('/').get_data(as_text=True)
+    assert "Teclado" in pagina and pagina.count("Baixo estoque</span>") == 1
+    filtrada = client.get('/?baixo_estoque=1').get_data(as_text=True)
+    assert "Mouse" in filtrada and "Teclado" not in filtrada
+
+# === Testes de Armazéns ===
+
+def test_estoque_por_armazem_e_transferencia(client):
+    """Testa operações por armazém, transferências e totais entre armazéns."""
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Monitor", "categoria": "Monitores", "preco_unitario": 900, "quantidade_inicial": 10}), content_type='application/json').get_json()['id']
+    assert client.post('/armazens', data=json.dumps({"codigo": "sp", "nome": "São Paulo"}), content_type='application/json').status_code == 201
+    assert client.post('/armazens', data=json.dumps({"codigo": "rj", "nome": "Rio"}), content_type='application/json').status_code == 201
+    assert client.post('/armazens', data=json.dumps({"codigo": "sp", "nome": "Outro"}), content_type='application/json').status_code == 409
+    assert client.post('/armazens', data=json.dumps({"codigo": "São Paulo", "nome": "X"}), content_type='application/json').status_code == 400
+    assert [a['codigo'] for a in client.get('/armazens').get_json()] == ["principal", "rj", "sp"]
+
+    response = client.post(f'/produtos/{produto_id}/estoque/sp', data=json.dumps({"tipo": "entrada", "quantidade": 7}), content_type='application/json')
+    assert response.status_code == 200
+    assert response.get_json() == {"produto_id": produto_id, "armazem": "sp", "quantidade": 7}
+    response = client.post(f'/produtos/{produto_id}/estoque/rj', data=json.dumps({"tipo": "saida", "quantidade": 1}), content_type='application/json')
+    assert response.get_json()['erro'] == "Estoque insuficiente para a saída."
+    assert client.post(f'/produtos/{produto_id}/estoque/bh', data=json.dumps({"tipo": "entrada", "quantidade": 1}), content_type='application/json').status_code == 404
+    assert client.post('/produtos/999/estoque/sp', data=json.dumps({"tipo": "entrada", "quantidade": 1}), content_type='application/json').status_code == 404
+
+    transferencia = {"produto_id": produto_id, "origem": "sp", "destino": "rj", "quantidade": 5}
+    response = client.post('/estoque/transferencias', data=json.dumps(transferencia), content_type='application/json')
+    assert response.status_code == 200
+    assert response.get_json()['origem']['quantidade'] == 2 and response.get_json()['destino']['quantidade'] == 5
+    transferencia.update(origem="principal", destino="sp", quantidade=4)
+    client.post('/estoque/transferencias', data=json.dumps(transferencia), content_type='application/json')
+    transferencia.update(origem="rj", destino="principal", quantidade=50)
+    response = client.post('/estoque/transferencias', data=json.dumps(transferencia), content_type='application/json')
+    assert response.status_code == 400
+    transferencia.update(produto_id=[produto_id], quantidade=1)
+    response = client.post('/estoque/transferencias', data=json.dumps(transferencia), content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json()['erro'] == "O campo 'produto_id' deve ser um número inteiro."
+    transferencia.update(produto_id=produto_id, origem=["rj"])
+    assert client.post('/estoque/transferencias', data=json.dumps(transferencia), content_type='application/json').status_code == 404
+
+    estoque = client.get(f'/produtos/{produto_id}/estoque').get_json()
+    assert {a['armazem']: a['quantidade'] for a in estoque['armazens']} == {"principal": 6, "rj": 5, "sp": 6}
+    assert estoque['total'] == 17
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 6
+
+    totais = client.get('/relatorios/estoque/armazens').get_json()
+    assert {a['armazem']: a['total_unidades'] for a in totais['armazens']} == {"principal": 6, "rj": 5, "sp": 6}
+    assert totais['total']['total_unidades'] == 17
+
+    client.delete(f'/produtos/{produto_id}')
+    assert client.get('/relatorios/estoque/armazens').get_json()['total']['total_unidades'] == 0
+    assert client.get(f'/produtos/{produto_id}/estoque').status_code == 404
+
+def test_transferencia_corpo_nao_objeto(client):
+    """Testa que um corpo JSON que não é objeto é recusado com 400 na transferência."""
+    for corpo in ('"produto_id origem destino quantidade"', '5', '[1, 2]', 'null'):
+        response = client.post('/estoque/transferencias', data=corpo, content_type='application/json')
+        assert response.status_code == 400, corpo
+        assert "são obrigatórios" in response.get_json()['erro']
+
+def test_recuperacao_de_transferencia_interrompida(client, monkeypatch):
+    """Testa que uma transferência interrompida entre as etapas é concluída ou cancelada sem perder unidades."""
+    import models
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Hub", "categoria": "Acessórios", "preco_unitario": 80, "quantidade_inicial": 10}), content_type='application/json').get_json()['id']
+    client.post('/armazens', data=json.dumps({"codigo": "sp", "nome": "São Paulo"}), content_type='application/json')
+
+    # Queda depois da saída na origem e antes da entrada no destino
+    etapa_original = models._etapa_transferencia
+    def cair_na_entrada(transferencia, etapa):
+        if etapa == "entrada":
+            raise SystemExit("queda")
+        return etapa_original(transferencia, etapa)
+    monkeypatch.setattr(models, '_etapa_transferencia', cair_na_entrada)
+    transferencia = {"produto_id": produto_id, "origem": "principal", "destino": "sp", "quantidade": 4}
+    with pytest.raises(SystemExit):
+        client.post('/estoque/transferencias', data=json.dumps(transferencia), content_type='application/json')
+    monkeypatch.setattr(models, '_etapa_transferencia', etapa_original)
+    assert client.get(f'/produtos/{produto_id}/estoque').get_json()['total'] == 6
+
+    # Transferência registrada cuja saída ainda não tinha sido gravada
+    pendente = {"produto_id": produto_id, "origem": "principal", "destino": "sp", "quantidade": 2}
+    with client.application.app_context():
+        pendente["id"] = models._executar_escrita(lambda conn: conn.execute(
+            "INSERT INTO transferencias (produto_id, origem, destino, quantidade) VALUES (?, 'principal', 'sp', 2) RETURNING id",
+            (produto_id,)).fetchone()[0])
+
+        assert models.recuperar_transferencias(idade_minima=0) == (1, 1)
+        assert models.recuperar_transferencias(idade_minima=0) == (0, 0)
+    estoque = client.get(f'/produtos/{produto_id}/estoque').get_json()
+    assert {a['armazem']: a['quantidade'] for a in estoque['armazens']} == {"principal": 6, "sp": 4}
+    with client.application.app_context():
+        # A saída cancelada pela recuperação não acontece mais
+        assert models._etapa_transferencia(pendente, "saida") == (None, None)
+        situacoes = [t['situacao'] for t in models.get_db().execute('SELECT situacao FROM transferencias ORDER BY id')]
+        assert situacoes == ["concluida", "cancelada"]
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 6
+
+def test_armazens_em_arquivos_proprios(tmp_path):
+    """Testa que cada armazém é gravado no seu próprio arquivo SQLite."""
+    app = create_app({'DATABASE': str(tmp_path / 'inventario.db')})
+    with app.app_context():
+        from models import resetar_estoque
+        resetar_estoque()
+    client = app.test_client()
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 0}), content_type='application/json').get_json()['id']
+    client.post('/armazens', data=json.dumps({"codigo": "norte", "nome": "Norte"}), content_type='application/json')
+    client.post(f'/produtos/{produto_id}/estoque/norte', data=json.dumps({"tipo": "entrada", "quantidade": 3}), content_type='application/json')
+
+    import sqlite3
+    arquivo = sqlite3.connect(tmp_path / 'inventario-armazem-norte.db')
+    assert arquivo.execute('SELECT produto_id, quantidade FROM estoque').fetchall() == [(produto_id, 3)]
+    assert arquivo.execute('SELECT tipo, quantidade FROM movimentacoes').fetchall() == [("entrada", 3)]
+    arquivo.close()
+
+def test_limite_de_armazens_anexados(client):
+    """Testa que os armazéns ficam abaixo do limite de anexos do SQLite e que as operações em todos continuam funcionando."""
+    from db import get_db, limite_armazens
+    with client.application.app_context():
+        limite = limite_armazens(get_db())
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 1}), content_type='application/json').get_json()['id']
+    for i in range(limite):
+        assert client.post('/armazens', data=json.dumps({"codigo": f"a{i}", "nome": f"Armazém {i}"}), content_type='application/json').status_code == 201
+        client.post(f'/produtos/{produto_id}/estoque/a{i}', data=json.dumps({"tipo": "entrada", "quantidade": 1}), content_type='application/json')
+    response = client.post('/armazens', data=json.dumps({"codigo": "extra", "nome": "Extra"}), content_type='application/json')
+    assert response.status_code == 409
+    assert response.get_json()['erro'] == f"Limite de {limite} armazéns atingido."
+    assert len(client.get('/armazens').get_json()) == limite + 1
+
+    assert client.get(f'/produtos/{produto_id}/estoque').get_json()['total'] == limite + 1
+    assert client.get('/relatorios/estoque/armazens').get_json()['total']['total_unidades'] == limite + 1
+    assert client.delete(f'/produtos/{produto_id}').status_code == 204
+    assert client.get('/relatorios/estoque/armazens').get_json()['total']['total_unidades'] == 0
+
+def test_escritor_agrupado_desanexa_armazens():
+    """Testa que a conexão do escritor agrupado não acumula os armazéns anexados pelos grupos anteriores."""
+    app = create_app({'DATABASE': ':memory:', 'RESERVAS_VARREDURA_SEGUNDOS': 0, 'ESCRITA_AGRUPADA': True})
+    client = app.test_client()
+    escritor = app.extensions['escritor_agrupado']
+    try:
+        produto_id = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 0}), content_type='application/json').get_json()['id']
+        client.post('/armazens', data=json.dumps({"codigo": "norte", "nome": "Norte"}), content_type='application/json')
+        assert client.post(f'/produtos/{produto_id}/estoque/norte', data=json.dumps({"tipo": "entrada", "quantidade": 3}), content_type='application/json').status_code == 200
+        anexados = escritor.executar(lambda conn: [linha[1] for linha in conn.execute('PRAGMA database_list')])
+        assert anexados == ["main"]
+    finally:
+        escritor.encerrar()
+
+# === Testes do Fluxo de Mudanças ===
+
+def test_mudancas_registradas_em_todas_as_escritas(client):
+    """Testa a sequência de mudanças gravada por criação, alteração, estoque e remoção."""
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Webcam", "categoria": "Periféricos", "preco_unitario": 200, "quantidade_inicial": 4}), content_type='application/json').get_json()['id']
+    client.put(f'/produtos/{produto_id}', data=json.dumps({"preco_unitario": 180}), content_type='application/json')
+    client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "saida", "quantidade": 1}), content_type='application/json')
+
+    resposta = client.get('/produtos/mudancas').get_json()
+    assert [m['tipo'] for m in resposta['mudancas']] == ["criado", "atualizado", "estoque"]
+    assert resposta['mudancas'][-1]['produto']['quantidade'] == 3
+    assert resposta['mudancas'][0]['produto']['preco_unitario'] == 180
+
+    client.delete(f'/produtos/{produto_id}')
+    delta = client.get(f"/produtos/mudancas?desde={resposta['ultimo_seq']}").get_json()
+    assert [(m['tipo'], m['produto']) for m in delta['mudancas']] == [("removido", None)]
+    vazio = client.get(f"/produtos/mudancas?desde={delta['ultimo_seq']}&espera=0").get_json()
+    assert vazio == {"mudancas": [], "ultimo_seq": delta['ultimo_seq']}
+
+def test_mudancas_long_poll_acorda_na_escrita(app, client):
+    """Testa que o long-poll devolve a mudança assim que ela acontece."""
+    import threading
+    import time
+    from models import criar_produto
+
+    def criar_depois():
+        time.sleep(0.1)
+        with app.app_context():
+            criar_produto({"nome": "Hub USB", "categoria": "Periféricos", "preco_unitario": 60, "quantidade_inicial": 1})
+
+    threading.Thread(target=criar_depois).start()
+    inicio = time.monotonic()
+    resposta = client.get('/produtos/mudancas?desde=0&espera=10').get_json()
+    assert time.monotonic() - inicio < 5
+    assert [m['produto']['nome'] for m in resposta['mudancas']] == ["Hub USB"]
+
+def test_mudancas_em_fluxo_sse(app, client):
+    """Testa o envio das mudanças como Server-Sent Events."""
+    import threading
+    from models import registrar_operacao_estoque
+    client.post('/produtos', data=json.dumps({"nome": "Pendrive", "categoria": "Armazenamento", "preco_unitario": 30, "quantidade_inicial": 2}), content_type='application/json')
+
+    response = client.get('/produtos/mudancas?stream=sse&desde=0')
+    assert response.mimetype == "text/event-stream"
+    eventos = response.iter_encoded()
+    assert next(eventos).startswith(b"retry:")
+    evento = next(eventos).decode()
+    assert evento.startswith("id: 1\nevent: criado\n")
+    assert json.loads(evento.split("data: ", 1)[1])['produto']['nome'] == "Pendrive"
+
+    # A escrita vem de outra thread, como viria de outra requisição concorrente
+    def entrada():
+        with app.app_context():
+            registrar_operacao_estoque(1, "entrada", 3)
+    escritor = threading.Thread(target=entrada)
+    escritor.start()
+    escritor.join()
+    assert next(eventos).decode().startswith("id: 2\nevent: estoque\n")
+    response.close()
+
+    reconexao = client.get('/produtos/mudancas?stream=sse&desde=0', headers={"Last-Event-ID": "1"})
+    eventos = reconexao.iter_encoded()
+    next(eventos)
+    assert next(eventos).decode().startswith("id: 2\n")
+    reconexao.close()
+
+def test_limite_de_fluxos_sse(tmp_path):
+    """Testa que fluxos SSE acima do limite recebem 503 e que a vaga volta ao fechar o fluxo."""
+    from app import create_app, encerrar_app
+    app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'sse.db'), 'MUDANCAS_SSE_MAXIMO': 1,
+                      'RESERVAS_VARREDURA_SEGUNDOS': 0})
+    client = app.test_client()
+
+    fluxo = client.get('/produtos/mudancas?stream=sse')
+    assert fluxo.status_code == 200
+    recusado = client.get('/produtos/mudancas?stream=sse')
+    assert recusado.status_code == 503
+    assert recusado.headers['Retry-After'] == "30"
+    assert "long-poll" in recusado.get_json()['erro']
+    # O long-poll continua disponível
+    assert client.get('/produtos/mudancas?espera=0').status_code == 200
+
+    fluxo.close()
+    reaberto = client.get('/produtos/mudancas?stream=sse')
+    assert reaberto.status_code == 200
+    reaberto.close()
+    encerrar_app(app)
+
+# === Testes de Reservas de Estoque ===
+
+def test_reserva_confirmada_e_cancelada(client):
+    """Testa reservar, confirmar e cancelar, com o disponível para promessa atualizado."""
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Console", "categoria": "Games", "preco_unitario": 3000, "quantidade_inicial": 5}), content_type='application/json').get_json()['id']
+
+    primeira = client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 3, "ttl": 60}), content_type='application/json')
+    assert primeira.status_code == 201
+    assert primeira.get_json()['status'] == "ativa"
+    produto = client.get(f'/produtos/{produto_id}').get_json()
+    assert (produto['quantidade'], produto['reservado'], produto['disponivel']) == (5, 3, 2)
+
+    response = client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 3}), content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json()['erro'] == "Estoque disponível insuficiente para a reserva."
+    # Uma saída direta também não pode consumir as unidades reservadas
+    response = client.post(f'/produtos/{produto_id}/estoque', data=json.dumps({"tipo": "saida", "quantidade": 3}), content_type='application/json')
+    assert response.status_code == 400
+    assert client.post('/produtos/999/reservas', data=json.dumps({"quantidade": 1}), content_type='application/json').status_code == 404
+    assert client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 1, "ttl": 0}), content_type='application/json').status_code == 400
+
+    segunda = client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 2}), content_type='application/json').get_json()
+    confirmada = client.post(f"/reservas/{primeira.get_json()['id']}/confirmar")
+    assert confirmada.status_code == 200
+    assert confirmada.get_json()['produto']['quantidade'] == 2
+    assert client.post(f"/reservas/{primeira.get_json()['id']}/cancelar").status_code == 409
+
+    assert client.post(f"/reservas/{segunda['id']}/cancelar").get_json()['status'] == "cancelada"
+    produto = client.get(f'/produtos/{produto_id}').get_json()
+    assert (produto['quantidade'], produto['reservado'], produto['disponivel']) == (2, 0, 2)
+    assert client.get(f"/reservas/{segunda['id']}").get_json()['status'] == "cancelada"
+    assert client.post('/reservas/999/confirmar').status_code == 404
+
+    historico = client.get(f'/produtos/{produto_id}/historico').get_json()['movimentacoes']
+    assert [(m['tipo'], m['quantidade']) for m in historico] == [("inicial", 5), ("saida", 3)]
+
+    # Reserva vencida ainda não varrida: a confirmação a libera e é recusada
+    from db import get_db
+    vencida = client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 2}), content_type='application/json').get_json()
+    with client.application.app_context():
+        conn = get_db()
+        with conn:
+            conn.execute("UPDATE reservas SET expira_em = '2000-01-01 00:00:00.000' WHERE id = ?", (vencida['id'],))
+    response = client.post(f"/reservas/{vencida['id']}/confirmar")
+    assert (response.status_code, response.get_json()['erro']) == (409, "Reserva expirada.")
+    assert client.get(f'/produtos/{produto_id}').get_json()['disponivel'] == 2
+
+def test_atualizado_em_apos_reservas(client):
+    """Testa que reservar, cancelar e liberar uma reserva atualizam o atualizado_em e o ETag do produto."""
+    from db import get_db
+    from models import cache_produtos
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Drone", "categoria": "Games", "preco_unitario": 2000, "quantidade_inicial": 5}), content_type='application/json').get_json()['id']
+
+    def executar_sql(sql, *parametros):
+        with client.application.app_context():
+            conn = get_db()
+            with conn:
+                conn.execute(sql, parametros)
+            cache_produtos.limpar()
+
+    def etag_antigo():
+        # atualizado_em tem precisão de segundos: recua a data para a mudança seguinte aparecer
+        executar_sql("UPDATE produtos SET atualizado_em = '2000-01-01 00:00:00' WHERE id = ?", produto_id)
+        return client.get(f'/produtos/{produto_id}').headers['ETag']
+
+    def produto_desde(etag):
+        response = client.get(f'/produtos/{produto_id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        produto = response.get_json()
+        assert produto['atualizado_em'] != '2000-01-01 00:00:00'
+        return produto['disponivel']
+
+    etag = etag_antigo()
+    reserva = client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 2}), content_type='application/json').get_json()
+    assert produto_desde(etag) == 3
+
+    etag = etag_antigo()
+    client.post(f"/reservas/{reserva['id']}/cancelar")
+    assert produto_desde(etag) == 5
+
+    vencida = client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 1}), content_type='application/json').get_json()
+    executar_sql("UPDATE reservas SET expira_em = '2000-01-01 00:00:00.000' WHERE id = ?", vencida['id'])
+    etag = etag_antigo()
+    client.post(f"/reservas/{vencida['id']}/confirmar")
+    assert produto_desde(etag) == 5
+
+def test_reservas_expiradas_liberadas_em_lotes():
+    """Testa a varredura em segundo plano que libera as reservas vencidas."""
+    import time
+    from db import get_db
+
+    app = create_app({'DATABASE': ':memory:', 'RESERVAS_VARREDURA_SEGUNDOS': 0.05, 'RESERVAS_VARREDURA_LOTE': 2})
+    client = app.test_client()
+    try:
+        produto_id = client.post('/produtos', data=json.dumps({"nome": "Ingresso", "categoria": "Eventos", "preco_unitario": 100, "quantidade_inicial": 10}), content_type='application/json').get_json()['id']
+        reservas = [client.post(f'/produtos/{produto_id}/reservas', data=json.dumps({"quantidade": 1, "ttl": 60}), content_type='application/json').get_json()['id'] for _ in range(5)]
+
+        with app.app_context():
+            conn = get_db()
+            with conn:
+                conn.execute("UPDATE reservas SET expira_em = '2000-01-01 00:00:00.000' WHERE id != ?", (reservas[-1],))
+
+        prazo = time.monotonic() + 5
+        while client.get(f'/produtos/{produto_id}').get_json()['reservado'] != 1 and time.monotonic() < prazo:
+            time.sleep(0.02)
+        assert client.get(f'/produtos/{produto_id}').get_json()['disponivel'] == 9
+        assert [client.get(f'/reservas/{r}').get_json()['status'] for r in reservas] == ["expirada"] * 4 + ["ativa"]
+        assert client.post(f'/reservas/{reservas[0]}/confirmar').get_json()['erro'] == "Reserva já expirada."
+    finally:
+        app.extensions['varredor_reservas'].encerrar()
+
+# === Testes das Migrações de Schema ===
+
+def test_migracoes_preservam_banco_do_schema_original(tmp_path):
+    """Testa a migração de um banco do schema original, sem perder os produtos."""
+    import sqlite3
+    from migracoes import VERSAO_ATUAL, aplicar_migracoes, versao_banco
+    caminho = tmp_path / 'legado.db'
+    legado = sqlite3.connect(caminho)
+    legado.execute('CREATE TABLE produtos (id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL, categoria TEXT NOT NULL, preco_unitario REAL NOT NULL, quantidade INTEGER NOT NULL)')
+    legado.execute("INSERT INTO produtos (nome, categoria, preco_unitario, quantidade) VALUES ('Mouse Óptico', 'Periféricos', 50, 4), ('Antigo', 'Periféricos', 1, 1)")
+    legado.execute("DELETE FROM produtos WHERE nome = 'Antigo'")
+    legado.commit()
+    legado.close()
+
+    app = create_app({'DATABASE': str(caminho), 'RESERVAS_VARREDURA_SEGUNDOS': 0})
+    client = app.test_client()
+    assert client.get('/produtos?nome=mouse').get_json()[0]['quantidade'] == 4
+    assert client.get('/relatorios/estoque').get_json()['total']['total_unidades'] == 4
+    assert [m['tipo'] for m in client.get('/produtos/1/historico').get_json()['movimentacoes']] == ["inicial"]
+    # O id do produto removido antes da migração não é reutilizado
+    novo = client.post('/produtos', data=json.dumps({"nome": "Teclado", "categoria": "Periféricos", "preco_unitario": 90, "quantidade_inicial": 1}), content_type='application/json')
+    assert novo.get_json()['id'] == 3
+
+    conn = sqlite3.connect(caminho)
+    assert versao_banco(conn) == VERSAO_ATUAL
+    assert aplicar_migracoes(conn) == []
+    indices = {linha[0] for linha in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'produtos'")}
+    assert {'idx_produtos_categoria_nome', 'idx_produtos_nome', 'idx_produtos_baixo_estoque'} <= indices
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute('UPDATE produtos SET quantidade = -1 WHERE id = 1')
+    conn.close()
+
+def test_migracoes_recusam_banco_mais_novo(tmp_path):
+    """Testa que a aplicação não inicia sobre um banco de versão desconhecida."""
+    import sqlite3
+    from migracoes import VERSAO_ATUAL
+    conn = sqlite3.connect(tmp_path / 'futuro.db')
+    conn.execute(f'PRAGMA user_version = {VERSAO_ATUAL + 1}')
+    conn.close()
+    with pytest.raises(RuntimeError):
+        create_app({'DATABASE': str(tmp_path / 'futuro.db'), 'RESERVAS_VARREDURA_SEGUNDOS': 0})
+
+# === Testes de Execução em Produção ===
+
+def test_configuracao_pelo_ambiente_e_encerramento(monkeypatch):
+    """Testa a leitura das configurações INVENTARIO_* e o encerramento das threads."""
+    from app import encerrar_app
+    monkeypatch.setenv('INVENTARIO_SECRET_KEY', 'segredo-de-producao')
+    monkeypatch.setenv('INVENTARIO_DEBUG', 'false')
+    monkeypatch.setenv('INVENTARIO_SQLITE_BUSY_TIMEOUT_MS', '1500')
+    app = create_app({'DATABASE': ':memory:', 'RESERVAS_VARREDURA_SEGUNDOS': 0.05, 'ESCRITA_AGRUPADA': True})
+    assert app.config['SECRET_KEY'] == 'segredo-de-producao'
+    assert app.debug is False
+    assert app.config['SQLITE_BUSY_TIMEOUT_MS'] == 1500
+
+    client = app.test_client()
+    assert client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 1}), content_type='application/json').status_code == 201
+    encerrar_app(app, timeout=5)
+    assert not app.extensions['varredor_reservas']._thread.is_alive()
+    assert app.extensions['escritor_agrupado']._thread is None
+
+def test_verificacao_de_saude(client):
+    """Testa a rota de saúde usada pelo balanceador."""
+    from migracoes import VERSAO_ATUAL
+    response = client.get('/saude')
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "ok", "versao_schema": VERSAO_ATUAL}
+    assert response.headers['Cache-Control'] == "no-store"
+
+def test_escrita_repetida_com_banco_ocupado(tmp_path):
+    """Testa a nova tentativa quando outro processo segura o lock de escrita além do busy timeout."""
+    import sqlite3
+    import threading
+    from models import escritas_repetidas
+    caminho = str(tmp_path / 'inventario.db')
+    app = create_app({'DATABASE': caminho, 'RESERVAS_VARREDURA_SEGUNDOS': 0,
+                      'SQLITE_BUSY_TIMEOUT_MS': 20, 'SQLITE_TENTATIVAS_ESCRITA': 20})
+    client = app.test_client()
+
+    outro_processo = sqlite3.connect(caminho, check_same_thread=False)
+    outro_processo.execute('BEGIN IMMEDIATE')
+    threading.Timer(0.2, outro_processo.commit).start()
+    repetidas = sum(escritas_repetidas._valores.values())
+    response = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 1}), content_type='application/json')
+    assert response.status_code == 201
+    assert sum(escritas_repetidas._valores.values()) > repetidas
+    outro_processo.close()
+
+def test_escrita_em_armazem_nao_trava_banco_principal(tmp_path):
+    """Testa que a escrita só no arquivo de um armazém não depende do lock de escrita do banco principal."""
+    import sqlite3
+    caminho = str(tmp_path / 'inventario.db')
+    app = create_app({'DATABASE': caminho, 'RESERVAS_VARREDURA_SEGUNDOS': 0,
+                      'SQLITE_BUSY_TIMEOUT_MS': 20, 'SQLITE_TENTATIVAS_ESCRITA': 1})
+    client = app.test_client()
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 0}), content_type='application/json').get_json()['id']
+    client.post('/armazens', data=json.dumps({"codigo": "norte", "nome": "Norte"}), content_type='application/json')
+
+    outro_processo = sqlite3.connect(caminho)
+    outro_processo.execute('BEGIN IMMEDIATE')
+    try:
+        response = client.post(f'/produtos/{produto_id}/estoque/norte', data=json.dumps({"tipo": "entrada", "quantidade": 3}), content_type='application/json')
+        assert response.status_code == 200
+        assert response.get_json()['quantidade'] == 3
+        # A escrita no principal, ao contrário, espera pelo lock e desiste com 503
+        response = client.post(f'/produtos/{produto_id}/estoque/principal', data=json.dumps({"tipo": "entrada", "quantidade": 1}), content_type='application/json')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == "1"
+        assert response.get_json()['erro'] == "Banco de dados ocupado. Tente novamente em instantes."
+    finally:
+        outro_processo.rollback()
+        outro_processo.close()
+
+def test_cache_percebe_escritas_de_outros_processos(tmp_path):
+    """Testa que o cache descarta produtos alterados diretamente no banco por outro processo."""
+    import sqlite3
+    import time
+    caminho = str(tmp_path / 'inventario.db')
+    app = create_app({'DATABASE': caminho, 'RESERVAS_VARREDURA_SEGUNDOS': 0, 'CACHE_PRODUTOS_SINCRONIZACAO_MS': 10})
+    client = app.test_client()
+    produto_id = client.post('/produtos', data=json.dumps({"nome": "Cabo", "categoria": "Cabos", "preco_unitario": 5, "quantidade_inicial": 1}), content_type='application/json').get_json()['id']
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 1
+
+    outro_processo = sqlite3.connect(caminho)
+    with outro_processo:
+        outro_processo.execute('UPDATE produtos SET quantidade = 7 WHERE id = ?', (produto_id,))
+    outro_processo.close()
+    time.sleep(0.02)
+    assert client.get(f'/produtos/{produto_id}').get_json()['quantidade'] == 7
@@ -0,0 +1,29 @@
+# tests/test_benchmark.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import bench_api
+
+
+def test_benchmark_executa_todas_as_rotas():
+    """Executa o benchmark com um catálogo mínimo para garantir que continua funcionando."""
+    diretorio = os.getcwd()
+    relatorio = bench_api.executar(produtos=200, requisicoes=2)
+
+    assert os.getcwd() == diretorio
+    assert set(relatorio['rotas']) == {nome for nome, _, _ in bench_api.cenarios(200)}
+    assert all(rota['erros'] == 0 for rota in relatorio['rotas'].values())
+    assert relatorio['rotas']['GET /produtos/<id>']['p50_ms'] > 0
+
+
+def test_benchmark_compara_execucoes():
+    """Testa a detecção de regressões entre duas execuções."""
+    anterior = {"rotas": {"GET /produtos": {"p95_ms": 10.0, "vazao_rps": 100.0}}}
+    atual = {"rotas": {"GET /produtos": {"p95_ms": 10.5, "vazao_rps": 80.0}}}
+
+    regressoes = bench_api.comparar(atual, anterior, tolerancia=0.10)
+    assert regressoes == ["GET /produtos: vazão 100.0 -> 80.0 req/s"]
+    assert bench_api.percentil([1, 2, 3, 4], 50) == 2
@@ -0,0 +1,61 @@
+"""
+Varredura periódica das reservas de estoque vencidas.
+
+Uma thread por aplicação acorda a cada intervalo e libera as reservas ativas
+cujo prazo passou, em lotes de até `lote` reservas por transação, até não
+restar nenhuma vencida. A thread guarda só uma referência fraca à aplicação
+e termina quando ela deixa de existir ou quando `encerrar` é chamado.
+"""
+import logging
+import sqlite3
+import threading
+import weakref
+
+from models import liberar_reservas_expiradas
+
+logger = logging.getLogger('inventario.reservas')
+
+
+class VarredorReservas:
+    """Thread que libera as reservas vencidas em lotes."""
+
+    def __init__(self, app, intervalo=5.0, lote=500):
+        self._app = weakref.ref(app)
+        self.intervalo = intervalo
+        self.lote = lote
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar_laco, name='varredor-reservas', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def encerrar(self, timeout=None):
+        """Interrompe a varredura, esperando o lote em andamento terminar."""
+        self._parar.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def varrer(self, app):
+        """Libera todas as reservas vencidas, um lote por transação. Retorna o total liberado."""
+        total = 0
+        with app.app_context():
+            while not self._parar.is_set():
+                liberadas = liberar_reservas_expiradas(self.lote)
+                total += liberadas
+                if liberadas < self.lote:
+                    break
+        return total
+
+    def _executar_laco(self):
+        while not self._parar.wait(self.intervalo):
+            app = self._app()
+            if app is None:
+                return
+            try:
+                liberadas = self.varrer(app)
+            except sqlite3.Error:
+                logger.exception("Falha ao liberar reservas expiradas")
+            else:
+                if liberadas:
+                    logger.info("%d reserva(s) expirada(s) liberada(s)", liberadas)
+            del app
@@ -3,7 +3,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from functools import wraps # Importa wraps para criar o decorator
 from models import (
     listar_produtos, obter_produto_por_id, criar_produto, 
-    atualizar_produto, remover_produto, registrar_operacao_estoque
+    atualizar_produto, remover_produto, registrar_operacao_estoque,
+    listar_movimentacoes, resumo_estoque, listar_produtos_baixo_estoque, ultima_mudanca
 )
 
 web_routes = Blueprint('web', __name__, template_folder='templates')
@@ -46,9 +47,12 @@ def logout():
 @web_routes.route("/")
 @login_required
 def index():
-    # ... (código existente sem alteração)
-    produtos = listar_produtos()
-    return render_template("index.html", produtos=produtos)
+    # Filtro ?baixo_estoque=1 usa o índice parcial em vez de filtrar a lista completa
+    baixo_estoque = request.args.get("baixo_estoque") == "1"
+    produtos = listar_produtos_baixo_estoque() if baixo_estoque else listar_produtos()
+    # A página acompanha as mudanças posteriores a esta sequência via SSE
+    return render_template("index.html", produtos=produtos, resumo=resumo_estoque(), baixo_estoque=baixo_estoque,
+                           ultimo_seq=ultima_mudanca())
 
 @web_routes.route("/produto/novo", methods=["GET", "POST"])
 @login_required
@@ -59,7 +63,8 @@ def novo_produto():
             "nome": request.form.get("nome"),
             "categoria": request.form.get("categoria"),
             "preco_unitario": float(request.form.get("preco_unitario")),
-            "quantidade_inicial": int(request.form.get("quantidade_inicial"))
+            "quantidade_inicial": int(request.form.get("quantidade_inicial")),
+            "estoque_minimo": int(request.form.get("estoque_minimo") or 0)
         }
         produto, erro = criar_produto(dados)
         if erro:
@@ -80,7 +85,8 @@ def detalhe_produto(produto_id):
     if not produto:
         flash("Produto não encontrado.", "warning")
         return redirect(url_for("web.index"))
-    return render_template("produto_detalhe.html", produto=produto)
+    movimentacoes = listar_movimentacoes(produto_id, limite=20, decrescente=True)
+    return render_template("produto_detalhe.html", produto=produto, movimentacoes=movimentacoes)
 
 @web_routes.route("/produto/<int:produto_id>/editar", methods=["GET", "POST"])
 @login_required
@@ -95,7 +101,8 @@ def editar_produto(produto_id):
         dados = {
             "nome": request.form.get("nome"),
             "categoria": request.form.get("categoria"),
-            "preco_unitario": float(request.form.get("preco_unitario"))
+            "preco_unitario": float(request.form.get("preco_unitario")),
+            "estoque_minimo": int(request.form.get("estoque_minimo") or 0)
         }
         produto_atualizado, erro = atualizar_produto(produto_id, dados)
         if erro:
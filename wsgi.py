@@ -0,0 +1,17 @@
+"""
+Ponto de entrada WSGI para produção (Gunicorn, uWSGI, mod_wsgi...):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+A configuração vem das variáveis de ambiente INVENTARIO_* (veja create_app).
+Com vários workers a chave secreta precisa ser a mesma em todos, então aqui
+ela é obrigatória.
+"""
+import os
+
+from app import create_app
+
+if not os.environ.get('INVENTARIO_SECRET_KEY'):
+    raise RuntimeError("Defina INVENTARIO_SECRET_KEY para executar em produção.")
+
+app = create_app()